@@ -1,6 +1,26 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
 class NavigatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'navigator'
+
+    def ready(self):
+        # Pick up trees prebuilt by `manage.py build_graph_artifacts`
+        from .graph_utils import preload_artifacts, start_background_loading
+        from .sparql_registry import load_prepared_queries
+        from .sparql_pool import WORKER_ENV
+        preload_artifacts()
+        # Parse and algebrize the bundled .sparql files off the request path
+        load_prepared_queries()
+
+        # Only server processes load the graphs up front; WSGI and ASGI servers do it
+        # from wsgi.py / asgi.py, and other commands (migrate, test, benchmark, ...) never.
+        # Under runserver only the autoreloaded child (RUN_MAIN) serves requests.
+        # SPARQL pool workers inherit the runserver environment but never reason themselves.
+        if 'runserver' in sys.argv and not os.environ.get(WORKER_ENV):
+            if os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv:
+                start_background_loading()
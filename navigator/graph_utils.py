@@ -1,468 +1,1267 @@
 import rdflib
 from rdflib.namespace import RDF, RDFS, OWL
 import os
+import collections
+import hashlib
+import itertools
+import json
+import logging
+import re
 import owlready2
 import tempfile
+import threading
+import time
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.evaluate import _fillTemplate, evalPart, evalQuery
+from rdflib.plugins.sparql.sparql import QueryContext
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, ontologies, sparql_pool, stores
+from .reasoning import RuleMaterializer, materialize
+from .hierarchy import HierarchyIndex
+from .search import SearchIndex
+from .similarity import SimilarityIndex
+from .registry import GraphRegistry, NOT_LOADED, LOADING
+
+logger = logging.getLogger(__name__)
 
 # Global cache for graphs
-_ASSERTED_GRAPH = None
-_INFERRED_GRAPH = None
+graphs = GraphRegistry()
+ASSERTED = 'asserted'
+INFERRED = 'inferred'
+# Named graph holding the reasoner output in the inferred dataset
+INFERRED_GRAPH = rdflib.URIRef('urn:rgo:graph:inferred')
 
-def load_graph(inferred=False):
-    global _ASSERTED_GRAPH, _INFERRED_GRAPH
-    
-    
-    # Path to ontology
-    ontology_path = r'd:/ashish/webapp/ritualgrammar_marriage/ontology/ritualgrammar.ttl'
-    print("Graph Loaded")
-    # Load asserted graph if not loaded
-    if _ASSERTED_GRAPH is None:
-        _ASSERTED_GRAPH = rdflib.Graph()
-        # Parse using rdflib for the asserted view
-        _ASSERTED_GRAPH.parse(ontology_path, format='turtle')
-        
+# Per-process caches of graph versions and prebuilt artifacts
+_GRAPH_VERSIONS = {}
+_ARTIFACTS = {}
+_INDEXES = {}
+
+# In-process edits (see update_graph): the rule materializer and the time of the last edit
+_EDITS = {'lock': threading.Lock(), 'materializer': None, 'last_modified': 0}
+# Locks held by parent threads would never be released in a forked pool worker
+os.register_at_fork(after_in_child=lambda: _EDITS.update(lock=threading.Lock()))
+
+CRM = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
+SKOS = rdflib.Namespace("http://www.w3.org/2004/02/skos/core#")
+# Root of the events tree
+RITUAL_ROOT = rdflib.URIRef("https://www.ritualgrammar.org/ontology/Ritual")
+
+# Axioms injected before reasoning. They are part of the inference fingerprint,
+# so editing these lists invalidates any inferred snapshot on disk.
+TRANSITIVE_PROPERTIES = [CRM.P9_consists_of, CRM.P10i_contains, CRM.P10_falls_within, CRM.P9i_forms_part_of, SKOS.broader, CRM.P127_has_broader_term]
+SUBPROPERTY_AXIOMS = [
+    (CRM.P9_consists_of, CRM.P10i_contains),
+    (CRM.P9i_forms_part_of, CRM.P10_falls_within),
+]
+PROPERTY_CHAINS = [
+    # P2_has_type o broader -> P2_has_type
+    (CRM.P2_has_type, [CRM.P2_has_type, SKOS.broader]),
+]
+
+# Bump when the snapshot layout changes
+SNAPSHOT_FORMAT = 1
+
+
+def get_cache_dir():
+    """RGO_CACHE_DIR: inference snapshot, artifacts, parsed imports and graph stores."""
+    return str(getattr(settings, 'RGO_CACHE_DIR', os.path.join(settings.BASE_DIR, '.graph_cache')))
+
+
+HERMIT = 'hermit'
+RULES = 'rules'
+
+
+def inference_engine():
+    """RGO_INFERENCE_ENGINE: 'hermit' (owlready2 + HermiT, needs Java) or 'rules' (pure Python)."""
+    engine = getattr(settings, 'RGO_INFERENCE_ENGINE', HERMIT)
+    if engine not in (HERMIT, RULES):
+        raise ValueError(f"Unknown RGO_INFERENCE_ENGINE {engine!r}; use '{HERMIT}' or '{RULES}'")
+    return engine
+
+
+def inference_fingerprint():
+    """Hash of everything that determines the inferred graph."""
+    h = hashlib.sha256()
+    h.update(f"format={SNAPSHOT_FORMAT};owlready2={owlready2.VERSION}".encode())
+    h.update(f"engine={inference_engine()}".encode())
+    h.update(f"reason_over_imports={getattr(settings, 'RGO_REASON_OVER_IMPORTS', False)}".encode())
+    ontologies.inputs_digest(h)
+    h.update(repr((TRANSITIVE_PROPERTIES, SUBPROPERTY_AXIOMS, PROPERTY_CHAINS)).encode())
+    return h.hexdigest()
+
+
+def graph_version(inferred=False):
+    """Content version of the asserted or inferred graph.
+
+    The ontology only changes on deploy, so the hash is computed once per process.
+    """
+    key = INFERRED if inferred else ASSERTED
+    if key not in _GRAPH_VERSIONS:
+        if inferred:
+            _GRAPH_VERSIONS[key] = inference_fingerprint()
+        else:
+            _GRAPH_VERSIONS[key] = ontologies.inputs_digest(hashlib.sha256()).hexdigest()
+    return _GRAPH_VERSIONS[key]
+
+
+def graph_last_modified(inferred=False):
+    """Modification time (epoch seconds) of the newest input of the graph, or of the last edit.
+
+    The inferred graph also counts the time its snapshot was written: a new engine or
+    axiom list changes it without touching the ontology files.
+    """
+    times = [os.path.getmtime(p) for p in ontologies.input_files()] + [_EDITS['last_modified']]
+    if inferred:
+        try:
+            times.append(os.path.getmtime(_snapshot_path(graph_version(inferred=True))))
+        except OSError:
+            pass  # Not reasoned yet (or edited since); the inputs are all there is
+    return max(times)
+
+
+def _artifact_path(name, version):
+    return os.path.join(get_cache_dir(), f"{name}-{version[:16]}.json")
+
+
+def save_artifact(name, version, data):
+    path = _artifact_path(name, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.json', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _ARTIFACTS[(name, version)] = data
+    return path
+
+
+def load_artifact(name, version):
+    """Return a prebuilt artifact (see `manage.py build_graph_artifacts`) or None."""
+    key = (name, version)
+    if key not in _ARTIFACTS:
+        path = _artifact_path(name, version)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                _ARTIFACTS[key] = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable artifact %s: %s", path, e)
+            return None
+    return _ARTIFACTS[key]
+
+
+def reduce_hierarchy(inferred=False, reduce=None):
+    """Whether the navigation hierarchy is shown as its transitive reduction.
+
+    Only the inferred hierarchy is reduced; reduce=None follows RGO_REDUCE_INFERRED_HIERARCHY.
+    """
     if not inferred:
-        return _ASSERTED_GRAPH
-        
-    # Load/Compute inferred graph if not loaded
-    if _INFERRED_GRAPH is None:
-        print("Computing inferences with HermiT (via owlready2)... this may take a moment.")
-        
-        # Bridge: RDFLib (Turtle) -> RDF/XML -> Owlready2
-        # We process the graph to remove external imports that cause parsing errors (e.g., getting HTML instead of RDF)
-        
-        # Create a temporary graph to strip imports
-        g_for_inference = rdflib.Graph()
-        for triple in _ASSERTED_GRAPH:
+        return False
+    return getattr(settings, 'RGO_REDUCE_INFERRED_HIERARCHY', True) if reduce is None else reduce
+
+
+def _reduced_suffix(reduced):
+    return '-reduced' if reduced else ''
+
+
+EVENTS_DAG_ARTIFACT_NAME = 'navigation-events-dag'
+
+
+def navigation_dag_artifact_name(inferred=False, reduced=False):
+    return ('navigation-dag-inferred' if inferred else 'navigation-dag-asserted') + _reduced_suffix(reduced)
+
+
+def preload_artifacts():
+    try:
+        load_artifact(label_artifact_name(False), graph_version(False))
+        load_artifact(label_artifact_name(True), graph_version(True))
+        load_artifact(hierarchy_artifact_name(False), graph_version(False))
+        load_artifact(hierarchy_artifact_name(True), graph_version(True))
+        load_artifact(hierarchy_artifact_name(True, reduced=True), graph_version(True))
+        load_artifact(EVENTS_DAG_ARTIFACT_NAME, graph_version(True))
+        load_artifact(navigation_dag_artifact_name(False), graph_version(False))
+        load_artifact(navigation_dag_artifact_name(True), graph_version(True))
+        load_artifact(navigation_dag_artifact_name(True, reduced=True), graph_version(True))
+    except OSError as e:
+        logger.warning("Could not preload graph artifacts: %s", e)
+
+
+def _snapshot_path(fingerprint):
+    return os.path.join(get_cache_dir(), f"inferred-{fingerprint[:16]}.nt")
+
+
+def _load_inferred_snapshot(fingerprint):
+    path = _snapshot_path(fingerprint)
+    if not os.path.exists(path):
+        return None
+    g = rdflib.Graph()
+    try:
+        g.parse(path, format='nt')
+    except Exception as e:
+        logger.warning("Ignoring unreadable inferred snapshot %s: %s", path, e)
+        return None
+    return g
+
+
+def _save_inferred_snapshot(graph, fingerprint):
+    path = _snapshot_path(fingerprint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so other workers never read a half-written snapshot
+    fd, tmp_path = tempfile.mkstemp(suffix='.nt', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        graph.serialize(destination=tmp_path, format='nt', encoding='utf-8')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _reasoner_world(asserted_graph):
+    """owlready2 World holding asserted_graph plus the injected axioms, ready for HermiT."""
+    # Bridge: RDFLib (Turtle) -> RDF/XML -> Owlready2
+    # Imports were already resolved locally (see ontologies.reasoning_graph); owlready2 would
+    # otherwise try to fetch them from the web and fail (e.g., getting HTML instead of RDF)
+
+    # Create a temporary graph to strip imports
+    g_for_inference = rdflib.Graph()
+    with metrics.timed('strip_imports'):
+        for triple in asserted_graph:
             # Skip owl:imports assertions to prevent auto-fetching
             if triple[1] == OWL.imports:
                 continue
             g_for_inference.add(triple)
 
-        # FORCE Transitivity for P9, P10i, and broader hierarchy properties so Owlready2 picks it up
-        crm = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
-        skos = rdflib.Namespace("http://www.w3.org/2004/02/skos/core#")
-
-        # FORCE Transitivity for P9, P10i, and broader hierarchy properties so Owlready2 picks it up
-        crm = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
-        skos = rdflib.Namespace("http://www.w3.org/2004/02/skos/core#")
-
-        # Define them as ObjectProperty AND TransitiveProperty to be safe for ALL reasoners
-        # Also ensure P2_has_type is an ObjectProperty for the chain
-        targets_transitive = [crm.P9_consists_of, crm.P10i_contains, crm.P10_falls_within, crm.P9i_forms_part_of, skos.broader, crm.P127_has_broader_term]
-        for prop in targets_transitive:
-            g_for_inference.add((prop, RDF.type, OWL.ObjectProperty))
-            g_for_inference.add((prop, RDF.type, OWL.TransitiveProperty))
-            
-        g_for_inference.add((crm.P2_has_type, RDF.type, OWL.ObjectProperty))
-        
-        # LINK P9 and P10i for Mixed Transitivity
-        # By making P9 (consists of) a subProperty of P10i (contains), 
-        # a chain like A -P10i-> B -P9-> C becomes A -P10i-> B -P10i-> C
-        # Since P10i is transitive, this infers A -P10i-> C.
-        g_for_inference.add((crm.P9_consists_of, RDFS.subPropertyOf, crm.P10i_contains))
-        g_for_inference.add((crm.P9i_forms_part_of, RDFS.subPropertyOf, crm.P10_falls_within))
-        
-        # Create a temporary file for the RDF/XML representation
-        with tempfile.NamedTemporaryFile(suffix='.rdf', delete=False) as tmp:
-            g_for_inference.serialize(destination=tmp.name, format='xml')
-            tmp_path = tmp.name
-            
-        try:
-            # Load logic using Owlready2
-            world = owlready2.World()
-            # Use file URI protocol
-            onto = world.get_ontology(f"file://{tmp_path}").load()
-            
-            # Add Property Chain via Owlready2 API (Safer than manual RDF/XML injection)
-            # P2_has_type o broader -> P2_has_type
+    # FORCE Transitivity for P9, P10i, and broader hierarchy properties so Owlready2 picks it up
+    # Define them as ObjectProperty AND TransitiveProperty to be safe for ALL reasoners
+    for prop in TRANSITIVE_PROPERTIES:
+        g_for_inference.add((prop, RDF.type, OWL.ObjectProperty))
+        g_for_inference.add((prop, RDF.type, OWL.TransitiveProperty))
+
+    # Also ensure the chained properties are ObjectProperties
+    for prop, chain in PROPERTY_CHAINS:
+        for p in [prop] + chain:
+            g_for_inference.add((p, RDF.type, OWL.ObjectProperty))
+
+    # LINK P9 and P10i for Mixed Transitivity
+    # By making P9 (consists of) a subProperty of P10i (contains),
+    # a chain like A -P10i-> B -P9-> C becomes A -P10i-> B -P10i-> C
+    # Since P10i is transitive, this infers A -P10i-> C.
+    for sub, sup in SUBPROPERTY_AXIOMS:
+        g_for_inference.add((sub, RDFS.subPropertyOf, sup))
+
+    # Create a temporary file for the RDF/XML representation
+    with tempfile.NamedTemporaryFile(suffix='.rdf', delete=False) as tmp, metrics.timed('rdfxml_serialize'):
+        g_for_inference.serialize(destination=tmp.name, format='xml')
+        tmp_path = tmp.name
+
+    try:
+        # Load logic using Owlready2
+        world = owlready2.World()
+        # Use file URI protocol
+        with metrics.timed('owlready_load'):
+            world.get_ontology(f"file://{tmp_path}").load()
+
+        # Add Property Chain via Owlready2 API (Safer than manual RDF/XML injection)
+        for prop, chain in PROPERTY_CHAINS:
             try:
                 # Retrieve the properties from the loaded world
-                p2 = next(world.sparql("""SELECT ?p WHERE { ?p <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#ObjectProperty> . FILTER(STR(?p) = 'http://www.cidoc-crm.org/cidoc-crm/P2_has_type') }"""))[0]
-                broader = next(world.sparql("""SELECT ?p WHERE { ?p <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#ObjectProperty> . FILTER(STR(?p) = 'http://www.w3.org/2004/02/skos/core#broader') }"""))[0]
-                
-                # Define property chain: has_type o broader implies has_type
-                p2.property_chain.append(owlready2.PropertyChain([p2, broader]))
+                target = world[str(prop)]
+                links = [world[str(p)] for p in chain]
+                target.property_chain.append(owlready2.PropertyChain(links))
             except Exception as e:
-                print(f"Warning: Could not enable property chain inference: {e}")
-            
-            # Run HermiT reasoner
-            owlready2.sync_reasoner(world, infer_property_values=True)
-            
-            print("Inference complete. Converting to RDFLib graph...")
-            
-            # We need to bridge back to RDFLib. 
-            _INFERRED_GRAPH = world.as_rdflib_graph()
-            
-            # Bind the namespaces from the asserted graph for convenience (prefixes)
-            for prefix, namespace in _ASSERTED_GRAPH.namespaces():
-                _INFERRED_GRAPH.bind(prefix, namespace)
-                
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        
-    return _INFERRED_GRAPH
-
-def get_navigation_structure(inferred=False):
+                logger.warning("Could not enable property chain inference: %s", e)
+    finally:
+        # Clean up temp file
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return world
+
+
+def _compute_inferred_graph(asserted_graph):
+    logger.info("Computing inferences with HermiT (via owlready2)... this may take a moment.")
+    world = _reasoner_world(asserted_graph)
+
+    # Run HermiT reasoner
+    with metrics.timed('sync_reasoner'):
+        owlready2.sync_reasoner(world, infer_property_values=True)
+
+    logger.info("Inference complete. Converting to RDFLib graph...")
+
+    # We need to bridge back to RDFLib.
+    # Copy into a plain in-memory graph so it can outlive the owlready2 World
+    inferred = rdflib.Graph()
+    with metrics.timed('as_rdflib_graph'):
+        for triple in world.as_rdflib_graph():
+            inferred.add(triple)
+    return inferred
+
+
+@metrics.timed('rule_inference')
+def _compute_rule_inferences(asserted_graph):
+    logger.info("Computing inferences with the rule engine...")
+    start = time.perf_counter()
+    inferred = rdflib.Graph()
+    for triple in asserted_graph:
+        if triple[1] != OWL.imports:
+            inferred.add(triple)
+    derived = materialize(inferred, TRANSITIVE_PROPERTIES, SUBPROPERTY_AXIOMS, PROPERTY_CHAINS)
+    for triple in derived:
+        inferred.add(triple)
+    logger.info("Inference complete: %d triples derived in %.2fs", len(derived), time.perf_counter() - start)
+    return inferred
+
+
+def check_consistency():
+    """Full HermiT consistency check of the current asserted graph, edits included.
+
+    The rule materializer only maintains the navigation rules, so this is the way
+    to validate the ontology after edits. Returns {'consistent': bool,
+    'unsatisfiable_classes': [IRIs]}; unsatisfiable classes alone do not make
+    the ontology inconsistent.
+    """
+    world = _reasoner_world(ontologies.reasoning_graph(load_graph(inferred=False)))
+    try:
+        owlready2.sync_reasoner(world, infer_property_values=False)
+    except owlready2.OwlReadyInconsistentOntologyError:
+        return {'consistent': False, 'unsatisfiable_classes': []}
+    unsatisfiable = sorted(c.iri for c in world.inconsistent_classes() if hasattr(c, 'iri'))
+    return {'consistent': True, 'unsatisfiable_classes': unsatisfiable}
+
+
+def _load_asserted_graph():
+    # With a persistent RGO_GRAPH_STORE the ontologies are only parsed when the store is first built
+    with metrics.timed('graph_load'):
+        graph = stores.open_graph(ASSERTED, graph_version(inferred=False), ontologies.load_dataset)
+    logger.info("Asserted graph loaded: %d triples", len(graph))
+    return graph
+
+
+class GraphNotReady(RuntimeError):
+    """The inferred graph has not been built yet and this process may not build it."""
+    error_code = 'not_ready'
+
+
+def _build_inferred_graph():
+    asserted = load_graph(inferred=False)
+
+    # Reuse the materialized triples from disk unless the inputs have changed
+    fingerprint = graph_version(inferred=True)
+    inferences = _load_inferred_snapshot(fingerprint)
+    if inferences is None:
+        if os.environ.get(sparql_pool.WORKER_ENV):
+            # Workers only open what the server process built; they never reason themselves
+            raise GraphNotReady("The inferred graph is still being built; please retry.")
+        compute = _compute_rule_inferences if inference_engine() == RULES else _compute_inferred_graph
+        inferences = compute(ontologies.reasoning_graph(asserted))
+        try:
+            _save_inferred_snapshot(inferences, fingerprint)
+        except OSError as e:
+            logger.warning("Could not write inferred snapshot: %s", e)
+
+    # The asserted named graphs (and their prefixes) plus one graph with the reasoner output
+    graph = ontologies.copy_dataset(asserted)
+    context = graph.graph(INFERRED_GRAPH)
+    context.addN((s, p, o, context) for s, p, o in inferences)
+    return graph
+
+
+def _load_inferred_graph():
+    with metrics.timed('inferred_graph_load'):
+        graph = stores.open_graph(INFERRED, graph_version(inferred=True), _build_inferred_graph)
+    logger.info("Inferred graph loaded: %d triples", len(graph))
+    return graph
+
+
+def load_graph(inferred=False):
+    # Concurrent first callers share a single load; see GraphRegistry
+    if not inferred:
+        return graphs.get(ASSERTED, _load_asserted_graph)
+    return graphs.get(INFERRED, _load_inferred_graph)
+
+
+def start_asserted_load():
+    """Kick off the asserted graph load without blocking the caller."""
+    return graphs.start(ASSERTED, _load_asserted_graph)
+
+
+def start_background_reasoning():
+    """Kick off the inferred graph load (and reasoner run) without blocking the caller."""
+    return graphs.start(INFERRED, _load_inferred_graph)
+
+
+def start_background_loading():
+    """Start loading the graphs as a server process comes up, so requests don't wait for them.
+
+    Called from wsgi.py / asgi.py and, under runserver, from the app config; never
+    from other management commands. The asserted graph always loads; the reasoner
+    only runs with RGO_BACKGROUND_REASONING.
+    """
+    start_asserted_load()
+    if getattr(settings, 'RGO_BACKGROUND_REASONING', True):
+        start_background_reasoning()
+
+
+def inferred_graph_ready():
+    return graphs.is_ready(INFERRED)
+
+
+def reasoning_in_progress():
+    return graphs.state(INFERRED) in (NOT_LOADED, LOADING)
+
+
+def graph_status():
+    """Readiness of the asserted and inferred graphs, for the health endpoint."""
+    return graphs.status([ASSERTED, INFERRED])
+
+
+def reset():
+    """Drop the loaded graphs, versions, artifacts and indexes held by this process.
+
+    The next call loads everything again from the current settings; used by the
+    benchmark command to start each ontology size cold.
+    """
+    graphs.reset()
+    sparql_pool.shutdown()
+    for cache in (_GRAPH_VERSIONS, _ARTIFACTS, _INDEXES):
+        cache.clear()
+    _EDITS['materializer'] = None
+    _EDITS['last_modified'] = 0
+
+
+def _get_materializer(asserted):
+    if _EDITS['materializer'] is None:
+        # Same input and rules as the rule engine, so edits agree with a full recompute
+        _EDITS['materializer'] = RuleMaterializer.from_graph(
+            ontologies.reasoning_graph(asserted), TRANSITIVE_PROPERTIES, SUBPROPERTY_AXIOMS, PROPERTY_CHAINS)
+    return _EDITS['materializer']
+
+
+def _bump_versions(added, removed):
+    # Derive new versions from the old ones and the edit, so every cache and
+    # artifact keyed by graph version is bypassed from now on
+    edit = '\n'.join(sorted(f"+{' '.join(t.n3() for t in triple)}" for triple in added) +
+                     sorted(f"-{' '.join(t.n3() for t in triple)}" for triple in removed))
+    for key, inferred in ((ASSERTED, False), (INFERRED, True)):
+        previous = graph_version(inferred)
+        _GRAPH_VERSIONS[key] = hashlib.sha256(f"{previous}\n{edit}".encode()).hexdigest()
+    _EDITS['last_modified'] = time.time()
+    # Nothing asks for the old versions again; keeping their indexes would hold
+    # another full set in memory per edit
+    current = set(_GRAPH_VERSIONS.values())
+    for cache in (_ARTIFACTS, _INDEXES):
+        for key in list(cache):
+            if key[-1] not in current:
+                cache.pop(key, None)
+
+
+def has_edits():
+    return _EDITS['last_modified'] > 0
+
+
+def _editable_graphs():
+    """The loaded asserted and inferred graphs, as in-memory copies if they live in a store.
+
+    Persistent stores are shared by all workers and read-only, so the first edit
+    swaps them for copies that only this process sees.
+    """
+    asserted, inferred = load_graph(inferred=False), load_graph(inferred=True)
+    if stores.is_persistent(asserted):
+        # owlready2 keeps no named graphs; read them from the files again
+        copy = ontologies.copy_dataset(asserted) if isinstance(asserted, rdflib.Dataset) else ontologies.load_dataset()
+        graphs.replace(ASSERTED, copy)
+        asserted = copy
+    if stores.is_persistent(inferred):
+        copy = ontologies.copy_dataset(asserted)
+        context = copy.graph(INFERRED_GRAPH)
+        context.addN((s, p, o, context) for s, p, o in inferred.triples((None, None, None)) if (s, p, o) not in asserted)
+        graphs.replace(INFERRED, copy)
+        inferred = copy
+    return asserted, inferred
+
+
+def update_graph(added=(), removed=(), graph=None):
+    """Add and remove asserted triples, updating the inferred graph incrementally.
+
+    `graph` names the named graph to edit (default: the first root ontology). The
+    rule engine's inferences (transitive, subproperty, inverse, chain and subclass
+    rules) are maintained by the rule materializer instead of rerunning the reasoner,
+    so with RGO_INFERENCE_ENGINE = 'rules' the result equals a full recompute. Other
+    HermiT inferences are left as they are (run check_consistency() to validate
+    the result). Edits live in this process and its forked SPARQL workers only and
+    are lost on restart. Returns the change to the inferred triples:
+    {'added': [triples], 'removed': [triples]}.
+    """
+    with _EDITS['lock']:
+        # The edit is applied on top of the reasoner output, so that has to exist first
+        asserted, inferred = _editable_graphs()
+        materializer = _get_materializer(asserted)
+
+        name = rdflib.URIRef(graph) if graph else ontologies.default_graph_name()
+        target = asserted.graph(name) if isinstance(asserted, rdflib.Dataset) else asserted
+        added = [t for t in added if t not in target]
+        removed = [t for t in removed if t in target]
+        if not added and not removed:
+            return {'added': [], 'removed': []}
+
+        for dataset in (asserted, inferred):
+            context = dataset.graph(name) if isinstance(dataset, rdflib.Dataset) else dataset
+            for triple in removed:
+                context.remove(triple)
+            for triple in added:
+                context.add(triple)
+
+        if name not in ontologies.reasoned_graph_names():
+            # The reasoner never sees this graph (an import), so nothing is derived from it
+            delta = {'added': set(), 'removed': set()}
+        elif any(RuleMaterializer.is_axiom(t) for t in added + removed):
+            # The rules themselves changed; start over from the edited graph
+            before = materializer.facts
+            _EDITS['materializer'] = None
+            materializer = _get_materializer(asserted)
+            delta = {'added': materializer.facts - before, 'removed': before - materializer.facts}
+        else:
+            # A triple asserted in another reasoned graph as well is still asserted
+            reasoned = [asserted.graph(n) for n in ontologies.reasoned_graph_names()]
+            delta = materializer.apply(added=added,
+                                       removed=[t for t in removed if not any(t in g for g in reasoned)])
+
+        inferences = inferred.graph(INFERRED_GRAPH) if isinstance(inferred, rdflib.Dataset) else inferred
+        for triple in delta['removed']:
+            inferences.remove(triple)
+        for triple in removed:
+            # The reasoner output echoes its input; drop removed triples unless still derived
+            if not materializer.holds(triple) and triple not in asserted:
+                inferences.remove(triple)
+        for triple in delta['added']:
+            if triple not in asserted:
+                inferences.add(triple)
+
+        _bump_versions(added, removed)
+        # Pool workers hold copies of the old graphs; new (forked) workers see the edit
+        sparql_pool.shutdown()
+        return {'added': sorted(delta['added']), 'removed': sorted(delta['removed'])}
+
+
+# Display label sources, in order of preference
+LABEL_PREDICATES = [SKOS.altLabel, SKOS.prefLabel, RDFS.label]
+
+
+def local_name(uri):
+    uri = str(uri)
+    return uri.split('#')[-1] if '#' in uri else uri.rstrip('/').split('/')[-1]
+
+
+def _language_rank(literal, languages):
+    lang = (getattr(literal, 'language', None) or '').lower()
+    for rank, preferred in enumerate(languages):
+        if lang == preferred or (preferred and lang.startswith(preferred + '-')):
+            return rank
+    return len(languages)
+
+
+def label_artifact_name(inferred=False):
+    return 'labels-inferred' if inferred else 'labels-asserted'
+
+
+def get_label_index(inferred=False):
+    """{uri: display label} for every labelled entity, built once per graph version.
+
+    Follows altLabel -> prefLabel -> rdfs:label, picking the literal whose language
+    comes first in RGO_LABEL_LANGUAGES. Use label_for() to fall back to the local name.
+    """
+    name, version = label_artifact_name(inferred), graph_version(inferred)
+    index = load_artifact(name, version)
+    if index is None:
+        index = _ARTIFACTS[(name, version)] = build_label_index(inferred=inferred)
+    return index
+
+
+@metrics.timed('label_index')
+def build_label_index(inferred=False):
     g = load_graph(inferred=inferred)
-    
-    crm = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
-    skos = rdflib.Namespace("http://www.w3.org/2004/02/skos/core#")
-    
-    entities = {}
-    
-    def get_label(entity_uri):
-        alt_label = g.value(entity_uri, skos.altLabel)
-        if alt_label: return str(alt_label)
-        pref_label = g.value(entity_uri, skos.prefLabel)
-        if pref_label: return str(pref_label)
-        label = g.value(entity_uri, RDFS.label)
-        if label: return str(label)
-        return str(entity_uri).split('#')[-1]
-
-    # Pre-scan entities that have labels
-    labeled_entities = set()
-    for s in g.subjects(unique=True):
-        if (s, skos.altLabel, None) in g or (s, skos.prefLabel, None) in g or (s, RDFS.label, None) in g:
-            labeled_entities.add(s)
-            entities[s] = {'id': str(s), 'label': get_label(s), 'children': [], 'parents': []}
-           
-    # relevant_predicates
-    relevant_predicates = {
-        crm.P10_falls_within, crm.P9i_forms_part_of, 
-        crm.P10i_contains, crm.P9_consists_of,
-        skos.broader, crm.P127_has_broader_term
-        
-    }
-    
-    for s, p, o in g:
-        if p in relevant_predicates:
-            if s not in labeled_entities or o not in labeled_entities:
+    languages = [l.lower() for l in getattr(settings, 'RGO_LABEL_LANGUAGES', ['en', ''])]
+
+    best = {}  # uri -> (predicate rank, language rank, label)
+    for predicate_rank, predicate in enumerate(LABEL_PREDICATES):
+        for s, o in g.subject_objects(predicate):
+            if not str(o):
                 continue
-                
-            is_parent_child_direction = (p == crm.P10i_contains or p == crm.P9_consists_of)
-            parent = s if is_parent_child_direction else o
-            child = o if is_parent_child_direction else s
-            
-            if child not in entities[parent]['children']:
-                entities[parent]['children'].append(entities[child])
-            if parent not in entities[child]['parents']:
-                entities[child]['parents'].append(entities[parent])
-    
-    # Standard Root Finding (No strict filtering, restoring original behavior)
-    roots = []
-    for s, data in entities.items():
-        if not data['parents'] and data['children']:
-             roots.append(data)
-    
-    # Fallback
-    if not roots:
-        for s, data in entities.items():
-            if data['children']:
-                roots.append(data)
-
-    # Serialize
-    def serialize(node, visited=None):
-        if visited is None: visited = set()
-        if node['id'] in visited:
-            return {'id': node['id'], 'label': node['label'], 'children': []}
-        visited.add(node['id'])
-        
-        children_list = []
-        for child in node['children']:
-             children_list.append(serialize(child, visited.copy()))
-        
-        children_list.sort(key=lambda x: x['label'])
-             
-        return {
-            'id': node['id'],
-            'label': node['label'],
-            'children': children_list
-        }
-    unique_roots = {}
-    for root in roots:
-        unique_roots[root["id"]] = root
+            candidate = (predicate_rank, _language_rank(o, languages), str(o))
+            key = str(s)
+            if key not in best or candidate < best[key]:
+                best[key] = candidate
+    return {uri: candidate[2] for uri, candidate in best.items()}
 
-   
-    
-    serialized_roots = [serialize(root) for root in roots]
-    
-    return serialized_roots
 
-def get_event_navigation_structure(inferred=False):
+def label_for(labels, uri):
+    return labels.get(str(uri)) or local_name(uri)
+
+
+# Hierarchy predicates used by the navigation tree
+NAVIGATION_PREDICATES = {
+    CRM.P10_falls_within, CRM.P9i_forms_part_of,
+    CRM.P10i_contains, CRM.P9_consists_of,
+    SKOS.broader, CRM.P127_has_broader_term,
+}
+# For these the subject is the parent; for the rest the object is
+PARENT_TO_CHILD_PREDICATES = {CRM.P10i_contains, CRM.P9_consists_of}
+
+
+def hierarchy_artifact_name(inferred=False, reduced=False):
+    return ('hierarchy-inferred' if inferred else 'hierarchy-asserted') + _reduced_suffix(reduced)
+
+
+def get_hierarchy_index(inferred=False, reduce=None):
+    """Parent/child index of the navigation tree (a HierarchyIndex), built once per graph version.
+
+    With the inferred graph every ancestor reached through a transitive property is
+    a direct parent; the reduced index keeps only the Hasse-diagram edges and lists
+    the dropped ones as implied parents.
+    """
+    reduced = reduce_hierarchy(inferred, reduce)
+    name, version = hierarchy_artifact_name(inferred, reduced), graph_version(inferred)
+    key = (name, version)
+    if key not in _INDEXES:
+        data = load_artifact(name, version)
+        if data is not None:
+            _INDEXES[key] = HierarchyIndex.from_dict(data)
+        elif reduced:
+            _INDEXES[key] = get_hierarchy_index(inferred=inferred, reduce=False).reduced()
+        else:
+            _INDEXES[key] = build_hierarchy_index(inferred=inferred)
+    return _INDEXES[key]
+
+
+@metrics.timed('hierarchy_index')
+def build_hierarchy_index(inferred=False):
+    g = load_graph(inferred=inferred)
+    # Only labelled entities take part in the tree
+    labels = get_label_index(inferred=inferred)
+
+    def edges():
+        for p in NAVIGATION_PREDICATES:
+            for s, o in g.subject_objects(p):
+                s, o = str(s), str(o)
+                if s in labels and o in labels:
+                    yield (s, o) if p in PARENT_TO_CHILD_PREDICATES else (o, s)
+
+    return HierarchyIndex.from_edges(edges(), labels.__getitem__)
+
+
+def _implied_parents(index, i):
+    # Inferred memberships dropped by the transitive reduction, as annotations
+    implied = index.implied_parents(i)
+    return {'inferred_parents': [index.uris[p] for p in implied]} if len(implied) else {}
+
+
+def _index_node(index, i):
+    return {
+        'id': index.uris[i],
+        'label': index.labels[i],
+        'child_count': index.child_count(i),
+        **_implied_parents(index, i),
+    }
+
+
+def get_navigation_roots(inferred=False, reduce=None):
+    """Top-level nodes with child counts; children are fetched on demand."""
+    index = get_hierarchy_index(inferred=inferred, reduce=reduce)
+    return [_index_node(index, i) for i in index.roots]
+
+
+def get_navigation_children(node_id, inferred=False, offset=0, limit=None, reduce=None):
+    """One page of a node's children, sorted by label."""
+    index = get_hierarchy_index(inferred=inferred, reduce=reduce)
+    i = index.id_of(node_id)
+    child_ids = index.children(i) if i is not None else []
+    page = child_ids[offset:offset + limit] if limit is not None else child_ids[offset:]
+    return {
+        'id': node_id,
+        'total': len(child_ids),
+        'offset': offset,
+        'children': [_index_node(index, c) for c in page],
+        'next_offset': offset + len(page) if offset + len(page) < len(child_ids) else None,
+    }
+
+
+@metrics.timed('event_hierarchy')
+def build_event_hierarchy(inferred=False):
+    """Events under their most specific types, up the asserted type hierarchy to rg:Ritual.
+
+    Returns (HierarchyIndex, set of event URIs).
+    """
     # We need both graphs:
     # Inferred: To find the Events (which might be inferred) and their connection to Types (P2).
     # Asserted: To traverse the Type Hierarchy (skos:broader) without transitive shortcuts.
-    g_inferred = load_graph(inferred=True)
+    # With inferred=False (reasoning not finished yet) the asserted graph stands in for both.
+    g_inferred = load_graph(inferred=inferred)
     g_asserted = load_graph(inferred=False)
     
     crm = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
     skos = rdflib.Namespace("http://www.w3.org/2004/02/skos/core#")
-    rg_ritual = rdflib.URIRef("https://www.ritualgrammar.org/ontology/Ritual")
-    
-    # 1. Identify all Events from Inferred Graph
+    rg_ritual = RITUAL_ROOT
+
+    asserted_labels = get_label_index(inferred=False)
+    inferred_labels = get_label_index(inferred=inferred)
+
+    # Asserted type hierarchy, integer-encoded, for walking up from the leaf types.
+    # Nothing is walked above rg:Ritual, so its own broader links are left out.
+    types = HierarchyIndex.from_edges(
+        ((str(o), str(s)) for s, o in g_asserted.subject_objects(skos.broader) if s != rg_ritual),
+        lambda uri: label_for(asserted_labels, uri))
+    up_to_ritual = types.ancestor_bitsets()
+
+    # Broader closure as it stands in the inferred graph, as ancestor bitsets
+    concepts = HierarchyIndex.from_edges(
+        ((str(o), str(s)) for s, o in g_inferred.subject_objects(skos.broader)), str)
+    ancestors = concepts.ancestor_bitsets()
+
+    # 1. Identify all Events from Inferred Graph, with all their types (Inferred)
     target_events = set(g_inferred.subjects(RDF.type, crm.E5_Event))
-    
-    tree_map = {} # parent_uri -> set(child_uri)
-    nodes_data = {} # uri -> {'id': ..., 'label': ...}
-    
-    def get_label(entity_uri, g_source):
-        alt = g_source.value(entity_uri, skos.altLabel)
-        if alt: return str(alt)
-        pref = g_source.value(entity_uri, skos.prefLabel)
-        if pref: return str(pref)
-        lbl = g_source.value(entity_uri, RDFS.label)
-        if lbl: return str(lbl)
-        return str(entity_uri).split('#')[-1]
-
-    # Pre-populate Root
-    nodes_data[str(rg_ritual)] = {'id': str(rg_ritual), 'label': get_label(rg_ritual, g_asserted), 'children': []}
-    #print(nodes_data[str(rg_ritual)])
-    relationships = set()
-    
-    for event in target_events:
-        # Get all types of this event (Inferred)
-        all_types = set(g_inferred.objects(event, crm.P2_has_type))
-        if not all_types: continue
-        
+    event_types = {}
+    for event, t in g_inferred.subject_objects(crm.P2_has_type):
+        if event in target_events:
+            event_types.setdefault(event, set()).add(t)
+
+    edges = set()  # (parent uri, child uri)
+    events = set()
+    walked = 0  # bitset of type ids whose asserted parents are linked
+
+    for event, all_types in event_types.items():
         # 2. Filter for Most Specific Types only
-        # Strategy: If T1 is broader than T2, we discard T1. 
-        # But we must check this relationship in the Inferred Graph where broader logic is complete.
-        
-        most_specific_types = set(all_types)
-        for t1 in all_types:
-            for t2 in all_types:
-                if t1 == t2: continue
-                # if t2 is narrower than t1 (i.e., t2 has broader t1)
-                # In Inferred graph, this triple (t2, broader, t1) exists transitively
-                if (t2, skos.broader, t1) in g_inferred:
-                    if t1 in most_specific_types:
-                        most_specific_types.remove(t1)
+        # Strategy: If T1 is broader than T2, we discard T1: drop every type that is
+        # an ancestor of another type of the event, in one OR over their bitsets.
+        ids = {t: concepts.id_of(t) for t in all_types}
+        covered = 0
+        for i in ids.values():
+            if i is not None:
+                covered |= ancestors[i]
+        most_specific_types = [t for t, i in ids.items() if i is None or not covered >> i & 1]
 
         # 3. Build Tree upward from Specific Types using ASSERTED hierarchy
         event_str = str(event)
-        nodes_data[event_str] = {'id': event_str, 'label': get_label(event, g_inferred), 'children': [], 'is_event': True}
-        
+        events.add(event_str)
+
         for leaf_type in most_specific_types:
-            leaf_str = str(leaf_type)
-            
             # Link Event to Leaf Type
-            if (leaf_str, event_str) not in relationships:
-                relationships.add((leaf_str, event_str))
-                if leaf_str not in tree_map: tree_map[leaf_str] = set()
-                tree_map[leaf_str].add(event_str)
-            
-            if leaf_str not in nodes_data:
-                nodes_data[leaf_str] = {'id': leaf_str, 'label': get_label(leaf_type, g_asserted), 'children': []}
-
-            # Traverse Up strictly using Asserted Graph to avoid flatten shortcuts
-            curr = leaf_type
-            queue = [curr]
-            visited_up = set()
-            
-            while queue:
-                ct = queue.pop(0)
-                if ct == rg_ritual: continue
-                ct_str = str(ct)
-                
-                if ct_str in visited_up: continue
-                visited_up.add(ct_str)
-                
-                # Get Asserted Parents
-                parents = list(g_asserted.objects(ct, skos.broader))
-                
-                for p in parents:
-                    p_str = str(p)
-                    
-                    # Store Node Data
-                    if p_str not in nodes_data:
-                        nodes_data[p_str] = {'id': p_str, 'label': get_label(p, g_asserted), 'children': []}
-                    
-                    # Store Link
-                    if (p_str, ct_str) not in relationships:
-                        relationships.add((p_str, ct_str))
-                        if p_str not in tree_map: tree_map[p_str] = set()
-                        tree_map[p_str].add(ct_str)
-                    
-                    queue.append(p)
-
-    # 4. Serialize from Root
-    def build_tree(node_id, visited):
-        if node_id in visited: return None
-        visited.add(node_id)
-        
-        node = nodes_data.get(node_id)
-        if not node: return None
-        
-        children_ids = tree_map.get(node_id, set())
-        children_list = []
-        for child_id in children_ids:
-            child_tree = build_tree(child_id, visited.copy())
-            if child_tree:
-                children_list.append(child_tree)
-        
-        # Sort children by label
-        children_list.sort(key=lambda x: x['label'])
-        
-        return {
-            'id': node['id'],
-            'label': node['label'],
-            'children': children_list,
-            'is_event': node.get('is_event', False)
-        }
-    
-    root_tree = build_tree(str(rg_ritual), set())
-    
-    if root_tree:
-        return [root_tree]
-    return []
+            edges.add((str(leaf_type), event_str))
+            leaf_id = types.id_of(leaf_type)
+            if leaf_id is not None:
+                walked |= (1 << leaf_id) | up_to_ritual[leaf_id]
+
+    # Every type on the way up links to its asserted parents, strictly using the
+    # Asserted Graph to avoid flatten shortcuts
+    for ct in _bits(walked):
+        for p in types.parents(ct):
+            edges.add((types.uris[p], types.uris[ct]))
+
+    def label(uri):
+        return label_for(inferred_labels if uri in events else asserted_labels, uri)
+
+    return HierarchyIndex.from_edges(edges, label), events
+
+
+def _bits(bitset):
+    # Positions of the set bits of an int, lowest first
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+def _event_hierarchy(inferred=False):
+    key = ('event-hierarchy', graph_version(inferred))
+    if key not in _INDEXES:
+        _INDEXES[key] = build_event_hierarchy(inferred=inferred)
+    return _INDEXES[key]
+
+
+def _lone_ritual_root(inferred):
+    return {'id': str(RITUAL_ROOT), 'label': label_for(get_label_index(inferred=False), RITUAL_ROOT),
+            'children': [], 'is_event': False}
+
+
+@metrics.timed('tree_build')
+def index_to_dag(index, roots, attributes=None):
+    """Serialize the part of index reachable from roots as a DAG.
+
+    {'nodes': [{'id', 'label', 'children': [node positions]}, ...], 'roots': [positions]}:
+    every node appears once and parents refer to children by position in 'nodes', so
+    the size is bounded by the node and edge counts however many paths lead to a node.
+    attributes(i) adds extra keys to a node.
+    """
+    positions = {}
+    order = []
+    queue = collections.deque()
+    for n in roots:
+        if n not in positions:
+            positions[n] = len(order)
+            order.append(n)
+            queue.append(n)
+    while queue:
+        for child in index.children(queue.popleft()):
+            if child not in positions:
+                positions[child] = len(order)
+                order.append(child)
+                queue.append(child)
+
+    nodes = []
+    for n in order:
+        node = {'id': index.uris[n], 'label': index.labels[n],
+                'children': [positions[c] for c in index.children(n)]}
+        if attributes:
+            node.update(attributes(n))
+        nodes.append(node)
+    return {'nodes': nodes, 'roots': [positions[n] for n in roots]}
+
+
+def get_navigation_dag(inferred=False, reduce=None):
+    """The navigation tree as a DAG (see index_to_dag), from the hierarchy index."""
+    reduced = reduce_hierarchy(inferred, reduce)
+    name, version = navigation_dag_artifact_name(inferred, reduced), graph_version(inferred)
+    dag = load_artifact(name, version)
+    if dag is None:
+        index = get_hierarchy_index(inferred=inferred, reduce=reduced)
+        dag = _ARTIFACTS[(name, version)] = index_to_dag(index, list(index.roots),
+                                                         lambda i: _implied_parents(index, i))
+    return dag
+
+
+def get_event_navigation_dag(inferred=False):
+    """The events tree as a DAG rooted at rg:Ritual; event nodes carry is_event."""
+    version = graph_version(inferred)
+    dag = load_artifact(EVENTS_DAG_ARTIFACT_NAME, version)
+    if dag is None:
+        dag = _ARTIFACTS[(EVENTS_DAG_ARTIFACT_NAME, version)] = build_event_navigation_dag(inferred=inferred)
+    return dag
+
+
+def build_event_navigation_dag(inferred=False):
+    tree, events = _event_hierarchy(inferred=inferred)
+    root = tree.id_of(RITUAL_ROOT)
+    if root is None:
+        return {'nodes': [_lone_ritual_root(inferred)], 'roots': [0]}
+    return index_to_dag(tree, [root], lambda i: {'is_event': tree.uris[i] in events})
+
+
+def get_event_navigation_roots(inferred=False):
+    """Top-level nodes of the events tree with child counts, for lazy rendering."""
+    dag = get_event_navigation_dag(inferred=inferred)
+    return [{'id': dag['nodes'][r]['id'], 'label': dag['nodes'][r]['label'],
+             'child_count': len(dag['nodes'][r]['children'])} for r in dag['roots']]
+
+
+# Literals searched besides the labels
+DESCRIPTION_PREDICATES = [SKOS.definition, SKOS.scopeNote, RDFS.comment,
+                          rdflib.URIRef("http://purl.org/dc/terms/description")]
+
+
+@metrics.timed('search_index')
+def build_search_index(inferred=False):
+    g = load_graph(inferred=inferred)
+    labels = get_label_index(inferred=inferred)
+    index = SearchIndex()
+    fields = [(p, local_name(p)) for p in LABEL_PREDICATES] + [(p, 'description') for p in DESCRIPTION_PREDICATES]
+    for predicate, field in fields:
+        for s, o in g.subject_objects(predicate):
+            if isinstance(s, rdflib.URIRef) and isinstance(o, rdflib.Literal):
+                index.add(s, label_for(labels, s), field, o)
+    return index
+
+
+def get_search_index(inferred=False):
+    key = ('search', graph_version(inferred))
+    if key not in _INDEXES:
+        _INDEXES[key] = build_search_index(inferred=inferred)
+    return _INDEXES[key]
+
+
+def ancestor_path(index, i):
+    """[{'id', 'label'}] from a root of the hierarchy down to the parent of node i."""
+    path, seen = [], {i}
+    parents = index.parents(i)
+    # Parents are in label order; follow the first one up
+    while len(parents) and parents[0] not in seen:
+        i = parents[0]
+        seen.add(i)
+        path.append({'id': index.uris[i], 'label': index.labels[i]})
+        parents = index.parents(i)
+    return path[::-1]
+
+
+def search_nodes(query, inferred=False, limit=20, reduce=None):
+    """Ranked label matches for query, each with its ancestor path in the navigation tree."""
+    hierarchy = get_hierarchy_index(inferred=inferred, reduce=reduce)
+    results = []
+    for uri, label, score in get_search_index(inferred=inferred).search(query, limit=limit):
+        i = hierarchy.id_of(uri)
+        results.append({
+            'id': uri,
+            'label': label,
+            'score': score,
+            'path': ancestor_path(hierarchy, i) if i is not None else [],
+        })
+    return results
+
+
+# Tokens whose inner whitespace is significant: IRIs and string literals.
+# Comments are dropped and any other run of whitespace becomes one space.
+_QUERY_TOKEN_RE = re.compile(
+    r'(<[^<>"{}|^`\\\s]*>'
+    r'|"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\''
+    r'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+    r'|(?:\s+|#[^\n]*)+'
+)
 
-def execute_sparql_query(query_string, inferred=False):
+
+def normalize_query(query_string):
+    """Canonical form of a query for cache keys; formatting-only edits map to the same key."""
+    return _QUERY_TOKEN_RE.sub(lambda m: m.group(1) or ' ', query_string).strip()
+
+
+def sparql_cache_key(query_string, inferred=False, extra=''):
+    digest = hashlib.sha256(normalize_query(query_string).encode('utf-8')).hexdigest()
+    mode = 'inferred' if inferred else 'asserted'
+    return f"sparql:{mode}:{graph_version(inferred)[:16]}:{digest}{extra}"
+
+
+def _sparql_cache():
+    alias = getattr(settings, 'RGO_SPARQL_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def execute_sparql_query(query_string, inferred=False, prepared=None, init_bindings=None, offset=0, limit=None):
+    """Run a query and return one page of decorated rows, serving repeats from the cache.
+
+    Entries are keyed by normalized query text, bindings, page, mode and graph version,
+    so a new ontology deploy never serves stale rows. Errors and oversized results are
+    not cached. `prepared` is an rdflib prepareQuery() object for `query_string`.
+    No page reaches past RGO_SPARQL_MAX_ROWS; `truncated` is set when the cap cut it short.
+    """
+    max_rows = getattr(settings, 'RGO_SPARQL_MAX_ROWS', 10000)
+    offset = min(max(0, offset), max_rows)
+    if limit is None or offset + limit > max_rows:
+        limit = max_rows - offset
+
+    query = prepared if prepared is not None else query_string
+    cache = _sparql_cache()
+    key = sparql_cache_key(query_string, inferred=inferred,
+                           extra=f"{bindings_key(init_bindings)}:{offset}:{limit}")
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        # Evaluated in the worker pool under RGO_SPARQL_TIMEOUT
+        result = sparql_pool.run_query(query, inferred=inferred, init_bindings=init_bindings,
+                                       offset=offset, limit=limit, text=query_string)
+        if result.get('next_offset') is not None and result['next_offset'] >= max_rows:
+            result['next_offset'] = None
+            result['truncated'] = True
+        cache_max_rows = getattr(settings, 'RGO_SPARQL_CACHE_MAX_ROWS', 5000)
+        if cache is not None and 'error' not in result and len(result.get('results') or []) <= cache_max_rows:
+            cache.set(key, result, timeout=None)
+    return result
+
+
+def bindings_key(init_bindings):
+    if not init_bindings:
+        return ''
+    items = sorted((str(k), v.n3()) for k, v in init_bindings.items())
+    return ':' + hashlib.sha256(repr(items).encode('utf-8')).hexdigest()[:16]
+
+
+def iter_sparql_query(query, inferred=False, init_bindings=None):
+    """Evaluate a query lazily.
+
+    Returns (type, vars, rows) where rows is an iterator of term tuples pulled from
+    rdflib's evaluator one at a time, so callers can page or stream without
+    materializing the whole result. type is 'SELECT', 'TRIPLES' or 'OTHER'.
+    Parse errors are raised here; evaluation errors surface while iterating.
+    """
     g = load_graph(inferred=inferred)
+    if isinstance(query, str):
+        # Same prefixes as Graph.query() makes available
+        with metrics.timed('sparql_parse'):
+            query = prepareQuery(query, initNs=dict(g.namespaces()))
+
+    if query.algebra.name in ('ConstructQuery', 'DescribeQuery'):
+        return 'TRIPLES', ['Subject', 'Predicate', 'Object'], _distinct(_iter_graph_query(g, query, init_bindings))
+
+    res = evalQuery(g, query, init_bindings or {})
+
+    # If it's a SELECT query
+    if res['type_'] == 'SELECT':
+        variables = [str(v) for v in res['vars_']]
+        keys = [rdflib.Variable(v) for v in variables]
+        return 'SELECT', variables, (tuple(row.get(k) for k in keys) for row in res['bindings'])
+
+    return 'OTHER', [], iter(())
+
+
+def _iter_graph_query(g, query, init_bindings):
+    """Triples of a CONSTRUCT or DESCRIBE query, one solution at a time.
+
+    rdflib's evalQuery() fills a whole result graph before returning it, so a
+    RGO_SPARQL_MAX_ROWS cut would only come after it was all in memory.
+    Same context setup as evalQuery(). Triples can repeat; see _distinct().
+    """
+    main = query.algebra
+    ctx = QueryContext(g, initBindings={rdflib.Variable(k): v for k, v in (init_bindings or {}).items()},
+                       datasetClause=main.datasetClause)
+    ctx.prologue = query.prologue
+    if main.name == 'ConstructQuery':
+        # CONSTRUCT WHERE { ... } uses its pattern as the template
+        template = main.template or main.p.p.triples
+        for solution in evalPart(ctx, main.p):
+            yield from _fillTemplate(template, solution)
+        return
+
+    resources = {iri for iri in main.PV if isinstance(iri, rdflib.URIRef)}
+    if main.p is not None:
+        for solution in evalPart(ctx, main.p):
+            resources.update(solution.values())
+    for resource in resources:
+        yield from ctx.graph.cbd(resource)
+
+
+def _distinct(triples):
+    # Only holds what was produced so far, i.e. at most RGO_SPARQL_MAX_ROWS triples when capped
+    seen = set()
+    for triple in triples:
+        if triple not in seen:
+            seen.add(triple)
+            yield triple
+
+
+def _decorate_term(val, labels):
+    if val is None:
+        return None
+    str_val = str(val)
+    is_uri = isinstance(val, rdflib.URIRef)
+
+    # Compute label
+    label = str_val
+    if is_uri:
+        label = label_for(labels, str_val)
+
+    return {
+        'value': str_val,
+        'label': label,
+        'type': 'uri' if is_uri else 'literal'
+    }
+
+
+def _execute_sparql_query(query, inferred=False, init_bindings=None, offset=0, limit=None):
+    labels = get_label_index(inferred=inferred)
     try:
-        results = g.query(query_string)
-        
-        # Parse results into a friendly format
-        output = []
+        kind, variables, rows = iter_sparql_query(query, inferred=inferred, init_bindings=init_bindings)
+        if kind == 'OTHER':
+            return {'type': 'OTHER', 'results': 'Query type not supported for table view.'}
+
+        # Pull one extra row to know whether there is a next page
+        stop = offset + limit + 1 if limit is not None else None
+        # Rows are evaluated lazily, so this is where the query actually runs
+        with metrics.timed('sparql_eval'):
+            page = list(itertools.islice(rows, offset, stop))
+        has_next = limit is not None and len(page) > limit
+        page = page[:limit] if limit is not None else page
+        with metrics.timed('label_decoration'):
+            results = [[_decorate_term(val, labels) for val in row] for row in page]
+
         # JSON-like structure: columns and rows
-        
-        # If it's a SELECT query
-        if results.type == 'SELECT':
-            vars = [str(v) for v in results.vars]
-            rows = []
-            for row in results:
-                # Create an ordered list of cells matching 'vars'
-                row_list = []
-                for v in vars:
-                    val = row[v]
-                    if val is not None:
-                        str_val = str(val)
-                        is_uri = isinstance(val, rdflib.URIRef)
-                        
-                        # Compute label
-                        label = str_val
-                        if is_uri:
-                            # Try to find RDFS label
-                            rdfs_label = g.value(val, RDFS.label)
-                            if rdfs_label:
-                                label = str(rdfs_label)
-                            elif '#' in str_val:
-                                label = str_val.split('#')[-1]
-                            else:
-                                label = str_val.split('/')[-1]
-                        
-                        row_list.append({
-                            'value': str_val,
-                            'label': label,
-                            'type': 'uri' if is_uri else 'literal'
-                        })
-                    else:
-                        row_list.append(None)
-                rows.append(row_list)
-            return {'type': 'SELECT', 'vars': vars, 'results': rows}
-        
-            return {'type': 'SELECT', 'vars': vars, 'results': rows}
-        
-        # Handle Graph results (DESCRIBE, CONSTRUCT)
-        if results.type == 'DESCRIBE' or results.type == 'CONSTRUCT':
-            vars = ['Subject', 'Predicate', 'Object']
-            rows = []
-            for s, p, o in results:
-                row_list = []
-                for val in [s, p, o]:
-                    if val is not None:
-                        str_val = str(val)
-                        is_uri = isinstance(val, rdflib.URIRef)
-                        
-                        # Compute label
-                        label = str_val
-                        if is_uri:
-                            rdfs_label = g.value(val, RDFS.label)
-                            if rdfs_label:
-                                label = str(rdfs_label)
-                            elif '#' in str_val:
-                                label = str_val.split('#')[-1]
-                            else:
-                                label = str_val.split('/')[-1]
-                        
-                        row_list.append({
-                            'value': str_val,
-                            'label': label,
-                            'type': 'uri' if is_uri else 'literal'
-                        })
-                    else:
-                        row_list.append(None)
-                rows.append(row_list)
-            return {'type': 'TRIPLES', 'vars': vars, 'results': rows}
-
-        return {'type': 'OTHER', 'results': 'Query type not supported for table view.'}
-        
+        return {
+            'type': kind,
+            'vars': variables,
+            'results': results,
+            'offset': offset,
+            'next_offset': offset + len(page) if has_next else None,
+        }
+
     except Exception as e:
         return {'error': str(e)}
 
-# Helper to explore details of a node
-def get_node_details(node_id, inferred=False):
+
+# Whole -> part predicates a ritual is composed through (closed transitively)
+RITUAL_PART_PREDICATES = [CRM.P9_consists_of, CRM.P10i_contains]
+# What a ritual's parts are compared by: their types, who takes part and what is used
+MODULE_FEATURE_PREDICATES = {
+    CRM.P2_has_type: 'type',
+    CRM.P14_carried_out_by: 'actor',
+    CRM.P11_had_participant: 'participant',
+    CRM.P16_used_specific_object: 'object',
+}
+
+
+def ritual_modules(inferred=False):
+    """{ritual uri: set of module features} for everything that has parts.
+
+    A ritual's modules are its parts (P9 / P10i, transitively) as 'part:<uri>', the
+    types of those parts as 'type:<uri>', and the actors, participants and objects of
+    the ritual and its parts ('actor:', 'participant:', 'object:'). The ritual's own
+    types are left out, so two rituals are similar by what they contain rather than
+    by how they are classified.
+    """
     g = load_graph(inferred=inferred)
-    node_uri = rdflib.URIRef(node_id)
-    details = {'id': node_id, 'properties': []}
-    
-    seen = set()  # (predicate, object, direction)
+    edges = set()
+    for p in RITUAL_PART_PREDICATES:
+        for whole, part in g.subject_objects(p):
+            if isinstance(whole, rdflib.URIRef) and isinstance(part, rdflib.URIRef) and whole != part:
+                # Parts are the "parents" here, so ancestor_bitsets() gives every part of a whole
+                edges.add((str(part), str(whole)))
+    if not edges:
+        return {}
+    composition = HierarchyIndex.from_edges(edges, str)
+    parts = composition.ancestor_bitsets()
 
-    ignored_types = {str(OWL.NamedIndividual), str(OWL.Class), str(OWL.ObjectProperty),
-                     str(OWL.DatatypeProperty), str(OWL.Ontology), str(OWL.AnnotationProperty),
-                     "http://www.w3.org/2004/02/skos/core#Concept"}
-    ignored_predicates = {str(OWL.imports), str(OWL.versionIRI)}
+    features = {}
+    for p, kind in MODULE_FEATURE_PREDICATES.items():
+        for s, o in g.subject_objects(p):
+            if isinstance(o, rdflib.URIRef):
+                features.setdefault(str(s), set()).add(f"{kind}:{o}")
 
-    # Outgoing
-    for p, o in g.predicate_objects(subject=node_uri):
-        key = (str(p), str(o), 'out')
-        if key in seen:
+    modules = {}
+    for i, uri in enumerate(composition.uris):
+        if not parts[i]:
             continue
-        seen.add(key)
+        ritual = {f for f in features.get(uri, ()) if not f.startswith('type:')}
+        for j in _bits(parts[i]):
+            part = composition.uris[j]
+            ritual.add(f"part:{part}")
+            ritual |= features.get(part, set())
+        modules[uri] = ritual
+    return modules
 
-        if str(p) in ignored_predicates or (p == RDF.type and str(o) in ignored_types):
-            continue
 
-        p_label = g.value(p, RDFS.label) or (str(p).split('#')[-1] if '#' in str(p) else str(p).split('/')[-1])
-        o_label = str(o)
-        if isinstance(o, rdflib.URIRef):
-            o_label = g.value(o, RDFS.label) or (str(o).split('#')[-1] if '#' in str(o) else str(o).split('/')[-1])
-
-        details['properties'].append({
-            'predicate': str(p),
-            'predicate_label': str(p_label),
-            'object': str(o),
-            'object_label': str(o_label),
-            'is_uri': isinstance(o, rdflib.URIRef),
-            'direction': 'out'
-        })
-    '''
-    # Incoming
-    for s, p in g.subject_predicates(object=node_uri):
-        key = (str(p), str(s), 'in')
-        if key in seen:
-            continue
-        seen.add(key)
+@metrics.timed('similarity_index')
+def build_similarity_index(inferred=False):
+    labels = get_label_index(inferred=inferred)
+    modules = ritual_modules(inferred=inferred)
+    return SimilarityIndex(modules, {uri: label_for(labels, uri) for uri in modules})
+
+
+def get_similarity_index(inferred=False):
+    key = ('similarity', graph_version(inferred))
+    if key not in _INDEXES:
+        _INDEXES[key] = build_similarity_index(inferred=inferred)
+    return _INDEXES[key]
+
+
+def _module_entries(features, labels):
+    entries = []
+    for feature in features:
+        kind, uri = feature.split(':', 1)
+        entries.append({'kind': kind, 'id': uri, 'label': label_for(labels, uri)})
+    return entries
+
+
+def compare_rituals(a, b, inferred=False):
+    """Jaccard similarity and the shared and distinct modules of two rituals, or None if either has no parts."""
+    index = get_similarity_index(inferred=inferred)
+    i, j = index.id_of(a), index.id_of(b)
+    if i is None or j is None:
+        return None
+    labels = get_label_index(inferred=inferred)
+    return {
+        'a': {'id': index.uris[i], 'label': index.labels[i]},
+        'b': {'id': index.uris[j], 'label': index.labels[j]},
+        'jaccard': index.jaccard(i, j),
+        'estimated_jaccard': index.estimated_jaccard(i, j),
+        'shared': _module_entries(index.shared(i, j), labels),
+        'only_a': _module_entries(index.only(i, j), labels),
+        'only_b': _module_entries(index.only(j, i), labels),
+    }
+
+
+def similar_rituals(uri, inferred=False, k=10):
+    """The k rituals whose modules overlap most with uri's, or None if it has no parts."""
+    index = get_similarity_index(inferred=inferred)
+    i = index.id_of(uri)
+    if i is None:
+        return None
+    return {
+        'id': index.uris[i],
+        'label': index.labels[i],
+        'module_count': len(index.sets[i]),
+        'neighbors': [{'id': index.uris[j], 'label': index.labels[j], 'jaccard': score,
+                       'shared_count': len(index.shared(i, j))}
+                      for j, score in index.neighbors(i, k)],
+    }
+
 
-        if str(p) in ignored_predicates:
+# Helper to explore details of a node
+
+# Left out of node details: bookkeeping types and ontology header predicates
+IGNORED_TYPES = {str(OWL.NamedIndividual), str(OWL.Class), str(OWL.ObjectProperty),
+                 str(OWL.DatatypeProperty), str(OWL.Ontology), str(OWL.AnnotationProperty),
+                 "http://www.w3.org/2004/02/skos/core#Concept"}
+IGNORED_PREDICATES = {str(OWL.imports), str(OWL.versionIRI)}
+
+
+@metrics.timed('details_index')
+def build_node_details_index(inferred=False):
+    """{uri: [property, ...]} for every named node, outgoing edges first, then incoming.
+
+    Built in one pass over the graph, with each term labelled once.
+    """
+    g = load_graph(inferred=inferred)
+    labels = get_label_index(inferred=inferred)
+    term_labels = {}
+
+    def label(term):
+        if term not in term_labels:
+            term_labels[term] = str(label_for(labels, term)) if isinstance(term, rdflib.URIRef) else str(term)
+        return term_labels[term]
+
+    outgoing, incoming = {}, {}
+    seen = set()  # (node, predicate, other end, direction)
+    for s, p, o in g.triples((None, None, None)):
+        if str(p) in IGNORED_PREDICATES or (p == RDF.type and str(o) in IGNORED_TYPES):
             continue
 
-        p_label = g.value(p, RDFS.label) or (str(p).split('#')[-1] if '#' in str(p) else str(p).split('/')[-1])
-        s_label = str(s)
-        if isinstance(s, rdflib.URIRef):
-            s_label = g.value(s, RDFS.label) or (str(s).split('#')[-1] if '#' in str(s) else str(s).split('/')[-1])
-        p_label = f"'{p_label}' of"
-
-        details['properties'].append({
-            'predicate': str(p),
-            'predicate_label': p_label,
-            'object': str(s),
-            'object_label': s_label,
-            'is_uri': isinstance(s, rdflib.URIRef),
-            'direction': 'in'
-        })
-    '''
-    return details
+        if isinstance(s, rdflib.URIRef) and (s, p, o, 'out') not in seen:
+            seen.add((s, p, o, 'out'))
+            outgoing.setdefault(str(s), []).append({
+                'predicate': str(p),
+                'predicate_label': label(p),
+                'object': str(o),
+                'object_label': label(o),
+                'is_uri': isinstance(o, rdflib.URIRef),
+                'direction': 'out'
+            })
+
+        if isinstance(o, rdflib.URIRef) and (o, p, s, 'in') not in seen:
+            seen.add((o, p, s, 'in'))
+            incoming.setdefault(str(o), []).append({
+                'predicate': str(p),
+                'predicate_label': f"'{label(p)}' of",
+                'object': str(s),
+                'object_label': label(s),
+                'is_uri': isinstance(s, rdflib.URIRef),
+                'direction': 'in'
+            })
+
+    return {node: outgoing.get(node, []) + incoming.get(node, []) for node in outgoing.keys() | incoming.keys()}
+
+
+def get_node_details_index(inferred=False):
+    key = ('node-details', graph_version(inferred))
+    if key not in _INDEXES:
+        _INDEXES[key] = build_node_details_index(inferred=inferred)
+    return _INDEXES[key]
+
+
+def get_node_details(node_id, inferred=False):
+    properties = get_node_details_index(inferred=inferred).get(node_id, [])
+    return {'id': node_id, 'properties': list(properties)}
+
+
+def get_nodes_details(node_ids, inferred=False):
+    """Details for several nodes at once: {uri: details}."""
+    return {node_id: get_node_details(node_id, inferred=inferred) for node_id in dict.fromkeys(node_ids)}
 
@@ -0,0 +1,225 @@
+from array import array
+
+
+def _csr(count, edges):
+    """Offsets and targets for `count` nodes from (source, target) pairs sorted by source."""
+    offsets = array('i', [0]) * (count + 1)
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+    targets = array('i', (target for _, target in edges))
+    return offsets, targets
+
+
+def _components(index):
+    """Strongly connected component of every node (iterative Tarjan).
+
+    Components are numbered in the order Tarjan completes them, i.e. reverse
+    topological: a component's successors always have smaller numbers.
+    """
+    count = len(index)
+    component = [-1] * count
+    low = [0] * count
+    order = [-1] * count
+    stack, on_stack = [], [False] * count
+    counter = components = 0
+    for start in range(count):
+        if order[start] != -1:
+            continue
+        work = [(start, 0)]
+        while work:
+            node, position = work.pop()
+            if position == 0:
+                order[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            children = index.children(node)
+            if position < len(children):
+                work.append((node, position + 1))
+                child = children[position]
+                if order[child] == -1:
+                    work.append((child, 0))
+                elif on_stack[child]:
+                    low[node] = min(low[node], order[child])
+                continue
+            if low[node] == order[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return component
+
+
+class HierarchyIndex:
+    """Compact parent/child index over integer node ids.
+
+    Node ids are assigned in (label, URI) order, so sorting ids sorts by label.
+    Children and parents are stored CSR-style in `array`s: the children of node i
+    are child_targets[child_offsets[i]:child_offsets[i + 1]]. URIs and labels are
+    parallel lists indexed by id.
+    """
+
+    def __init__(self, uris, labels, child_offsets, child_targets, parent_offsets, parent_targets, roots,
+                 implied_offsets=None, implied_targets=None):
+        self.uris = uris
+        self.labels = labels
+        self.child_offsets = child_offsets
+        self.child_targets = child_targets
+        self.parent_offsets = parent_offsets
+        self.parent_targets = parent_targets
+        self.roots = roots
+        # Set on transitive reductions: the parents whose direct edge was dropped, per child
+        self.implied_offsets = implied_offsets
+        self.implied_targets = implied_targets
+        self._ids = None
+
+    @classmethod
+    def from_edges(cls, edges, label):
+        """Build from (parent URI, child URI) pairs; label(uri) gives each node's label."""
+        edges = set(edges)
+        uris = {uri for edge in edges for uri in edge}
+        labels = {uri: label(uri) for uri in uris}
+        order = sorted(uris, key=lambda uri: (labels[uri], uri))
+        ids = {uri: i for i, uri in enumerate(order)}
+
+        index = cls._from_id_edges(order, [labels[uri] for uri in order],
+                                   [(ids[parent], ids[child]) for parent, child in edges])
+        index._ids = ids
+        return index
+
+    @classmethod
+    def _from_id_edges(cls, uris, labels, edges, implied=()):
+        down = sorted(edges)
+        up = sorted((child, parent) for parent, child in down)
+        child_offsets, child_targets = _csr(len(uris), down)
+        parent_offsets, parent_targets = _csr(len(uris), up)
+
+        # Standard Root Finding (No strict filtering, restoring original behavior)
+        has_children = {parent for parent, _ in down}
+        roots = [i for i in sorted(has_children) if parent_offsets[i] == parent_offsets[i + 1]]
+        # Fallback
+        if not roots:
+            roots = sorted(has_children)
+
+        implied_offsets = implied_targets = None
+        if implied:
+            implied_offsets, implied_targets = _csr(len(uris), sorted((child, parent) for parent, child in implied))
+        return cls(uris, labels, child_offsets, child_targets, parent_offsets, parent_targets, array('i', roots),
+                   implied_offsets, implied_targets)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def id_of(self, uri):
+        if self._ids is None:
+            self._ids = {u: i for i, u in enumerate(self.uris)}
+        return self._ids.get(str(uri))
+
+    def children(self, i):
+        return self.child_targets[self.child_offsets[i]:self.child_offsets[i + 1]]
+
+    def child_count(self, i):
+        return self.child_offsets[i + 1] - self.child_offsets[i]
+
+    def parents(self, i):
+        return self.parent_targets[self.parent_offsets[i]:self.parent_offsets[i + 1]]
+
+    def implied_parents(self, i):
+        """Parents of node i whose edge a transitive reduction dropped (empty otherwise)."""
+        if self.implied_offsets is None:
+            return array('i')
+        return self.implied_targets[self.implied_offsets[i]:self.implied_offsets[i + 1]]
+
+    def ancestor_bitsets(self):
+        """Every node's ancestors as an int bitset (bit j set: node j is an ancestor).
+
+        Computed once per strongly connected component, parents before children.
+        Nodes on a cycle count the other members of their cycle as ancestors.
+        """
+        component = _components(self)
+        count = max(component, default=-1) + 1
+        members = [0] * count
+        for i, c in enumerate(component):
+            members[c] |= 1 << i
+        parents = [set() for _ in range(count)]
+        for i in range(len(self)):
+            for p in self.parents(i):
+                if component[p] != component[i]:
+                    parents[component[i]].add(component[p])
+
+        # Tarjan numbers descendants first, so going backwards visits ancestors first
+        reach = [0] * count
+        for c in reversed(range(count)):
+            for p in parents[c]:
+                reach[c] |= members[p] | reach[p]
+        return [reach[component[i]] | (members[component[i]] & ~(1 << i)) for i in range(len(self))]
+
+    def reduced(self):
+        """Transitive reduction: only the Hasse-diagram edges are kept.
+
+        An edge u -> v is dropped when v is also reachable from another child of u.
+        Cycles are collapsed into strongly connected components first; edges inside
+        a component are kept. Dropped edges remain available as implied_parents().
+        """
+        component = _components(self)
+        count = max(component, default=-1) + 1
+        successors = [set() for _ in range(count)]
+        for u in range(len(self)):
+            for v in self.children(u):
+                if component[u] != component[v]:
+                    successors[component[u]].add(component[v])
+
+        # Components are numbered sinks first, so successors are always done before their
+        # predecessors. reach[c] is a bitset of the components reachable from c.
+        reach = [0] * count
+        for c in range(count):
+            for d in successors[c]:
+                reach[c] |= (1 << d) | reach[d]
+        # Components reachable from c through a path of two or more edges
+        indirect = [0] * count
+        for c in range(count):
+            for d in successors[c]:
+                indirect[c] |= reach[d]
+
+        kept, dropped = [], []
+        for u in range(len(self)):
+            for v in self.children(u):
+                if component[u] != component[v] and indirect[component[u]] >> component[v] & 1:
+                    dropped.append((u, v))
+                else:
+                    kept.append((u, v))
+        index = self._from_id_edges(self.uris, self.labels, kept, dropped)
+        index._ids = self._ids
+        return index
+
+    def to_dict(self):
+        """JSON-serializable form, for build_graph_artifacts."""
+        data = {
+            'uris': self.uris,
+            'labels': self.labels,
+            'child_offsets': self.child_offsets.tolist(),
+            'child_targets': self.child_targets.tolist(),
+            'parent_offsets': self.parent_offsets.tolist(),
+            'parent_targets': self.parent_targets.tolist(),
+            'roots': self.roots.tolist(),
+        }
+        if self.implied_offsets is not None:
+            data['implied_offsets'] = self.implied_offsets.tolist()
+            data['implied_targets'] = self.implied_targets.tolist()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        implied = [array('i', data[k]) if k in data else None for k in ('implied_offsets', 'implied_targets')]
+        return cls(data['uris'], data['labels'],
+                   array('i', data['child_offsets']), array('i', data['child_targets']),
+                   array('i', data['parent_offsets']), array('i', data['parent_targets']),
+                   array('i', data['roots']), *implied)
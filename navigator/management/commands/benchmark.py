@@ -0,0 +1,169 @@
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from navigator import graph_utils, ontologies, sparql_registry, synthetic
+
+# Typeahead prefixes and whole words, as the search box sends them
+SEARCH_TERMS = ['sa', 'sagun', 'marriage ritual', 'kanyadana']
+
+
+class Command(BaseCommand):
+    help = (
+        "Time graph loading, reasoning, the label, tree and search indexes, node details and the "
+        "bundled SPARQL queries on synthetic copies of the ontology scaled to several sizes, recording peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', type=int, nargs='+', default=[1, 10, 100],
+            help='Multiples of the events, activities and SKOS concepts to benchmark (default: 1 10 100; 1000 takes a while).',
+        )
+        parser.add_argument(
+            '--engine', choices=[graph_utils.HERMIT, graph_utils.RULES],
+            help='Inference engine to benchmark (default: RGO_INFERENCE_ENGINE).',
+        )
+        parser.add_argument(
+            '--details', type=int, default=100,
+            help='Number of nodes whose details are fetched (default: 100).',
+        )
+        parser.add_argument(
+            '--no-memory', action='store_true',
+            help='Skip tracemalloc, which slows allocation-heavy steps down, for cleaner timings.',
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument(
+            '--baseline',
+            help='Results file of an earlier run; fail if a step got slower than --tolerance allows.',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Allowed slowdown against --baseline as a fraction (default: 0.5, i.e. 50%%).',
+        )
+
+    def handle(self, *args, **options):
+        engine = options['engine'] or graph_utils.inference_engine()
+        results = {
+            'engine': engine,
+            'python': platform.python_version(),
+            'memory': not options['no_memory'],
+            'scales': {},
+        }
+        sources = ontologies.get_root_ontologies()
+
+        with tempfile.TemporaryDirectory(prefix='rgo-benchmark-') as workdir:
+            for factor in options['scales']:
+                if factor < 1:
+                    raise CommandError(f"Scales must be at least 1, got {factor}")
+                directory = os.path.join(workdir, f"x{factor}")
+                started = time.perf_counter()
+                names = synthetic.write_scaled_ontologies(sources, factor, directory)
+                self.stdout.write(f"\nScale x{factor} (generated in {time.perf_counter() - started:.1f}s)")
+
+                overrides = {
+                    'RGO_ONTOLOGY_DIR': directory,
+                    'RGO_ONTOLOGIES': names,
+                    'RGO_ONTOLOGY_CATALOG': ontologies.get_catalog_path(),
+                    'RGO_CACHE_DIR': os.path.join(directory, 'cache'),
+                    'RGO_INFERENCE_ENGINE': engine,
+                    'RGO_GRAPH_STORE': {},
+                    'RGO_SPARQL_WORKERS': 0,
+                    'RGO_SPARQL_CACHE': None,
+                    'RGO_BACKGROUND_REASONING': False,
+                }
+                with override_settings(**overrides):
+                    graph_utils.reset()
+                    try:
+                        results['scales'][str(factor)] = self._run_scale(options)
+                    finally:
+                        graph_utils.reset()
+        graph_utils.reset()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"\nResults written to {options['output']}")
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    def _run_scale(self, options):
+        steps = {}
+
+        def step(name, func, *args, **kwargs):
+            steps[name] = self._measure(func, *args, memory=not options['no_memory'], **kwargs)
+            peak = f"{steps[name]['peak_mb']:9.1f} MB" if 'peak_mb' in steps[name] else ''
+            self.stdout.write(f"  {name:<40} {steps[name]['seconds']:9.3f} s {peak}")
+
+        step('load_graph (asserted)', graph_utils.load_graph, inferred=False)
+        step('load_graph (inferred)', graph_utils.load_graph, inferred=True)
+        # The structures the views serve, in dependency order, so each step only pays
+        # for its own build (the later ones reuse the memoized indexes)
+        step('get_label_index (asserted)', graph_utils.get_label_index, inferred=False)
+        step('get_label_index (inferred)', graph_utils.get_label_index, inferred=True)
+        step('get_hierarchy_index (asserted)', graph_utils.get_hierarchy_index, inferred=False)
+        step('get_hierarchy_index (inferred)', graph_utils.get_hierarchy_index, inferred=True)
+        step('get_navigation_dag (asserted)', graph_utils.get_navigation_dag, inferred=False)
+        step('get_navigation_dag (inferred)', graph_utils.get_navigation_dag, inferred=True)
+        step('get_event_navigation_dag', graph_utils.get_event_navigation_dag, inferred=True)
+        step('get_search_index', graph_utils.get_search_index, inferred=True)
+        step(f'search_nodes (x{len(SEARCH_TERMS)})',
+             lambda: [graph_utils.search_nodes(term, inferred=True) for term in SEARCH_TERMS])
+
+        step('get_similarity_index', graph_utils.get_similarity_index, inferred=True)
+
+        nodes = graph_utils.get_hierarchy_index(inferred=True).uris[:options['details']]
+        step(f'get_node_details (x{len(nodes)})',
+             lambda: [graph_utils.get_node_details(node, inferred=True) for node in nodes])
+
+        for name, entry in sorted(sparql_registry.load_prepared_queries().items()):
+            if entry['prepared'] is not None:
+                step(f'sparql {name}', graph_utils.execute_sparql_query, entry['text'],
+                     inferred=True, prepared=entry['prepared'])
+
+        return {
+            'triples': {'asserted': len(graph_utils.load_graph(inferred=False)),
+                        'inferred': len(graph_utils.load_graph(inferred=True))},
+            'steps': steps,
+        }
+
+    def _measure(self, func, *args, memory=True, **kwargs):
+        gc.collect()
+        if memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            func(*args, **kwargs)
+            seconds = time.perf_counter() - started
+            result = {'seconds': round(seconds, 4)}
+            if memory:
+                result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        finally:
+            if memory:
+                tracemalloc.stop()
+        return result
+
+    def _compare(self, results, baseline_path, tolerance):
+        try:
+            with open(baseline_path, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read baseline {baseline_path}: {e}")
+
+        regressions = []
+        for factor, scale in results['scales'].items():
+            before = baseline.get('scales', {}).get(factor, {}).get('steps', {})
+            for name, measured in scale['steps'].items():
+                # Steps of a few milliseconds are mostly noise; ignore differences below 10 ms
+                if (name in before and measured['seconds'] > before[name]['seconds'] * (1 + tolerance)
+                        and measured['seconds'] - before[name]['seconds'] > 0.01):
+                    regressions.append(f"x{factor} {name}: {before[name]['seconds']:.3f}s -> {measured['seconds']:.3f}s")
+        if regressions:
+            raise CommandError("Slower than the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No step is slower than the baseline."))
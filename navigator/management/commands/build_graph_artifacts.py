@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from navigator import graph_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the reasoner and prebuild the asserted, inferred and event navigation trees "
+        "and label/hierarchy indexes so that no request has to pay for parsing, reasoning or tree building."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rerun the reasoner even if an inferred snapshot for this ontology already exists.',
+        )
+
+    def handle(self, *args, **options):
+        asserted_version = graph_utils.graph_version(inferred=False)
+        inferred_version = graph_utils.graph_version(inferred=True)
+
+        if options['force']:
+            snapshot = graph_utils._snapshot_path(inferred_version)
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+
+        try:
+            self._timed('Loading asserted graph', graph_utils.load_graph, inferred=False)
+            self._timed('Loading inferred graph', graph_utils.load_graph, inferred=True)
+        except Exception as e:
+            raise CommandError(f"Could not load graphs: {e}")
+
+        artifacts = [
+            (graph_utils.label_artifact_name(False), asserted_version,
+             lambda: graph_utils.build_label_index(inferred=False)),
+            (graph_utils.label_artifact_name(True), inferred_version,
+             lambda: graph_utils.build_label_index(inferred=True)),
+            (graph_utils.hierarchy_artifact_name(False), asserted_version,
+             lambda: graph_utils.build_hierarchy_index(inferred=False).to_dict()),
+            (graph_utils.hierarchy_artifact_name(True), inferred_version,
+             lambda: graph_utils.build_hierarchy_index(inferred=True).to_dict()),
+            (graph_utils.hierarchy_artifact_name(True, reduced=True), inferred_version,
+             lambda: graph_utils.get_hierarchy_index(inferred=True, reduce=True).to_dict()),
+            (graph_utils.navigation_dag_artifact_name(False), asserted_version,
+             lambda: graph_utils.get_navigation_dag(inferred=False)),
+            (graph_utils.navigation_dag_artifact_name(True), inferred_version,
+             lambda: graph_utils.get_navigation_dag(inferred=True, reduce=False)),
+            (graph_utils.navigation_dag_artifact_name(True, reduced=True), inferred_version,
+             lambda: graph_utils.get_navigation_dag(inferred=True, reduce=True)),
+            (graph_utils.EVENTS_DAG_ARTIFACT_NAME, inferred_version,
+             lambda: graph_utils.build_event_navigation_dag(inferred=True)),
+        ]
+
+        manifest = {'asserted_version': asserted_version, 'inferred_version': inferred_version, 'artifacts': {}}
+        for name, version, build in artifacts:
+            data = self._timed(f'Building {name}', build)
+            path = graph_utils.save_artifact(name, version, data)
+            manifest['artifacts'][name] = os.path.basename(path)
+
+        manifest['built_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        manifest_path = os.path.join(graph_utils.get_cache_dir(), 'manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Graph artifacts written to {graph_utils.get_cache_dir()}"))
+
+    def _timed(self, message, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stdout.write(f"{message}... {time.perf_counter() - start:.2f}s")
+        return result
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from navigator import graph_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Run HermiT over the ontologies for a full consistency check. Navigation inferences "
+        "are maintained incrementally by the rule materializer; this is the DL-level validation."
+    )
+
+    def handle(self, *args, **options):
+        try:
+            report = graph_utils.check_consistency()
+        except Exception as e:
+            raise CommandError(f"Could not run the reasoner: {e}")
+
+        if not report['consistent']:
+            raise CommandError("The ontology is inconsistent.")
+        for iri in report['unsatisfiable_classes']:
+            self.stdout.write(self.style.WARNING(f"Unsatisfiable class: {iri}"))
+        self.stdout.write(self.style.SUCCESS("The ontology is consistent."))
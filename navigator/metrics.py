@@ -0,0 +1,120 @@
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the histogram buckets, Prometheus style (cumulative, +Inf last)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+# Phases timed during the current request, for the Server-Timing header
+_request_phases = contextvars.ContextVar('rgo_request_phases', default=None)
+
+
+class Histogram:
+    """Thread-safe histogram with one series per label value combination."""
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        # SPARQL pool workers are forked while other threads may be observing, and time
+        # their own phases; a lock held at fork time would never be released in the child
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)]
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                bucket_labels = ','.join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {total!r}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+PHASE_SECONDS = Histogram('rgo_phase_seconds', 'Time spent per processing phase.', ['phase'])
+REQUEST_SECONDS = Histogram('rgo_request_seconds', 'Request latency per view and status code.', ['view', 'status'])
+HISTOGRAMS = [PHASE_SECONDS, REQUEST_SECONDS]
+
+
+def record(phase, seconds):
+    PHASE_SECONDS.observe(seconds, phase=phase)
+    phases = _request_phases.get()
+    if phases is not None:
+        phases.append((phase, seconds))
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Time a block (or, as a decorator, a function) as one observation of phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def capture():
+    """Collect the phases timed inside the block into the yielded list.
+
+    Used per request by the middleware, and in SPARQL pool workers so the parent can
+    replay() the phases of a query that ran in another process.
+    """
+    phases = []
+    token = _request_phases.set(phases)
+    try:
+        yield phases
+    finally:
+        _request_phases.reset(token)
+
+
+def replay(phases):
+    for phase, seconds in phases:
+        record(phase, seconds)
+
+
+def server_timing(phases, total=None):
+    """Server-Timing header value: one entry per phase, repeated phases summed."""
+    durations = {}
+    for phase, seconds in phases:
+        durations[phase] = durations.get(phase, 0.0) + seconds
+    entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in durations.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def render(extra=()):
+    """All metrics in the Prometheus text exposition format; extra lines are appended."""
+    return '\n'.join([h.render() for h in HISTOGRAMS] + list(extra)) + '\n'
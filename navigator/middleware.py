@@ -0,0 +1,88 @@
+import cProfile
+import logging
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import graph_utils, metrics
+
+logger = logging.getLogger(__name__)
+
+# Request header that asks for a cProfile capture (honoured when RGO_PROFILE_REQUESTS is on)
+PROFILE_HEADER = 'X-RGO-Profile'
+
+
+class ServerTimingMiddleware:
+    """Time every request and report its phases.
+
+    The phases timed while handling the request (graph load, tree build, SPARQL
+    evaluation, ...) are sent back as a Server-Timing header and, like the request
+    latency, recorded in the histograms served by /metrics/.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI the async views are awaited directly instead of through a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        profiler = self._profiler(request)
+
+        start = time.perf_counter()
+        with metrics.capture() as phases:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        return self._finish(request, response, phases, time.perf_counter() - start, profiler)
+
+    async def _acall(self, request):
+        profiler = self._profiler(request)
+
+        start = time.perf_counter()
+        with metrics.capture() as phases:
+            if profiler is not None:
+                # Only the event loop thread is profiled; work on the graph executor is
+                # not (its phases still show up in Server-Timing)
+                profiler.enable()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    profiler.disable()
+            else:
+                response = await self.get_response(request)
+        return self._finish(request, response, phases, time.perf_counter() - start, profiler)
+
+    def _profiler(self, request):
+        if request.headers.get(PROFILE_HEADER) and getattr(settings, 'RGO_PROFILE_REQUESTS', settings.DEBUG):
+            return cProfile.Profile()
+        return None
+
+    def _finish(self, request, response, phases, total, profiler):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(total, view=view, status=response.status_code)
+        response.headers['Server-Timing'] = metrics.server_timing(phases, total)
+        if profiler is not None:
+            self._save_profile(profiler, view, response)
+        return response
+
+    def _save_profile(self, profiler, view, response):
+        # Inspect with `python -m pstats <file>` or snakeviz
+        directory = str(getattr(settings, 'RGO_PROFILE_DIR', os.path.join(graph_utils.get_cache_dir(), 'profiles')))
+        path = os.path.join(directory, f"{view}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning("Could not write request profile %s: %s", path, e)
+            return
+        response.headers['X-RGO-Profile-File'] = os.path.basename(path)
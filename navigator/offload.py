@@ -0,0 +1,113 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+from django.conf import settings
+
+# Executors: rdflib work for the async views, and SPARQL queries, which mostly
+# wait on the worker pool (sparql_pool) for up to RGO_SPARQL_TIMEOUT each
+GRAPH = 'graph'
+SPARQL = 'sparql'
+_SIZES = {GRAPH: ('RGO_ASYNC_WORKERS', 4), SPARQL: ('RGO_SPARQL_ASYNC_WORKERS', 8)}
+
+# Reentrant: a call that finishes at once runs its done callback while the lock is held
+_lock = threading.RLock()
+_executors = {}
+_in_flight = {}  # key -> concurrent.futures.Future of the running call
+
+_DONE = object()
+
+
+def _after_fork():
+    # A forked child (SPARQL pool worker) has none of the executor threads, and the
+    # lock may have been held by one of them
+    global _lock
+    _lock = threading.RLock()
+    _executors.clear()
+    _in_flight.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _get_executor(name):
+    with _lock:
+        if name not in _executors:
+            setting, default = _SIZES[name]
+            _executors[name] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=getattr(settings, setting, default),
+                thread_name_prefix=f'rgo-{name}',
+            )
+        return _executors[name]
+
+
+def _submit(name, func, args, kwargs):
+    # Run in a copy of the caller's context, so phases timed in the worker thread
+    # still end up in the request's Server-Timing header
+    context = contextvars.copy_context()
+    return _get_executor(name).submit(context.run, func, *args, **kwargs)
+
+
+def _forget(key, future):
+    with _lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+async def _run(name, func, args, kwargs, key):
+    if key is None:
+        return await asyncio.wrap_future(_submit(name, func, args, kwargs))
+
+    with _lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = _in_flight[key] = _submit(name, func, args, kwargs)
+            future.add_done_callback(lambda done: _forget(key, done))
+    # A client that goes away must not cancel the computation for the others
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+async def run(func, *args, key=None, **kwargs):
+    """Await func(*args, **kwargs) run on the bounded graph executor (RGO_ASYNC_WORKERS threads).
+
+    rdflib work is CPU-bound and holds the GIL for long stretches, so the async views
+    hand it to a fixed number of threads instead of one sync_to_async thread each.
+    Calls with the same key while one is running share its result (request
+    coalescing): key must identify the result, e.g. include the graph version.
+    Shared results must not be mutated by the caller.
+    """
+    return await _run(GRAPH, func, args, kwargs, key)
+
+
+async def run_sparql(func, *args, key=None, **kwargs):
+    """Like run(), on the SPARQL executor (RGO_SPARQL_ASYNC_WORKERS threads).
+
+    Slow queries wait there for the pool, so they cannot hold up page rendering.
+    """
+    return await _run(SPARQL, func, args, kwargs, key)
+
+
+async def iterate_sparql(iterable):
+    """Async iterator over a blocking one; each next() runs on the SPARQL executor.
+
+    If the consumer stops early (e.g. the client went away), the iterator is closed
+    in a thread once any next() still running there has returned.
+    """
+    iterator = iter(iterable)
+    future = None
+    try:
+        while True:
+            future = _submit(SPARQL, next, (iterator, _DONE), {})
+            item = await asyncio.wrap_future(future)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            if future is not None and not future.done():
+                future.add_done_callback(lambda _: close())
+            else:
+                _submit(SPARQL, close, (), {})
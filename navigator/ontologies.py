@@ -0,0 +1,271 @@
+import hashlib
+import logging
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import rdflib
+import rdflib.plugins.sparql
+from rdflib.namespace import RDF, OWL
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# FROM / FROM NAMED / GRAPH only ever see the graphs loaded here; never fetch from the web
+rdflib.plugins.sparql.SPARQL_LOAD_GRAPHS = False
+
+# inputs digest -> the documents iter_documents() yielded, so listing them does not parse again
+_DOCUMENTS = {}
+
+# Parser per file extension; anything else goes through rdflib's guess
+FORMATS = {
+    '.ttl': 'turtle',
+    '.owl': 'xml',
+    '.rdf': 'xml',
+    '.rdfs': 'xml',
+    '.nt': 'nt',
+    '.jsonld': 'json-ld',
+}
+
+
+def get_ontology_dir():
+    return str(getattr(settings, 'RGO_ONTOLOGY_DIR', os.path.join(settings.BASE_DIR, 'ontology')))
+
+
+def get_root_ontologies():
+    """Absolute paths of the ontologies listed in RGO_ONTOLOGIES (relative to RGO_ONTOLOGY_DIR)."""
+    names = getattr(settings, 'RGO_ONTOLOGIES', ['ritualgrammar.ttl'])
+    return [os.path.join(get_ontology_dir(), str(name)) for name in names]
+
+
+def get_catalog_path():
+    return str(getattr(settings, 'RGO_ONTOLOGY_CATALOG', os.path.join(get_ontology_dir(), 'catalog-v001.xml')))
+
+
+def read_catalog(catalog_path=None):
+    """{ontology IRI: local file} from a Protege XML catalog.
+
+    Entries whose uri is another IRI (e.g. cidoc-crm/7.1.3/ -> cidoc-crm/) are
+    followed until they reach a file. Entries pointing at missing files are dropped.
+    """
+    catalog_path = catalog_path or get_catalog_path()
+    if not os.path.exists(catalog_path):
+        return {}
+    base = os.path.dirname(catalog_path)
+    targets = {}
+    for el in ET.parse(catalog_path).getroot().iter():
+        if el.tag.endswith('uri') and el.get('name') and el.get('uri'):
+            targets[el.get('name')] = el.get('uri')
+
+    catalog = {}
+    for name in targets:
+        target, seen = targets[name], {name}
+        while target in targets and target not in seen:
+            seen.add(target)
+            target = targets[target]
+        local = os.path.join(base, target)
+        if '://' not in target and os.path.isfile(local):
+            catalog[name] = local
+    return catalog
+
+
+def resolve_imports():
+    return getattr(settings, 'RGO_RESOLVE_IMPORTS', True)
+
+
+def input_files():
+    """Every file that can end up in the dataset, for versioning."""
+    paths = list(get_root_ontologies())
+    if resolve_imports() and os.path.exists(get_catalog_path()):
+        paths.append(get_catalog_path())
+        paths += sorted(set(read_catalog().values()))
+    return paths
+
+
+def inputs_digest(h):
+    """Feed the dataset configuration and the content of its input files into hash h."""
+    h.update(f"imports={resolve_imports()}".encode())
+    for path in input_files():
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h
+
+
+def _lookup(catalog, iri):
+    iri = str(iri)
+    if iri in catalog:
+        return catalog[iri]
+    # Imports are written with and without the trailing '/' or '#'
+    for name, path in catalog.items():
+        if name.rstrip('/#') == iri.rstrip('/#'):
+            return path
+    return None
+
+
+def _format_for(path):
+    return FORMATS.get(os.path.splitext(path)[1].lower()) or rdflib.util.guess_format(path) or 'xml'
+
+
+def _import_cache_path(path):
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    from .graph_utils import get_cache_dir
+    return os.path.join(get_cache_dir(), 'imports', f"{os.path.basename(path)}-{digest[:16]}.nt")
+
+
+def _parse_import(path):
+    # Imported vocabularies (CRM alone is several MB of RDF/XML) are kept as N-Triples,
+    # keyed by file hash, which rdflib parses several times faster
+    cache_path = _import_cache_path(path)
+    graph = rdflib.Graph()
+    if os.path.exists(cache_path):
+        try:
+            return graph.parse(cache_path, format='nt')
+        except Exception as e:
+            logger.warning("Ignoring unreadable import cache %s: %s", cache_path, e)
+            graph = rdflib.Graph()
+
+    graph.parse(path, format=_format_for(path))
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.nt', dir=os.path.dirname(cache_path))
+        os.close(fd)
+        try:
+            graph.serialize(destination=tmp_path, format='nt', encoding='utf-8')
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except OSError as e:
+        logger.warning("Could not cache parsed import %s: %s", path, e)
+    return graph
+
+
+def _graph_name(graph, path, taken):
+    # Name the graph after the ontology it declares, so FROM <http://www.cidoc-crm.org/cidoc-crm/> works
+    for iri in sorted(graph.subjects(RDF.type, OWL.Ontology)):
+        if isinstance(iri, rdflib.URIRef) and iri not in taken:
+            return iri
+    return rdflib.URIRef(Path(path).resolve().as_uri())
+
+
+def iter_documents():
+    """Yield (document, graph) for the root ontologies and, transitively, their imports.
+
+    document is {'graph': named graph IRI, 'path': local file, 'root': bool}. Imports
+    are resolved offline through the catalog; ones it does not map are skipped with a warning.
+    """
+    catalog = read_catalog() if resolve_imports() else {}
+    queue = [(path, True) for path in get_root_ontologies()]
+    seen, taken, unresolved = set(), set(), set()
+    while queue:
+        path, root = queue.pop(0)
+        if os.path.abspath(path) in seen:
+            continue
+        seen.add(os.path.abspath(path))
+
+        graph = rdflib.Graph()
+        if root:
+            with metrics.timed('parse'):
+                graph.parse(path, format=_format_for(path))
+        else:
+            with metrics.timed('parse_import'):
+                graph = _parse_import(path)
+        name = _graph_name(graph, path, taken)
+        taken.add(name)
+
+        if resolve_imports():
+            for iri in sorted(set(graph.objects(None, OWL.imports))):
+                local = _lookup(catalog, iri)
+                if local:
+                    queue.append((local, False))
+                elif str(iri).rstrip('/#') not in {str(t).rstrip('/#') for t in taken}:
+                    unresolved.add(str(iri))
+        yield {'graph': name, 'path': path, 'root': root}, graph
+
+    if unresolved:
+        logger.warning("Skipped imports not mapped in %s: %s",
+                       os.path.basename(get_catalog_path()), ', '.join(sorted(unresolved)))
+
+
+def load_dataset():
+    """All ontologies in an rdflib.Dataset, one named graph each.
+
+    The default graph is the union of the named graphs, so plain queries see
+    everything while FROM / GRAPH can target a single ontology.
+    """
+    key = _documents_key()
+    dataset = rdflib.Dataset(default_union=True)
+    documents = []
+    for document, graph in iter_documents():
+        # Roots come first, so their prefixes win over the imported vocabularies'
+        for prefix, namespace in graph.namespaces():
+            dataset.bind(prefix, namespace, override=False)
+        context = dataset.graph(document['graph'])
+        context.addN((s, p, o, context) for s, p, o in graph)
+        documents.append(document)
+    _DOCUMENTS[key] = documents
+    return dataset
+
+
+def _documents_key():
+    return inputs_digest(hashlib.sha256()).hexdigest()
+
+
+def documents():
+    """The documents of iter_documents(), parsed only if load_dataset() has not run in this process."""
+    key = _documents_key()
+    if key not in _DOCUMENTS:
+        _DOCUMENTS[key] = [document for document, graph in iter_documents()]
+    return _DOCUMENTS[key]
+
+
+def reason_over_imports():
+    return getattr(settings, 'RGO_REASON_OVER_IMPORTS', False)
+
+
+def reasoned_graph_names():
+    """Named graphs the reasoner runs over (see reasoning_graph)."""
+    return [document['graph'] for document in documents() if document['root'] or reason_over_imports()]
+
+
+def reasoning_graph(dataset=None):
+    """Plain graph of what the reasoner runs over.
+
+    Only the root ontologies unless RGO_REASON_OVER_IMPORTS is set, since HermiT
+    over the full CRM and PROV vocabularies is much slower and adds little to navigation.
+    With a loaded dataset, its (possibly edited) named graphs are used instead of the files.
+    """
+    combined = rdflib.Graph()
+    if isinstance(dataset, rdflib.Dataset):
+        for name in reasoned_graph_names():
+            combined += dataset.graph(name)
+        return combined
+    for document, graph in iter_documents():
+        if document['root'] or reason_over_imports():
+            combined += graph
+    return combined
+
+
+def default_graph_name():
+    """Named graph of the first root ontology, where edits go unless told otherwise."""
+    return documents()[0]['graph']
+
+
+def copy_dataset(source):
+    """A fresh in-memory Dataset with the named graphs of source."""
+    dataset = rdflib.Dataset(default_union=True)
+    for prefix, namespace in source.namespaces():
+        dataset.bind(prefix, namespace)
+    if isinstance(source, rdflib.Dataset):
+        for s, p, o, c in source.quads((None, None, None, None)):
+            if c is not None:
+                dataset.add((s, p, o, c))
+    else:
+        # Stores without named graphs (owlready2) come back as a single graph
+        dataset.addN((s, p, o, dataset.default_context) for s, p, o in source.triples((None, None, None)))
+    return dataset
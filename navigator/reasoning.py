@@ -0,0 +1,297 @@
+from collections import defaultdict
+
+from rdflib.namespace import RDF, RDFS, OWL
+
+# Schema predicates RuleMaterializer.from_graph reads rules from
+AXIOM_PREDICATES = {RDFS.subPropertyOf, RDFS.subClassOf, OWL.inverseOf}
+
+
+class RuleMaterializer:
+    """Incremental forward-chaining for the navigation rules.
+
+    Covers the same rules as materialize():
+      - p transitive:            p(x, y), p(y, z) -> p(x, z)
+      - sub subPropertyOf sup:   sub(x, y) -> sup(x, y)
+      - chain p <- [a, b]:       a(x, y), b(y, z) -> p(x, z)
+      - p inverseOf q:           p(x, y) -> q(y, x), and back
+      - c subClassOf d:          type(x, c) -> type(x, d)
+
+    Additions are propagated semi-naively (only new facts are joined against
+    the rest); removals use delete/rederive (DRed): everything that may depend
+    on a removed fact is retracted, then whatever still has another derivation
+    is put back. Facts are (s, p, o) tuples of rdflib terms.
+    """
+
+    def __init__(self, transitive=(), subproperties=(), chains=(), inverses=(), subclasses=()):
+        self.transitive = set(transitive)
+        self.superproperties = defaultdict(set)
+        self.subproperties = defaultdict(set)
+        for sub, sup in subproperties:
+            self.superproperties[sub].add(sup)
+            self.subproperties[sup].add(sub)
+        self.chains = []
+        for prop, chain in chains:
+            if len(chain) != 2:
+                raise ValueError(f"Only two-link property chains are supported: {prop}")
+            self.chains.append((prop, chain[0], chain[1]))
+        self.inverses = defaultdict(set)
+        for p, q in inverses:
+            self.inverses[p].add(q)
+            self.inverses[q].add(p)
+        self.superclasses = defaultdict(set)
+        self.subclasses = defaultdict(set)
+        for sub, sup in subclasses:
+            self.superclasses[sub].add(sup)
+            self.subclasses[sup].add(sub)
+        self.predicates = (self.transitive | set(self.superproperties) | set(self.subproperties)
+                           | {p for chain in self.chains for p in chain} | set(self.inverses))
+        if self.superclasses:
+            self.predicates.add(RDF.type)
+
+        self.asserted = set()
+        self.facts = set()
+        self._out = defaultdict(lambda: defaultdict(set))  # p -> s -> {o}
+        self._in = defaultdict(lambda: defaultdict(set))   # p -> o -> {s}
+
+    def relevant(self, triple):
+        return triple[1] in self.predicates
+
+    @staticmethod
+    def is_axiom(triple):
+        """True for the schema triples the rules are read from (see from_graph)."""
+        s, p, o = triple
+        return p in AXIOM_PREDICATES or (p == RDF.type and o == OWL.TransitiveProperty)
+
+    def holds(self, triple):
+        return triple in self.facts
+
+    def inferred(self):
+        """Facts that are derived but not asserted."""
+        return self.facts - self.asserted
+
+    def _store(self, fact):
+        s, p, o = fact
+        self.facts.add(fact)
+        self._out[p][s].add(o)
+        self._in[p][o].add(s)
+
+    def _discard(self, fact):
+        s, p, o = fact
+        self.facts.discard(fact)
+        self._out[p][s].discard(o)
+        self._in[p][o].discard(s)
+
+    def _consequences(self, fact):
+        """Facts derivable in one step with `fact` as one premise and known facts as the other."""
+        s, p, o = fact
+        if p in self.transitive:
+            for z in self._out[p].get(o, ()):
+                yield (s, p, z)
+            for x in self._in[p].get(s, ()):
+                yield (x, p, o)
+        for sup in self.superproperties.get(p, ()):
+            yield (s, sup, o)
+        for prop, a, b in self.chains:
+            if p == a:
+                for z in self._out[b].get(o, ()):
+                    yield (s, prop, z)
+            if p == b:
+                for x in self._in[a].get(s, ()):
+                    yield (x, prop, o)
+        for q in self.inverses.get(p, ()):
+            yield (o, q, s)
+        if p == RDF.type:
+            for sup in self.superclasses.get(o, ()):
+                yield (s, p, sup)
+
+    def _derivable(self, fact):
+        """True if `fact` follows in one step from the facts currently held."""
+        s, p, o = fact
+        if p in self.transitive:
+            if any(o in self._out[p].get(y, ()) for y in self._out[p].get(s, ())):
+                return True
+        for sub in self.subproperties.get(p, ()):
+            if o in self._out[sub].get(s, ()):
+                return True
+        for prop, a, b in self.chains:
+            if p == prop and any(o in self._out[b].get(y, ()) for y in self._out[a].get(s, ())):
+                return True
+        for q in self.inverses.get(p, ()):
+            if s in self._out[q].get(o, ()):
+                return True
+        if p == RDF.type and any(c in self._out[p].get(s, ()) for c in self.subclasses.get(o, ())):
+            return True
+        return False
+
+    def _insert(self, facts):
+        added = set()
+        delta = []
+        for fact in facts:
+            if fact not in self.facts:
+                self._store(fact)
+                added.add(fact)
+                delta.append(fact)
+        # Semi-naive: each round only joins the facts that are new in the previous one
+        while delta:
+            next_delta = []
+            for fact in delta:
+                for derived in list(self._consequences(fact)):
+                    if derived not in self.facts:
+                        self._store(derived)
+                        added.add(derived)
+                        next_delta.append(derived)
+            delta = next_delta
+        return added
+
+    def add(self, triples):
+        """Assert triples; returns the set of facts that became true."""
+        new = [t for t in triples if self.relevant(t) and t not in self.asserted]
+        self.asserted.update(new)
+        return self._insert(new)
+
+    def remove(self, triples):
+        """Retract asserted triples; returns the set of facts that stopped being true."""
+        gone = [t for t in triples if t in self.asserted]
+        self.asserted.difference_update(gone)
+
+        # Overdelete: everything with a derivation that used a removed fact
+        overdeleted = set(t for t in gone if t in self.facts)
+        queue = list(overdeleted)
+        while queue:
+            fact = queue.pop()
+            for derived in list(self._consequences(fact)):
+                if derived in self.facts and derived not in overdeleted:
+                    overdeleted.add(derived)
+                    queue.append(derived)
+        for fact in overdeleted:
+            self._discard(fact)
+
+        # Rederive what is still asserted or has an alternative derivation
+        survivors = [f for f in overdeleted if f in self.asserted or self._derivable(f)]
+        restored = self._insert(survivors)
+        return overdeleted - restored
+
+    def apply(self, added=(), removed=()):
+        """Apply one edit. Returns {'added': facts now true, 'removed': facts no longer true}."""
+        lost = self.remove(removed)
+        gained = self.add(added)
+        return {'added': gained - lost, 'removed': lost - gained}
+
+    @classmethod
+    def from_graph(cls, graph, transitive=(), subproperties=(), chains=()):
+        """Materializer over graph for the given axioms plus the graph's own, like materialize()."""
+        materializer = cls(
+            list(transitive) + list(graph.subjects(RDF.type, OWL.TransitiveProperty)),
+            list(subproperties) + list(graph.subject_objects(RDFS.subPropertyOf)),
+            chains,
+            graph.subject_objects(OWL.inverseOf),
+            graph.subject_objects(RDFS.subClassOf),
+        )
+        materializer.add(t for p in materializer.predicates for t in graph.triples((None, p, None)))
+        return materializer
+
+
+def _close(adjacency):
+    """Transitive closure in place of {node: {successors}} over integer node ids."""
+    for node in list(adjacency):
+        reached = adjacency[node]
+        stack = list(reached)
+        while stack:
+            for successor in adjacency.get(stack.pop(), ()):
+                if successor not in reached:
+                    reached.add(successor)
+                    stack.append(successor)
+
+
+def _supers(pairs):
+    """{sub: every superproperty or superclass, transitively} from (sub, sup) pairs."""
+    adjacency = defaultdict(set)
+    for sub, sup in pairs:
+        adjacency[sub].add(sup)
+    _close(adjacency)
+    return adjacency
+
+
+def materialize(graph, transitive=(), subproperties=(), chains=()):
+    """Closure of the navigation rules over graph in one batch pass, without a reasoner.
+
+    Besides the given axioms, the graph's own owl:TransitiveProperty, rdfs:subPropertyOf,
+    owl:inverseOf and rdfs:subClassOf (with rdf:type propagation) declarations are applied,
+    which covers what HermiT derives for the navigation trees. Terms are encoded as
+    integers and closures are computed by a DFS from every node, repeating the rule
+    stages until nothing new is derived. Returns the derived triples not in graph.
+    """
+    ids, terms = {}, []
+
+    def encode(term):
+        if term not in ids:
+            ids[term] = len(terms)
+            terms.append(term)
+        return ids[term]
+
+    transitive = {encode(p) for p in transitive}
+    transitive |= {encode(p) for p in graph.subjects(RDF.type, OWL.TransitiveProperty)}
+    superproperties = _supers([(encode(s), encode(o)) for s, o in subproperties] +
+                              [(encode(s), encode(o)) for s, o in graph.subject_objects(RDFS.subPropertyOf)])
+    inverses = set()
+    for p, q in graph.subject_objects(OWL.inverseOf):
+        inverses.add((encode(p), encode(q)))
+        inverses.add((encode(q), encode(p)))
+    chains = [(encode(prop), encode(chain[0]), encode(chain[1])) for prop, chain in chains if len(chain) == 2]
+    superclasses = _supers([(encode(s), encode(o)) for s, o in graph.subject_objects(RDFS.subClassOf)])
+    rdf_type = encode(RDF.type)
+
+    predicates = set(transitive) | set(superproperties) | {q for p, q in inverses}
+    predicates |= {p for chain in chains for p in chain}
+    for sups in superproperties.values():
+        predicates |= sups
+    if superclasses:
+        predicates.add(rdf_type)
+
+    # predicate -> subject -> {objects}
+    facts = {p: defaultdict(set) for p in predicates}
+    original = set()
+    for p in predicates:
+        for s, _, o in graph.triples((None, terms[p], None)):
+            s, o = encode(s), encode(o)
+            facts[p][s].add(o)
+            original.add((s, p, o))
+
+    def add_all(p, pairs):
+        target, added = facts[p], False
+        for s, o in pairs:
+            if o not in target[s]:
+                target[s].add(o)
+                added = True
+        return added
+
+    def count():
+        return sum(len(objects) for by_subject in facts.values() for objects in by_subject.values())
+
+    size = -1
+    while size != count():
+        size = count()
+        for p, sups in superproperties.items():
+            pairs = [(s, o) for s, objects in facts.get(p, {}).items() for o in objects]
+            for sup in sups:
+                add_all(sup, pairs)
+        for p, q in inverses:
+            add_all(q, [(o, s) for s, objects in list(facts[p].items()) for o in objects])
+        for p in transitive:
+            _close(facts[p])
+        for prop, a, b in chains:
+            add_all(prop, [(s, z) for s, middles in list(facts[a].items())
+                           for m in middles for z in facts[b].get(m, ())])
+        if superclasses:
+            types = facts[rdf_type]
+            for s in list(types):
+                for c in list(types[s]):
+                    types[s] |= superclasses.get(c, set())
+
+    derived = set()
+    for p, by_subject in facts.items():
+        for s, objects in by_subject.items():
+            for o in objects:
+                if (s, p, o) not in original:
+                    derived.add((terms[s], terms[p], terms[o]))
+    return derived
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NOT_LOADED = 'not_loaded'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class GraphRegistry:
+    """Process-wide holder for the loaded graphs.
+
+    Loading is single-flight: the first caller for a name runs the loader while
+    concurrent callers wait on the same lock and then reuse its result, so a burst
+    of first requests triggers one parse / one reasoner run instead of one each.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # SPARQL pool workers are forked from a process that may be loading a graph
+        # in another thread; that thread does not exist in the child
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Locks held by parent threads would never be released in the child. Keep the
+        # finished graphs, forget loads that were still running, and start with fresh locks.
+        self._lock = threading.Lock()
+        self._entries = {name: {**entry, 'lock': threading.Lock(), 'thread': None}
+                         for name, entry in self._entries.items() if entry['state'] in (READY, FAILED)}
+
+    def _entry(self, name):
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = {
+                    'lock': threading.Lock(),
+                    'state': NOT_LOADED,
+                    'value': None,
+                    'error': None,
+                    'loaded_at': None,
+                    'load_seconds': None,
+                    'thread': None,
+                }
+            return self._entries[name]
+
+    def get(self, name, loader):
+        entry = self._entry(name)
+        # Fast path without locking once the graph is in place
+        if entry['state'] == READY:
+            return entry['value']
+
+        with entry['lock']:
+            if entry['state'] == READY:
+                return entry['value']
+            entry['state'] = LOADING
+            entry['error'] = None
+            start = time.perf_counter()
+            try:
+                value = loader()
+            except Exception as e:
+                entry['state'] = FAILED
+                entry['error'] = str(e)
+                raise
+            entry['value'] = value
+            entry['load_seconds'] = round(time.perf_counter() - start, 3)
+            entry['loaded_at'] = time.time()
+            entry['state'] = READY
+            return value
+
+    def start(self, name, loader):
+        """Load in a daemon thread unless a load has already been attempted."""
+        entry = self._entry(name)
+        with self._lock:
+            if entry['state'] != NOT_LOADED or entry['thread']:
+                return False
+            entry['thread'] = threading.Thread(target=self._load_quietly, args=(name, loader),
+                                               name=f'graph-loader-{name}', daemon=True)
+        entry['thread'].start()
+        return True
+
+    def _load_quietly(self, name, loader):
+        try:
+            self.get(name, loader)
+        except Exception as e:
+            # The failure is recorded on the entry and reported by status()
+            logger.warning("Background load of %s graph failed: %s", name, e)
+
+    def replace(self, name, value):
+        """Swap a loaded graph for another one, e.g. an edited copy."""
+        entry = self._entry(name)
+        with entry['lock']:
+            entry['value'] = value
+            entry['state'] = READY
+
+    def state(self, name):
+        return self._entry(name)['state']
+
+    def is_ready(self, name):
+        return self.state(name) == READY
+
+    def reset(self, name=None):
+        with self._lock:
+            names = [name] if name else list(self._entries)
+            for n in names:
+                self._entries.pop(n, None)
+
+    def status(self, names):
+        report = {}
+        for name in names:
+            entry = self._entry(name)
+            report[name] = {
+                'state': entry['state'],
+                'error': entry['error'],
+                'loaded_at': entry['loaded_at'],
+                'load_seconds': entry['load_seconds'],
+            }
+        return report
@@ -0,0 +1,136 @@
+import bisect
+import unicodedata
+
+# Devanagari signs that only change the spelling, not the word, so "kalaśa" typed
+# with or without a nukta, or chandrabindu vs anusvara, finds the same label
+DEVANAGARI_FOLD = {
+    '\u093c': '',        # nukta
+    '\u0901': '\u0902',  # chandrabindu -> anusvara
+    '\u200c': '',        # zero width non-joiner
+    '\u200d': '',        # zero width joiner
+}
+
+
+def _is_devanagari(char):
+    return '\u0900' <= char <= '\u097f' or '\ua8e0' <= char <= '\ua8ff'
+
+
+def normalize(text):
+    """Case- and accent-insensitive form of text for matching.
+
+    Latin diacritics are dropped (Pāṇigrahaṇa -> panigrahana). Devanagari vowel
+    signs and viramas are combining marks too but carry the word, so they are kept;
+    only the spelling variants in DEVANAGARI_FOLD are folded.
+    """
+    decomposed = unicodedata.normalize('NFD', unicodedata.normalize('NFKC', str(text)).casefold())
+    out = []
+    previous = ''
+    for char in decomposed:
+        if char in DEVANAGARI_FOLD:
+            char = DEVANAGARI_FOLD[char]
+        elif unicodedata.category(char) == 'Mn' and not _is_devanagari(previous) and not _is_devanagari(char):
+            continue
+        out.append(char)
+        if char:
+            previous = char
+    return unicodedata.normalize('NFC', ''.join(out))
+
+
+def tokenize(text):
+    """Normalized words of text. Letters, digits and combining marks form words."""
+    text = normalize(text)
+    return ''.join(c if unicodedata.category(c)[0] in 'LMN' else ' ' for c in text).split()
+
+
+class SearchIndex:
+    """Inverted index over the label and description literals of the graph.
+
+    Documents are added as add(uri, label, field, text); each field has a weight.
+    Tokens are kept sorted, so the tokens starting with a prefix are one bisect
+    range (a flattened prefix trie) and typeahead never scans the vocabulary.
+    """
+
+    # Score of a hit per field; the label fields match the label index's priority
+    FIELD_WEIGHTS = {'altLabel': 4.0, 'prefLabel': 4.0, 'label': 3.0, 'description': 1.0}
+    # A token that is only a prefix of the indexed word counts for less
+    PREFIX_FACTOR = 0.5
+
+    def __init__(self):
+        self.uris = []
+        self.labels = []
+        self._label_keys = []  # normalized label per doc, for ranking labels that start with the query
+        self._ids = {}
+        self._names = {}     # normalized label text -> doc ids, for whole-label matches
+        self._postings = {}  # token -> {doc id: best field weight}
+        self._tokens = None  # sorted vocabulary, built on first query
+
+    def __len__(self):
+        return len(self.uris)
+
+    def add(self, uri, label, field, text):
+        uri = str(uri)
+        if uri not in self._ids:
+            self._ids[uri] = len(self.uris)
+            self.uris.append(uri)
+            self.labels.append(str(label))
+            self._label_keys.append(' '.join(tokenize(label)))
+        doc = self._ids[uri]
+        weight = self.FIELD_WEIGHTS.get(field, 1.0)
+        for token in tokenize(text):
+            postings = self._postings.setdefault(token, {})
+            postings[doc] = max(postings.get(doc, 0.0), weight)
+        if field != 'description':
+            self._names.setdefault(' '.join(tokenize(text)), set()).add(doc)
+        self._tokens = None
+
+    def _vocabulary(self):
+        if self._tokens is None:
+            self._tokens = sorted(self._postings)
+        return self._tokens
+
+    def _completions(self, prefix):
+        tokens = self._vocabulary()
+        start = bisect.bisect_left(tokens, prefix)
+        end = bisect.bisect_left(tokens, prefix + '\U0010ffff', start)
+        return tokens[start:end]
+
+    def _matches(self, token, prefix):
+        """{doc id: score} for one query token; the last token of a query may be a prefix."""
+        scores = dict(self._postings.get(token, {}))
+        if prefix:
+            for completion in self._completions(token):
+                if completion == token:
+                    continue
+                for doc, weight in self._postings[completion].items():
+                    scores[doc] = max(scores.get(doc, 0.0), weight * self.PREFIX_FACTOR)
+        return scores
+
+    def search(self, query, limit=20):
+        """[(uri, label, score)] for documents containing every query token, best first.
+
+        The last token also matches as a prefix (typeahead). Labels equal to the whole
+        query, or starting with it, are ranked first.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores = None
+        for position, token in enumerate(tokens):
+            matches = self._matches(token, prefix=position == len(tokens) - 1)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {doc: score + matches[doc] for doc, score in scores.items() if doc in matches}
+            if not scores:
+                return []
+
+        phrase = ' '.join(tokens)
+        for doc in self._names.get(phrase, ()):
+            if doc in scores:
+                scores[doc] += 10.0
+        for doc in scores:
+            if self._label_keys[doc].startswith(phrase):
+                scores[doc] += 5.0
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.labels[item[0]], self.uris[item[0]]))
+        return [(self.uris[doc], self.labels[doc], score) for doc, score in ranked[:limit]]
@@ -0,0 +1,94 @@
+import random
+from array import array
+
+# Mersenne prime for the MinHash permutations (a * x + b) mod P
+_PRIME = (1 << 61) - 1
+
+
+class SimilarityIndex:
+    """Module sets of rituals, compared by Jaccard similarity.
+
+    Each ritual is a set of features (strings such as 'part:<uri>' or 'actor:<uri>'),
+    stored as a sorted array of integer feature ids for exact Jaccard and shared
+    lists. MinHash signatures, split into LSH bands, give nearest-neighbour
+    candidates without comparing a ritual against every other one.
+    """
+
+    def __init__(self, modules, labels=None, num_perm=64, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.features = sorted({f for features in modules.values() for f in features})
+        feature_ids = {f: i for i, f in enumerate(self.features)}
+        self.uris = sorted(modules)
+        self.labels = [(labels or {}).get(uri, uri) for uri in self.uris]
+        self._ids = {uri: i for i, uri in enumerate(self.uris)}
+        self.sets = [array('i', sorted(feature_ids[f] for f in modules[uri])) for uri in self.uris]
+
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self.signatures = [self._signature(s) for s in self.sets]
+
+        # Rituals whose signatures agree on all rows of a band are candidates for each other
+        self.rows = num_perm // bands
+        self._buckets = {}
+        for i, signature in enumerate(self.signatures):
+            for band in range(bands):
+                key = (band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                self._buckets.setdefault(key, []).append(i)
+        self._bands = bands
+
+    def _signature(self, feature_ids):
+        if not feature_ids:
+            return array('Q', [_PRIME] * len(self._permutations))
+        return array('Q', [min((a * x + b) % _PRIME for x in feature_ids) for a, b in self._permutations])
+
+    def __len__(self):
+        return len(self.uris)
+
+    def id_of(self, uri):
+        return self._ids.get(str(uri))
+
+    def jaccard(self, i, j):
+        a, b = set(self.sets[i]), set(self.sets[j])
+        union = len(a | b)
+        return len(a & b) / union if union else 0.0
+
+    def estimated_jaccard(self, i, j):
+        """Jaccard estimate from the MinHash signatures (fraction of equal minima)."""
+        si, sj = self.signatures[i], self.signatures[j]
+        return sum(x == y for x, y in zip(si, sj)) / len(si)
+
+    def shared(self, i, j):
+        """Features of both rituals, in feature order."""
+        b = set(self.sets[j])
+        return [self.features[f] for f in self.sets[i] if f in b]
+
+    def only(self, i, j):
+        """Features of ritual i that ritual j lacks."""
+        b = set(self.sets[j])
+        return [self.features[f] for f in self.sets[i] if f not in b]
+
+    def candidates(self, i):
+        """Rituals sharing at least one LSH band with ritual i."""
+        found = set()
+        signature = self.signatures[i]
+        for band in range(self._bands):
+            key = (band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            found.update(self._buckets.get(key, ()))
+        found.discard(i)
+        return found
+
+    def neighbors(self, i, k=10):
+        """[(j, jaccard)] of the k most similar rituals, best first.
+
+        LSH candidates are ranked by exact Jaccard; when they are fewer than k, the
+        remaining rituals with any shared feature are ranked as well.
+        """
+        candidates = self.candidates(i)
+        if len(candidates) < k:
+            own = set(self.sets[i])
+            candidates.update(j for j, s in enumerate(self.sets) if j != i and not own.isdisjoint(s))
+        scored = [(j, self.jaccard(i, j)) for j in candidates]
+        scored = [(j, score) for j, score in scored if score > 0]
+        scored.sort(key=lambda item: (-item[1], self.labels[item[0]], self.uris[item[0]]))
+        return scored[:k]
@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+
+import rdflib
+
+# format -> content type of the streamed response
+CONTENT_TYPES = {
+    'json': 'application/sparql-results+json',
+    'csv': 'text/csv; charset=utf-8',
+    'tsv': 'text/tab-separated-values; charset=utf-8',
+}
+
+
+def _json_term(term):
+    if isinstance(term, rdflib.URIRef):
+        return {'type': 'uri', 'value': str(term)}
+    if isinstance(term, rdflib.BNode):
+        return {'type': 'bnode', 'value': str(term)}
+    value = {'type': 'literal', 'value': str(term)}
+    if term.language:
+        value['xml:lang'] = term.language
+    elif term.datatype:
+        value['datatype'] = str(term.datatype)
+    return value
+
+
+def stream_json(variables, rows):
+    # SPARQL 1.1 Query Results JSON Format, one binding per chunk
+    yield '{"head": {"vars": %s}, "results": {"bindings": [' % json.dumps(variables)
+    separator = '\n'
+    for row in rows:
+        binding = {var: _json_term(term) for var, term in zip(variables, row) if term is not None}
+        yield separator + json.dumps(binding)
+        separator = ',\n'
+    yield '\n]}}\n'
+
+
+def _csv_term(term):
+    if term is None:
+        return ''
+    # Blank nodes keep their '_:' prefix so they can be told apart from IRIs and literals
+    if isinstance(term, rdflib.BNode):
+        return term.n3()
+    return str(term)
+
+
+def stream_csv(variables, rows):
+    # SPARQL 1.1 CSV: plain lexical values
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    writer.writerow(variables)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_csv_term(term) for term in row])
+        yield buffer.getvalue()
+
+
+def _tsv_term(term):
+    if term is None:
+        return ''
+    if not isinstance(term, rdflib.Literal):
+        return term.n3()
+    # Single-line N-Triples literal; raw tabs and newlines would break the row
+    escaped = (str(term).replace('\\', '\\\\').replace('"', '\\"')
+               .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'))
+    if term.language:
+        return f'"{escaped}"@{term.language}'
+    if term.datatype:
+        return f'"{escaped}"^^<{term.datatype}>'
+    return f'"{escaped}"'
+
+
+def stream_tsv(variables, rows):
+    # SPARQL 1.1 TSV: variables with '?', terms in N-Triples syntax
+    yield '\t'.join(f'?{var}' for var in variables) + '\n'
+    for row in rows:
+        yield '\t'.join(_tsv_term(term) for term in row) + '\n'
+
+
+STREAMERS = {
+    'json': stream_json,
+    'csv': stream_csv,
+    'tsv': stream_tsv,
+}
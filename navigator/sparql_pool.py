@@ -0,0 +1,313 @@
+import atexit
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rows per message when a worker streams results back
+STREAM_CHUNK_ROWS = 500
+
+# Set in pool workers, which never run the reasoner (see apps.py and _build_inferred_graph)
+WORKER_ENV = 'RGO_SPARQL_WORKER'
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _after_fork():
+    # Workers are forked from a threaded server: fresh lock, and no share in the parent's pool
+    global _lock, _pool
+    _lock = threading.Lock()
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _init_worker(settings_module):
+    os.environ[WORKER_ENV] = '1'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    from . import stores
+    from .graph_utils import graphs, has_edits
+    if stores.get_store_config()['BACKEND'] != stores.MEMORY and not has_edits():
+        # Store handles (SQLite, BerkeleyDB) must not be shared across fork; reopen them here.
+        # Edited graphs are in-memory copies (see update_graph) and are kept.
+        graphs.reset()
+
+
+def _run_in_worker(query, inferred, init_bindings, offset, limit):
+    # Forked workers inherit already-loaded graphs; spawned ones load (or read the
+    # inferred snapshot) on their first query. Loaded up front, so an inferred graph
+    # the server has not built yet fails the query (GraphNotReady) instead of its rows.
+    from .graph_utils import _execute_sparql_query, load_graph
+    load_graph(inferred=inferred)
+    return _execute_sparql_query(query, inferred=inferred, init_bindings=init_bindings,
+                                 offset=offset, limit=limit)
+
+
+@functools.lru_cache(maxsize=64)
+def _prepare_bundled(text):
+    from rdflib.plugins.sparql import prepareQuery
+    from .sparql_registry import DEFAULT_NAMESPACES
+    return prepareQuery(text, initNs=DEFAULT_NAMESPACES)
+
+
+def _run_timed_in_worker(query, inferred, init_bindings, offset, limit, bundled=False):
+    # Prepared queries do not pickle, so bundled queries arrive as text and are
+    # prepared once per worker with the same prefixes as sparql_registry uses
+    if bundled:
+        query = _prepare_bundled(query)
+    # The phases are sent back with the result, since metrics live in the parent process
+    with metrics.capture() as phases:
+        result = _run_in_worker(query, inferred, init_bindings, offset, limit)
+    return result, phases
+
+
+def _stream_in_worker(query, inferred, init_bindings, max_rows):
+    # Yields (type, vars) first, so parse errors surface before any row, then lists of rows
+    from .graph_utils import iter_sparql_query
+    kind, variables, rows = iter_sparql_query(query, inferred=inferred, init_bindings=init_bindings)
+    yield kind, variables
+    rows = itertools.islice(rows, max_rows)
+    while True:
+        chunk = list(itertools.islice(rows, STREAM_CHUNK_ROWS))
+        if not chunk:
+            return
+        yield chunk
+
+
+class QueryError(Exception):
+    """A query the pool could not answer; error_code is 'timeout', 'worker_failed', 'not_ready' or None."""
+
+    def __init__(self, message, error_code=None):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def _serve(conn, settings_module):
+    """Worker process loop: run the (stream, func, args) tasks sent by the parent until the pipe closes.
+
+    Every result goes back as ('item', value) messages followed by ('done', None); a
+    streaming task sends one item per value its generator yields.
+    """
+    _init_worker(settings_module)
+    while True:
+        try:
+            stream, func, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            for item in (func(*args) if stream else [func(*args)]):
+                conn.send(('item', item))
+            conn.send(('done', None))
+        except Exception as e:
+            conn.send(('error', (str(e), getattr(e, 'error_code', None))))
+
+
+class _Worker:
+    def __init__(self, context, settings_module):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, settings_module),
+                                       name='rgo-sparql-worker', daemon=True)
+        self.process.start()
+        child.close()
+
+    def receive(self, deadline):
+        if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def close(self):
+        # The worker sees EOF and exits once its current task is done
+        self.conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.conn.close()
+        self.process.join(timeout=5)
+
+
+class _Pool:
+    """Up to `size` worker processes, each running one query at a time.
+
+    Unlike ProcessPoolExecutor, the parent knows which process runs which query, so a
+    query over the time limit is stopped by killing only its own worker.
+    """
+
+    def __init__(self, size, start_method):
+        self.size = size
+        self.context = multiprocessing.get_context(start_method)
+        self.settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'ritualgrammar_marriage.settings')
+        self.closed = False
+        self._idle = []
+        self._count = 0
+        self._available = threading.Condition()
+
+    def acquire(self, deadline):
+        with self._available:
+            while not self._idle and self._count >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            return _Worker(self.context, self.settings_module)
+        except Exception:
+            self._forget()
+            raise
+
+    def release(self, worker):
+        with self._available:
+            if not self.closed:
+                self._idle.append(worker)
+                self._available.notify()
+                return
+        worker.close()
+        self._forget()
+
+    def discard(self, worker):
+        worker.kill()
+        self._forget()
+
+    def _forget(self):
+        with self._available:
+            self._count -= 1
+            self._available.notify()
+
+    def close(self):
+        with self._available:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+            self._forget()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = _Pool(getattr(settings, 'RGO_SPARQL_WORKERS', 2), getattr(settings, 'RGO_SPARQL_START_METHOD', None))
+        return _pool
+
+
+def shutdown():
+    """Retire the current pool after the graphs changed; the next query starts fresh workers.
+
+    Queries already running finish on the old workers.
+    """
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(shutdown)
+
+
+def _replies(func, args, timeout, stream=False):
+    """Run func(*args) on a pooled worker and yield what it sends back, all within timeout seconds.
+
+    Raises QueryError on timeout, on a dead worker and on errors raised in the worker.
+    A worker that does not finish (timeout, or the caller stops early) is killed.
+    """
+    deadline = time.monotonic() + timeout
+    pool = _get_pool()
+    worker = None
+    finished = False
+    try:
+        worker = pool.acquire(deadline)
+        worker.conn.send((stream, func, args))
+        while True:
+            status, payload = worker.receive(deadline)
+            if status == 'item':
+                yield payload
+                continue
+            finished = True
+            if status == 'error':
+                raise QueryError(*payload)
+            return
+    except TimeoutError:
+        raise QueryError(f"Query cancelled after exceeding the {timeout}s time limit.", 'timeout')
+    except (EOFError, OSError):
+        raise QueryError('The query worker stopped unexpectedly; please retry.', 'worker_failed')
+    finally:
+        if worker is not None:
+            if finished:
+                pool.release(worker)
+            else:
+                pool.discard(worker)
+
+
+def run_query(query, inferred=False, init_bindings=None, offset=0, limit=None, text=None):
+    """Evaluate a query in the worker pool with a wall-clock limit.
+
+    query is a query string or a prepared query from sparql_registry; for the
+    latter, text must be its source, since only text can be sent to the workers.
+
+    Returns the same dict as _execute_sparql_query. Failures are structured:
+    {'error': message, 'error_code': 'timeout' | 'worker_failed'}.
+    With RGO_SPARQL_WORKERS = 0 the query runs in the calling thread (no time limit).
+    """
+    if not getattr(settings, 'RGO_SPARQL_WORKERS', 2):
+        return _run_in_worker(query, inferred, init_bindings, offset, limit)
+
+    if isinstance(query, str):
+        args = (query, inferred, init_bindings, offset, limit)
+    else:
+        args = (text, inferred, init_bindings, offset, limit, True)
+    try:
+        [(result, phases)] = _replies(_run_timed_in_worker, args, getattr(settings, 'RGO_SPARQL_TIMEOUT', 30))
+    except QueryError as e:
+        return {'error': str(e), 'error_code': e.error_code}
+    metrics.replay(phases)
+    return result
+
+
+def stream_query(query, inferred=False, init_bindings=None, max_rows=None):
+    """Evaluate a query for streaming: (type, vars, rows) like graph_utils.iter_sparql_query.
+
+    In the pool, the worker sends the rows back in chunks and RGO_SPARQL_TIMEOUT
+    covers the whole stream, so a query that never produces a row is still stopped.
+    Errors and timeouts before the first row raise QueryError; a stream that runs
+    out of time later is cut short, since the response has already started.
+    """
+    if not getattr(settings, 'RGO_SPARQL_WORKERS', 2):
+        from .graph_utils import iter_sparql_query
+        kind, variables, rows = iter_sparql_query(query, inferred=inferred, init_bindings=init_bindings)
+        return kind, variables, itertools.islice(rows, max_rows)
+
+    replies = _replies(_stream_in_worker, (query, inferred, init_bindings, max_rows),
+                       getattr(settings, 'RGO_SPARQL_TIMEOUT', 30), stream=True)
+    kind, variables = next(replies)
+    # Wait for the first rows (or the end), so a query that finds nothing in time is an error
+    first = next(replies, [])
+    return kind, variables, _stream_rows(first, replies)
+
+
+def _stream_rows(first, replies):
+    try:
+        yield from first
+        for chunk in replies:
+            yield from chunk
+    except QueryError as e:
+        logger.warning("SPARQL stream cut short: %s", e)
+    finally:
+        # A client that stops reading leaves the worker mid-query; this kills it
+        replies.close()
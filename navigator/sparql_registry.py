@@ -0,0 +1,120 @@
+import logging
+import os
+import re
+import threading
+
+import rdflib
+from django.conf import settings
+from django.utils.text import slugify
+from rdflib.namespace import RDF, RDFS, OWL, XSD
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.util import from_n3
+
+from . import metrics
+from .graph_utils import CRM, SKOS
+
+logger = logging.getLogger(__name__)
+
+# Prefixes available to the bundled queries without a PREFIX declaration
+DEFAULT_NAMESPACES = {
+    'rdf': RDF, 'rdfs': RDFS, 'owl': OWL, 'xsd': XSD,
+    'crm': CRM, 'skos': SKOS,
+    'rg': rdflib.Namespace("https://www.ritualgrammar.org/ontology/"),
+    'np': rdflib.Namespace("https://www.ritualgrammar.org/ontology/nepal/"),
+}
+
+_VARIABLE_RE = re.compile(r'[?$]([A-Za-z_][A-Za-z0-9_]*)')
+
+_lock = threading.Lock()
+_QUERIES = None
+
+
+def _after_fork():
+    # Locks held by parent threads would never be released in a forked pool worker
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_sparql_dir():
+    return str(getattr(settings, 'RGO_SPARQL_DIR', os.path.join(settings.BASE_DIR, 'ontology', 'sparql')))
+
+
+def load_prepared_queries():
+    """Parse and algebrize every bundled .sparql file once.
+
+    Returns {name: {'name', 'title', 'text', 'variables', 'prepared', 'error'}}, where
+    name is the slugified file name used in /sparql/named/<name>/.
+    """
+    global _QUERIES
+    with _lock:
+        if _QUERIES is not None:
+            return _QUERIES
+        queries = {}
+        directory = get_sparql_dir()
+        filenames = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        for filename in filenames:
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() != '.sparql':
+                continue
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                text = f.read()
+            entry = {
+                'name': slugify(stem),
+                'title': stem,
+                'text': text,
+                'variables': sorted(set(_VARIABLE_RE.findall(text))),
+                'prepared': None,
+                'error': None,
+            }
+            try:
+                with metrics.timed('sparql_parse'):
+                    entry['prepared'] = prepareQuery(text, initNs=DEFAULT_NAMESPACES)
+            except Exception as e:
+                logger.warning("Could not prepare SPARQL query %s: %s", filename, e)
+                entry['error'] = str(e)
+            queries[entry['name']] = entry
+        _QUERIES = queries
+        return _QUERIES
+
+
+def get_prepared_query(name):
+    return load_prepared_queries().get(name)
+
+
+def parse_binding(value):
+    """Turn a request parameter into an RDF term.
+
+    Absolute IRIs (bare or in <...>), prefixed names and N3 literals such as "x"@en
+    are understood; anything else is bound as a plain literal.
+    """
+    value = value.strip()
+    if re.match(r'^[A-Za-z][A-Za-z0-9+.-]*://', value):
+        return rdflib.URIRef(value)
+    nsm = rdflib.Graph().namespace_manager
+    for prefix, namespace in DEFAULT_NAMESPACES.items():
+        nsm.bind(prefix, namespace, override=True)
+    try:
+        term = from_n3(value, nsm=nsm)
+    except Exception:
+        term = None
+    if isinstance(term, (rdflib.URIRef, rdflib.Literal)):
+        return term
+    return rdflib.Literal(value)
+
+
+def bindings_from_params(entry, params, reserved=()):
+    """initBindings for a prepared query from request parameters.
+
+    Raises ValueError for parameters that are not variables of the query.
+    """
+    bindings = {}
+    for key, value in params.items():
+        if key in reserved:
+            continue
+        if key not in entry['variables']:
+            raise ValueError(f"Unknown variable '{key}' for query '{entry['name']}'")
+        bindings[rdflib.Variable(key)] = parse_binding(value)
+    return bindings
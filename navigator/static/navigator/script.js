@@ -4,12 +4,21 @@ document.addEventListener('DOMContentLoaded', () => {
     const toggle = document.getElementById('toggle-inferred');
     toggle.addEventListener('change', async () => {
         window.isInferred = toggle.checked;
+        detailsCache.clear();
         await reloadTree();
         clearDetails();
     });
 
     // Delegate clicks on tree nodes
-    document.getElementById('sidebar').addEventListener('click', (e) => {
+    document.getElementById('sidebar').addEventListener('click', async (e) => {
+        const loadMore = e.target.closest('.load-more');
+        if (loadMore) {
+            e.stopPropagation();
+            await loadChildren(loadMore.closest('.children-container'), loadMore.dataset.parent, Number(loadMore.dataset.offset));
+            loadMore.remove();
+            return;
+        }
+
         const element = e.target.closest('.node-content');
         if (!element) return;
 
@@ -25,19 +34,60 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Expand / Collapse
         const treeNode = element.parentElement;
-        const childrenContainer = treeNode.querySelector(':scope > .children-container');
+        let childrenContainer = treeNode.querySelector(':scope > .children-container');
         const expander = element.querySelector('.expander');
+
+        // Children of lazy nodes are fetched the first time they are opened
+        if (!childrenContainer && element.dataset.lazy === 'true') {
+            childrenContainer = document.createElement('div');
+            childrenContainer.className = 'children-container';
+            treeNode.appendChild(childrenContainer);
+            delete element.dataset.lazy;
+            await loadChildren(childrenContainer, nodeId, 0);
+        }
+
         if (childrenContainer) {
             const expanded = childrenContainer.classList.toggle('expanded');
             expander?.classList.toggle('open', expanded);
         }
     });
+
+    if (window.reasoningInProgress) {
+        watchReasoning();
+    }
 });
 
+// Poll the health endpoint until the background reasoner has finished
+function watchReasoning() {
+    const status = document.getElementById('reasoning-status');
+    const timer = setInterval(async () => {
+        try {
+            const response = await fetch('/health/');
+            const health = await response.json();
+            if (health.graphs.inferred.state === 'failed') {
+                clearInterval(timer);
+                if (status) status.textContent = 'Reasoning failed — inferred data is unavailable.';
+                return;
+            }
+            if (!health.inferred_ready) return;
+
+            clearInterval(timer);
+            window.reasoningInProgress = false;
+            if (status) {
+                status.textContent = 'Inferred data is now available — click to reload.';
+                status.classList.add('ready');
+                status.addEventListener('click', () => window.location.reload());
+            }
+        } catch (e) {
+            console.error(e);
+        }
+    }, 3000);
+}
+
 // Reload tree from backend when inferred/ asserted changes
 async function reloadTree() {
     const inferredParam = window.isInferred ? 'true' : 'false';
-    const response = await fetch(`/navigation/?inferred=${inferredParam}`);
+    const response = await fetch(`/navigate/inferred/?inferred=${inferredParam}${reduceParam()}`);
     const htmlText = await response.text();
 
     // Extract the tree-root HTML from the response
@@ -48,6 +98,90 @@ async function reloadTree() {
     if (newTreeRoot && currentTreeRoot) {
         currentTreeRoot.replaceWith(newTreeRoot);
     }
+    // The replacement is the navigation tree, served by the children API
+    window.treeMode = 'navigation';
+    treeDag = null;
+}
+
+// The events tree is fetched once as a DAG (each node once, children by position)
+// and expanded from it node by node
+let treeDag = null;
+async function loadDag() {
+    if (!treeDag) {
+        const response = await fetch(`/api/tree/dag/?mode=${window.treeMode}`);
+        treeDag = await response.json();
+        treeDag.byId = new Map(treeDag.nodes.map(node => [node.id, node]));
+    }
+    return treeDag;
+}
+
+// Fetch one page of a node's children from the tree API and append them
+async function loadChildren(container, nodeId, offset) {
+    const inferredParam = window.isInferred ? '&inferred=true' : '';
+    try {
+        if (window.treeMode === 'events') {
+            const dag = await loadDag();
+            const node = dag.byId.get(nodeId);
+            const children = (node ? node.children : []).map(position => dag.nodes[position]);
+            children.forEach(child => container.appendChild(createTreeNode({ ...child, child_count: child.children.length })));
+            prefetchDetails(children.map(child => child.id));
+            return;
+        }
+
+        const response = await fetch(`/api/tree/children/?id=${encodeURIComponent(nodeId)}&offset=${offset}${inferredParam}${reduceParam()}`);
+        const data = await response.json();
+        if (data.error) {
+            container.insertAdjacentHTML('beforeend', `<div style="color:red">Error: ${data.error}</div>`);
+            return;
+        }
+
+        data.children.forEach(child => container.appendChild(createTreeNode(child)));
+        prefetchDetails(data.children.map(child => child.id));
+
+        if (data.next_offset !== null) {
+            const more = document.createElement('div');
+            more.className = 'load-more';
+            more.dataset.parent = nodeId;
+            more.dataset.offset = data.next_offset;
+            more.textContent = `Show more (${data.total - data.next_offset} remaining)`;
+            container.appendChild(more);
+        }
+    } catch (e) {
+        console.error(e);
+        container.insertAdjacentHTML('beforeend', '<div style="color:red">Failed to load children.</div>');
+    }
+}
+
+// Pass an explicit ?reduce= on to the tree API; otherwise the server default applies
+function reduceParam() {
+    return window.reduceParam ? `&reduce=${window.reduceParam}` : '';
+}
+
+// Build the same markup as tree_node.html for a node from the tree API
+function createTreeNode(node) {
+    const treeNode = document.createElement('div');
+    treeNode.className = 'tree-node';
+
+    const content = document.createElement('div');
+    content.className = 'node-content';
+    content.dataset.id = node.id;
+    if (node.child_count) content.dataset.lazy = 'true';
+
+    const expander = document.createElement('div');
+    expander.className = node.child_count ? 'expander has-children' : 'expander';
+    expander.textContent = node.child_count ? '▶' : '';
+
+    const label = document.createElement('span');
+    label.className = 'label';
+    label.textContent = node.label;
+    // Ancestors that are also direct parents in the inferred graph (hidden by the reduction)
+    if (node.inferred_parents) {
+        label.title = 'Also under (inferred): ' + node.inferred_parents.map(uri => uri.split(/[#/]/).pop()).join(', ');
+    }
+
+    content.append(expander, label);
+    treeNode.appendChild(content);
+    return treeNode;
 }
 
 // Clear the details panel
@@ -56,9 +190,34 @@ function clearDetails() {
     contentArea.innerHTML = '<div style="display:flex; align-items:center; justify-content:center; height:100%; opacity:0.3;"><p>Select a node to view details</p></div>';
 }
 
+// Node details already fetched, by id (for the current inferred/asserted mode)
+const detailsCache = new Map();
+
+// Fetch the details of the newly shown children with one request, so clicking one is instant
+async function prefetchDetails(nodeIds) {
+    // The server takes at most RGO_DETAILS_BATCH_SIZE (200) ids per request
+    const missing = nodeIds.filter(id => !detailsCache.has(id)).slice(0, 200);
+    if (!missing.length) return;
+    const inferred = window.isInferred;
+    const params = missing.map(id => `id=${encodeURIComponent(id)}`).join('&');
+    try {
+        const response = await fetch(`/api/details/?${params}${inferred ? '&inferred=true' : ''}`);
+        const data = await response.json();
+        // Skip stale answers (mode toggled meanwhile) and the asserted stand-in served during reasoning
+        if (data.error || data.reasoning_in_progress || inferred !== window.isInferred) return;
+        Object.values(data.nodes).forEach(details => detailsCache.set(details.id, details));
+    } catch (e) {
+        console.error(e);
+    }
+}
+
 // Load node details
 async function loadDetails(nodeId) {
     const contentArea = document.getElementById('details-area');
+    if (detailsCache.has(nodeId)) {
+        renderDetails(detailsCache.get(nodeId));
+        return;
+    }
     contentArea.innerHTML = '<div style="color:var(--text-color); opacity:0.5;">Loading...</div>';
 
     try {
@@ -71,6 +230,7 @@ async function loadDetails(nodeId) {
             return;
         }
 
+        if (!data.reasoning_in_progress) detailsCache.set(nodeId, data);
         renderDetails(data);
     } catch (e) {
         console.error(e);
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+
+import rdflib
+from django.conf import settings
+from rdflib.plugins.stores.memory import Memory
+
+MEMORY = 'memory'
+OWLREADY2 = 'owlready2'
+
+
+def get_store_config():
+    """RGO_GRAPH_STORE with defaults filled in.
+
+    BACKEND is 'memory' (parse into every worker), 'owlready2' (SQLite quadstore)
+    or the name of any rdflib store plugin with on-disk storage, e.g. 'Oxigraph'
+    (needs oxrdflib) or 'BerkeleyDB' (needs berkeleydb).
+    """
+    from .graph_utils import get_cache_dir
+    config = dict(getattr(settings, 'RGO_GRAPH_STORE', {}) or {})
+    config.setdefault('BACKEND', MEMORY)
+    config.setdefault('PATH', os.path.join(get_cache_dir(), 'store'))
+    return config
+
+
+def is_persistent(graph):
+    """True if graph lives in an on-disk store rather than in memory."""
+    return not isinstance(graph.store, Memory)
+
+
+def open_graph(name, version, build):
+    """Return graph `name` at `version`, backed by the configured store.
+
+    `build()` returns the graph in memory and is only called when no store exists yet
+    for this version. Persistent stores are written once, under a temporary name that
+    is renamed into place, and then opened by every worker without reparsing anything.
+    They are read-only after that: graph_utils.update_graph edits in-memory copies.
+    """
+    config = get_store_config()
+    backend = config['BACKEND']
+    if backend == MEMORY:
+        return build()
+
+    path = os.path.join(str(config['PATH']), f"{name}-{version[:16]}.{backend.lower()}")
+    if not os.path.exists(path):
+        _write_store(backend, path, build())
+    return _open_store(backend, path)
+
+
+def _write_store(backend, path, graph):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path))
+    try:
+        if backend == OWLREADY2:
+            _write_owlready2(os.path.join(tmp_path, 'quadstore.sqlite3'), graph)
+        else:
+            store = rdflib.Dataset(store=backend, default_union=True)
+            store.open(tmp_path, create=True)
+            try:
+                for prefix, namespace in graph.namespaces():
+                    store.bind(prefix, namespace)
+                # Keep the named graphs, so FROM / GRAPH work against the store too
+                store.addN((s, p, o, store.graph(c)) for s, p, o, c in graph.quads((None, None, None, None)))
+                store.commit()
+            finally:
+                store.close()
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker finished the same store first; use theirs
+            if not os.path.exists(path):
+                raise
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _write_owlready2(filename, graph):
+    import owlready2
+
+    # owlready2 parses N-Triples natively, which is far faster than adding triple by triple.
+    # It has no named graphs, so the dataset is stored as its union.
+    fd, nt_path = tempfile.mkstemp(suffix='.nt')
+    os.close(fd)
+    try:
+        union = rdflib.Graph()
+        union += graph.triples((None, None, None))
+        union.serialize(destination=nt_path, format='nt', encoding='utf-8')
+        world = owlready2.World(filename=filename)
+        world.get_ontology(f"file://{nt_path}").load()
+        world.save()
+        world.close()
+    finally:
+        os.remove(nt_path)
+
+
+def _open_store(backend, path):
+    if backend == OWLREADY2:
+        import owlready2
+
+        world = owlready2.World()
+        # Shared (non-exclusive) lock so every worker can open the same file
+        world.set_backend(filename=os.path.join(path, 'quadstore.sqlite3'), exclusive=False)
+        # owlready2 touches the file while opening; commit so the write lock is released
+        world.graph.commit()
+        return world.as_rdflib_graph()
+
+    graph = rdflib.Dataset(store=backend, default_union=True)
+    # Never create here; only _write_store populates a store
+    graph.open(path, create=False)
+    return graph
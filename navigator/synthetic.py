@@ -0,0 +1,74 @@
+import os
+
+import rdflib
+from rdflib.namespace import RDF
+
+from .graph_utils import CRM, SKOS, RITUAL_ROOT, LABEL_PREDICATES
+
+# Entities that are repeated when an ontology is scaled up
+SCALED_TYPES = [CRM.E5_Event, CRM.E7_Activity, SKOS.Concept]
+
+
+def scaled_entities(graphs):
+    """URIs of the events, activities and SKOS concepts across graphs (rg:Ritual excluded,
+    so every copy of the concept hierarchy hangs under the same root)."""
+    entities = set()
+    for graph in graphs:
+        for t in SCALED_TYPES:
+            entities.update(s for s in graph.subjects(RDF.type, t) if isinstance(s, rdflib.URIRef))
+    entities.discard(RITUAL_ROOT)
+    return entities
+
+
+def _copy_term(term, entities, n):
+    if term in entities:
+        return rdflib.URIRef(f"{term}-syn{n}")
+    return term
+
+
+def _copy_label(literal, n):
+    return rdflib.Literal(f"{literal} {n}", lang=literal.language, datatype=literal.datatype)
+
+
+def scale_graph(graph, factor, entities):
+    """graph plus factor - 1 copies of every triple that mentions one of entities.
+
+    In copy n each entity becomes <uri>-syn<n> and its labels get " <n>" appended;
+    links to anything not copied (people, places, rg:Ritual) are kept, so the copies
+    are wired into the rest of the ontology like the originals. Deterministic.
+    """
+    scaled = rdflib.Graph()
+    for prefix, namespace in graph.namespaces():
+        scaled.bind(prefix, namespace)
+    scaled += graph
+    mentioning = [(s, p, o) for s, p, o in graph if s in entities or o in entities]
+    for n in range(1, factor):
+        for s, p, o in mentioning:
+            if s in entities and p in LABEL_PREDICATES and isinstance(o, rdflib.Literal):
+                o = _copy_label(o, n)
+            scaled.add((_copy_term(s, entities, n), p, _copy_term(o, entities, n)))
+    return scaled
+
+
+def write_scaled_ontologies(paths, factor, directory):
+    """Scale the ontologies at paths by factor into directory as N-Triples.
+
+    Entities are collected across all files first, so cross-file references
+    (nepal concepts under ritualgrammar ones) point at the same copy.
+    Returns the new file names, in the order of paths.
+    """
+    graphs = []
+    for path in paths:
+        graph = rdflib.Graph()
+        graph.parse(path, format=rdflib.util.guess_format(path) or 'turtle')
+        graphs.append(graph)
+    entities = scaled_entities(graphs)
+
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for path, graph in zip(paths, graphs):
+        name = os.path.splitext(os.path.basename(path))[0] + '.nt'
+        scale_graph(graph, factor, entities).serialize(destination=os.path.join(directory, name),
+                                                       format='nt', encoding='utf-8')
+        names.append(name)
+    return names
@@ -1,3 +1,585 @@
-from django.test import TestCase
+import asyncio
+import concurrent.futures
+import io
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import rdflib
+from django.core.cache import caches
+from django.test import Client, SimpleTestCase, override_settings
+from rdflib.namespace import OWL, RDF, XSD
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.evaluate import evalQuery
+
+from . import graph_utils, metrics, ontologies, search, sparql_formats, sparql_pool, sparql_registry, synthetic
+from .graph_utils import CRM, SKOS
+from .hierarchy import HierarchyIndex, _components
+from .reasoning import RuleMaterializer, materialize
+from .similarity import SimilarityIndex
+
+RG = rdflib.Namespace("https://www.ritualgrammar.org/ontology/")
+
+# Triples the navigation trees are built from
+NAVIGATION_PREDICATES = [CRM.P2_has_type, SKOS.broader, CRM.P127_has_broader_term,
+                         CRM.P9_consists_of, CRM.P10i_contains, CRM.P10_falls_within, CRM.P9i_forms_part_of]
+
+
+def navigation_triples(graph):
+    triples = {t for p in NAVIGATION_PREDICATES for t in graph.triples((None, p, None))}
+    triples |= set(graph.triples((None, RDF.type, CRM.E5_Event)))
+    # HermiT also reports anonymous individuals; only named ones reach the trees
+    return {t for t in triples if isinstance(t[0], rdflib.URIRef) and isinstance(t[2], rdflib.URIRef)}
+
+
+class InferenceEngineTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Keep the parse caches out of the checkout
+        cache_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        overrides = override_settings(RGO_CACHE_DIR=cache_dir)
+        overrides.enable()
+        cls.addClassCleanup(overrides.disable)
+        cls.source = ontologies.reasoning_graph()
+        cls.rules = graph_utils._compute_rule_inferences(cls.source)
+
+    def test_rules_extend_the_asserted_triples(self):
+        derived = navigation_triples(self.rules) - navigation_triples(self.source)
+        self.assertTrue(derived)
+
+    def test_incremental_materializer_agrees_with_batch_closure(self):
+        axioms = (graph_utils.TRANSITIVE_PROPERTIES, graph_utils.SUBPROPERTY_AXIOMS, graph_utils.PROPERTY_CHAINS)
+        incremental = RuleMaterializer.from_graph(self.source, *axioms)
+        self.assertEqual(incremental.inferred(), materialize(self.source, *axioms))
+
+        edge = (RG.SagunEvent, CRM.P9_consists_of, RG.SagunActivity)
+        incremental.remove([edge])
+        edited = rdflib.Graph()
+        edited += self.source
+        edited.remove(edge)
+        self.assertEqual(incremental.facts - incremental.asserted, materialize(edited, *axioms))
+
+    @unittest.skipUnless(shutil.which('java'), 'HermiT needs a Java runtime')
+    def test_rules_match_hermit_on_navigation_triples(self):
+        hermit = graph_utils._compute_inferred_graph(self.source)
+        self.assertEqual(navigation_triples(self.rules), navigation_triples(hermit))
+
+
+class SyntheticOntologyTests(SimpleTestCase):
+    def test_scaling_repeats_events_and_concepts(self):
+        graphs = [rdflib.Graph().parse(path) for path in ontologies.get_root_ontologies()]
+        entities = synthetic.scaled_entities(graphs)
+        scaled = [synthetic.scale_graph(graph, 3, entities) for graph in graphs]
+
+        def count(gs, t):
+            return len({s for g in gs for s in g.subjects(RDF.type, t)} - {graph_utils.RITUAL_ROOT})
+
+        for t in synthetic.SCALED_TYPES:
+            self.assertEqual(count(scaled, t), 3 * count(graphs, t))
+        # Copies stay under the shared root
+        children = {s for g in graphs for s in g.subjects(SKOS.broader, graph_utils.RITUAL_ROOT)}
+        scaled_children = {s for g in scaled for s in g.subjects(SKOS.broader, graph_utils.RITUAL_ROOT)}
+        self.assertEqual(len(scaled_children), 3 * len(children))
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    def test_neighbors_ranked_by_exact_jaccard(self):
+        index = SimilarityIndex({
+            'hindu': {'part:a', 'part:b', 'part:c', 'actor:priest'},
+            'buddhist': {'part:a', 'part:b', 'actor:vajracharya'},
+            'other': {'part:x'},
+        })
+        hindu, buddhist = index.id_of('hindu'), index.id_of('buddhist')
+        self.assertAlmostEqual(index.jaccard(hindu, buddhist), 2 / 5)
+        self.assertEqual(index.shared(hindu, buddhist), ['part:a', 'part:b'])
+        self.assertEqual(index.only(buddhist, hindu), ['actor:vajracharya'])
+        # Rituals without any shared module are not neighbours
+        self.assertEqual(index.neighbors(hindu), [(buddhist, 2 / 5)])
+
+
+class ColdGraphTestCase(SimpleTestCase):
+    """Every test starts without loaded graphs or indexes.
+
+    Rule engine, in-memory graphs, no worker pool and no result cache unless
+    `overrides` says otherwise. The cache dir (parsed imports, inferred snapshot)
+    is shared by the tests of a class.
+    """
+    overrides = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.cache_dir, ignore_errors=True)
+
+    def setUp(self):
+        overrides = override_settings(**{
+            'RGO_CACHE_DIR': self.cache_dir,
+            'RGO_INFERENCE_ENGINE': graph_utils.RULES,
+            'RGO_GRAPH_STORE': {},
+            'RGO_SPARQL_WORKERS': 0,
+            'RGO_SPARQL_CACHE': None,
+            'RGO_BACKGROUND_REASONING': False,
+            **self.overrides,
+        })
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        graph_utils.reset()
+        self.addCleanup(graph_utils.reset)
+
+
+class IncrementalUpdateTests(ColdGraphTestCase):
+    """update_graph() must leave the inferred graph as a full rule-engine recompute would."""
+
+    def assertMatchesFullRecompute(self):
+        asserted = graph_utils.load_graph(inferred=False)
+        recomputed = graph_utils._compute_rule_inferences(ontologies.reasoning_graph(asserted))
+        expected = set(asserted.triples((None, None, None))) | set(recomputed)
+        self.assertEqual(set(graph_utils.load_graph(inferred=True).triples((None, None, None))), expected)
+
+    def test_removal_retracts_derived_triples(self):
+        graph_utils.update_graph(removed=[(RG.SagunEvent, CRM.P9_consists_of, RG.SagunActivity)])
+        inferred = graph_utils.load_graph(inferred=True)
+        self.assertNotIn((RG.SagunActivity, CRM.P9i_forms_part_of, RG.SagunEvent), inferred)
+        self.assertNotIn((RG.SagunActivity, CRM.P10_falls_within, RG.SagunEvent), inferred)
+        self.assertMatchesFullRecompute()
+
+    def test_addition_derives_triples(self):
+        graph_utils.update_graph(added=[(RG.SagunActivity, CRM.P9_consists_of, RG.OfferingToDeity)])
+        self.assertIn((RG.OfferingToDeity, CRM.P9i_forms_part_of, RG.SagunEvent), graph_utils.load_graph(inferred=True))
+        self.assertMatchesFullRecompute()
+
+    def test_adding_and_removing_again_restores_the_graph(self):
+        edge = (RG.SagunActivity, CRM.P9_consists_of, RG.OfferingToDeity)
+        before = set(graph_utils.load_graph(inferred=True).triples((None, None, None)))
+        graph_utils.update_graph(added=[edge])
+        graph_utils.update_graph(removed=[edge])
+        self.assertEqual(set(graph_utils.load_graph(inferred=True).triples((None, None, None))), before)
+
+    def test_inferred_last_modified_follows_the_snapshot(self):
+        graph_utils.load_graph(inferred=True)
+        snapshot = graph_utils._snapshot_path(graph_utils.graph_version(inferred=True))
+        later = graph_utils.graph_last_modified(inferred=False) + 3600
+        os.utime(snapshot, (later, later))
+        self.assertEqual(graph_utils.graph_last_modified(inferred=True), later)
+        self.assertLess(graph_utils.graph_last_modified(inferred=False), later)
+
+    def test_edit_drops_indexes_of_the_old_versions(self):
+        graph_utils.search_nodes('sagun', inferred=True)
+        graph_utils.get_navigation_dag(inferred=False)
+        old = {graph_utils.graph_version(False), graph_utils.graph_version(True)}
+        graph_utils.update_graph(added=[(RG.SagunActivity, CRM.P9_consists_of, RG.OfferingToDeity)])
+        cached = list(graph_utils._ARTIFACTS) + list(graph_utils._INDEXES)
+        self.assertFalse([key for key in cached if key[-1] in old])
+
+    def test_axiom_edit_rebuilds_the_rules(self):
+        graph_utils.update_graph(added=[(CRM.P16_used_specific_object, OWL.inverseOf, CRM.P16i_was_used_for)])
+        self.assertIn((RG.Egg, CRM.P16i_was_used_for, RG.SagunActivity), graph_utils.load_graph(inferred=True))
+        self.assertMatchesFullRecompute()
+
+
+class HierarchyIndexTests(SimpleTestCase):
+    # A diamond under a with a shortcut a -> d, a self-loop on d and a cycle e <-> f below it
+    edges = [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd'), ('a', 'd'), ('d', 'd'), ('d', 'e'), ('e', 'f'), ('f', 'e')]
+
+    def setUp(self):
+        self.index = HierarchyIndex.from_edges(self.edges, label=str.upper)
+
+    def ids(self, *uris):
+        return [self.index.id_of(uri) for uri in uris]
+
+    def names(self, ids):
+        return sorted(self.index.uris[i] for i in ids)
+
+    def bits(self, bitset):
+        return sorted(self.index.uris[i] for i in range(len(self.index)) if bitset >> i & 1)
+
+    def test_csr_lists_children_and_parents(self):
+        a, d, e = self.ids('a', 'd', 'e')
+        self.assertEqual(self.index.uris, ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(self.index.labels, ['A', 'B', 'C', 'D', 'E', 'F'])
+        self.assertEqual(self.names(self.index.children(a)), ['b', 'c', 'd'])
+        self.assertEqual(self.index.child_count(a), 3)
+        self.assertEqual(self.names(self.index.parents(d)), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.names(self.index.parents(e)), ['d', 'f'])
+        self.assertEqual(self.names(self.index.roots), ['a'])
+        copy = HierarchyIndex.from_dict(self.index.to_dict())
+        self.assertEqual(copy.to_dict(), self.index.to_dict())
+
+    def test_components_collapse_cycles_in_reverse_topological_order(self):
+        component = _components(self.index)
+        e, f = self.ids('e', 'f')
+        self.assertEqual(component[e], component[f])
+        self.assertEqual(len(set(component)), 5)
+        # Successors are completed first
+        for parent, child in self.edges:
+            p, q = self.ids(parent, child)
+            self.assertGreaterEqual(component[p], component[q])
+
+    def test_ancestor_bitsets(self):
+        ancestors = dict(zip(self.index.uris, map(self.bits, self.index.ancestor_bitsets())))
+        self.assertEqual(ancestors, {
+            'a': [],
+            'b': ['a'],
+            'c': ['a'],
+            'd': ['a', 'b', 'c'],          # a self-loop doesn't make d its own ancestor
+            'e': ['a', 'b', 'c', 'd', 'f'],
+            'f': ['a', 'b', 'c', 'd', 'e'],
+        })
+
+    def test_reduction_drops_only_shortcut_edges(self):
+        reduced = self.index.reduced()
+        a, d, e = self.ids('a', 'd', 'e')
+        self.assertEqual(self.names(reduced.children(a)), ['b', 'c'])
+        # Multiple parents survive; edges inside a component are kept
+        self.assertEqual(self.names(reduced.parents(d)), ['b', 'c', 'd'])
+        self.assertEqual(self.names(reduced.parents(e)), ['d', 'f'])
+        self.assertEqual(self.names(reduced.implied_parents(d)), ['a'])
+        self.assertEqual(len(reduced.child_targets), len(self.edges) - 1)
+        self.assertEqual(reduced.id_of('d'), d)
+        copy = HierarchyIndex.from_dict(reduced.to_dict())
+        self.assertEqual(self.names(copy.implied_parents(d)), ['a'])
+
+
+def _observe_phase():
+    metrics.record('fork-test', 0.001)
+
+
+class ForkSafetyTests(SimpleTestCase):
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_forked_worker_can_time_phases_while_parent_holds_histogram_lock(self):
+        # As if another server thread was observing at the moment a pool worker is forked
+        with metrics.PHASE_SECONDS._lock:
+            process = multiprocessing.get_context('fork').Process(target=_observe_phase)
+            process.start()
+            process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+        self.assertEqual(process.exitcode, 0)
+
+
+class GraphQueryTests(SimpleTestCase):
+    """CONSTRUCT and DESCRIBE are produced lazily, with the same triples rdflib's evalQuery() builds."""
+
+    queries = [
+        'CONSTRUCT { ?part crm:P9i_forms_part_of ?whole } WHERE { ?whole crm:P9_consists_of ?part }',
+        'CONSTRUCT WHERE { ?s a crm:E5_Event }',
+        'CONSTRUCT { ?s rdfs:label ?l } FROM <urn:rgo:none> WHERE { ?s rdfs:label ?l }',
+        'DESCRIBE rg:SagunEvent',
+        'DESCRIBE ?p WHERE { rg:SagunEvent crm:P9_consists_of ?p }',
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        overrides = override_settings(RGO_CACHE_DIR=cache_dir, RGO_GRAPH_STORE={})
+        overrides.enable()
+        cls.addClassCleanup(overrides.disable)
+        graph_utils.reset()
+        cls.addClassCleanup(graph_utils.reset)
+        cls.graph = graph_utils.load_graph(inferred=False)
+
+    def test_triples_match_evalquery(self):
+        namespaces = {'crm': CRM, 'rdfs': rdflib.RDFS, 'rg': RG}
+        for text in self.queries:
+            with self.subTest(query=text):
+                query = prepareQuery(text, initNs=namespaces)
+                expected = set(evalQuery(self.graph, query, {})['graph'])
+                kind, _, rows = graph_utils.iter_sparql_query(query)
+                rows = list(rows)
+                self.assertEqual(kind, 'TRIPLES')
+                self.assertEqual(len(rows), len(set(rows)))
+                self.assertEqual(set(rows), expected)
+
+
+class GraphLoadingViewTests(ColdGraphTestCase):
+    def slow_asserted_load(self):
+        load = graph_utils._load_asserted_graph
+
+        def slow_load():
+            time.sleep(0.5)
+            return load()
+        return mock.patch.object(graph_utils, '_load_asserted_graph', side_effect=slow_load)
+
+    def test_concurrent_first_requests_share_one_load(self):
+        with self.slow_asserted_load() as loader:
+            with concurrent.futures.ThreadPoolExecutor(4) as pool:
+                responses = list(pool.map(lambda _: Client().get('/api/tree/roots/'), range(4)))
+        self.assertEqual([r.status_code for r in responses], [200] * 4)
+        self.assertEqual(loader.call_count, 1)
+
+    def test_health_is_ready_once_the_asserted_graph_is(self):
+        with self.slow_asserted_load() as loader:
+            response = self.client.get('/health/')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['graphs']['asserted']['state'], 'loading')
+            # Waits for the load health started instead of starting another
+            graph_utils.load_graph(inferred=False)
+            self.assertEqual(self.client.get('/health/').status_code, 200)
+        self.assertEqual(loader.call_count, 1)
+
+
+class AsyncViewTests(ColdGraphTestCase):
+    def slowly(self, func, delay):
+        def slow(*args, **kwargs):
+            time.sleep(delay)
+            return func(*args, **kwargs)
+        return mock.Mock(side_effect=slow)
+
+    async def test_identical_requests_in_flight_share_one_computation(self):
+        details = self.slowly(graph_utils.get_node_details, 0.3)
+        with mock.patch('navigator.views.get_node_details', details):
+            responses = await asyncio.gather(*(
+                self.async_client.get('/details/', {'id': str(RG.SagunActivity)}) for _ in range(3)))
+        self.assertEqual([r.status_code for r in responses], [200] * 3)
+        self.assertEqual(details.call_count, 1)
+        self.assertEqual(len({r.content for r in responses}), 1)
+
+    async def test_slow_sparql_does_not_hold_up_pages(self):
+        graph_utils.load_graph(inferred=True)
+        query = self.slowly(graph_utils.execute_sparql_query, 2)
+        with mock.patch('navigator.views.execute_sparql_query', query):
+            # Distinct queries, so they are not coalesced
+            queries = [asyncio.ensure_future(self.async_client.post('/sparql/', {'query': f'ASK {{ FILTER({i}) }}'}))
+                       for i in range(5)]
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            response = await self.async_client.get('/details/', {'id': str(RG.SagunActivity)})
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(response.status_code, 200)
+            await asyncio.gather(*queries)
+        self.assertEqual(query.call_count, 5)
+
+
+class ConditionalGetTests(ColdGraphTestCase):
+    def test_navigation_page_revalidates_with_304(self):
+        response = self.client.get('/navigate/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+        self.assertEqual(self.client.get('/navigate/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/navigate/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get('/navigate/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_edit_changes_the_etag(self):
+        etag = self.client.get('/api/tree/dag/').headers['ETag']
+        self.assertEqual(self.client.get('/api/tree/dag/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        graph_utils.update_graph(added=[(RG.SagunActivity, CRM.P9_consists_of, RG.OfferingToDeity)])
+        response = self.client.get('/api/tree/dag/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class SparqlResultCacheTests(ColdGraphTestCase):
+    overrides = {'RGO_SPARQL_CACHE': 'sparql'}
+    query = 'SELECT ?part WHERE { <%s> <%s> ?part }' % (RG.SagunActivity, CRM.P9_consists_of)
+
+    def setUp(self):
+        super().setUp()
+        caches['sparql'].clear()
+
+    def run_query(self, query):
+        return self.client.post('/sparql/', {'query': query})
+
+    def test_repeats_are_served_from_the_cache_until_the_graph_changes(self):
+        with mock.patch.object(graph_utils.sparql_pool, 'run_query', wraps=graph_utils.sparql_pool.run_query) as run:
+            self.assertNotContains(self.run_query(self.query), str(RG.OfferingToDeity))
+            # Formatting-only edits share the cache key
+            self.run_query('  ' + self.query.replace(' ', '\n  ') + ' # again')
+            self.assertEqual(run.call_count, 1)
+
+            graph_utils.update_graph(added=[(RG.SagunActivity, CRM.P9_consists_of, RG.OfferingToDeity)])
+            self.assertContains(self.run_query(self.query), str(RG.OfferingToDeity))
+            self.assertEqual(run.call_count, 2)
+
+
+class NamedQueryTests(ColdGraphTestCase):
+    def setUp(self):
+        query_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, query_dir, ignore_errors=True)
+        with open(os.path.join(query_dir, 'Parts of.sparql'), 'w', encoding='utf-8') as f:
+            f.write('SELECT ?part WHERE { ?whole crm:P9_consists_of ?part } ORDER BY ?part')
+        self.overrides = {'RGO_SPARQL_DIR': query_dir}
+        super().setUp()
+        sparql_registry._QUERIES = None
+        self.addCleanup(setattr, sparql_registry, '_QUERIES', None)
+
+    def parts(self, **params):
+        response = self.client.get('/sparql/named/parts-of/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row[0]['value'] for row in response.json()['results']]
+
+    def test_parameters_bind_query_variables(self):
+        self.assertEqual(self.client.get('/sparql/named/').json()['queries'][0]['variables'], ['part', 'whole'])
+        everything = self.parts()
+        sagun = self.parts(whole='rg:SagunEvent')
+        self.assertIn(str(RG.SagunActivity), sagun)
+        self.assertEqual(self.parts(whole=f'<{RG.SagunEvent}>'), sagun)
+        self.assertLess(len(sagun), len(everything))
+        self.assertEqual(self.parts(whole='"SagunEvent"'), [])
+
+    def test_unknown_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/sparql/named/parts-of/', {'hole': 'rg:SagunEvent'}).status_code, 400)
+        self.assertEqual(self.client.get('/sparql/named/missing/').status_code, 404)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _exit_worker():
+    os._exit(1)
+
+
+def _count_forever():
+    yield os.getpid()
+    for i in itertools.count():
+        time.sleep(0.01)
+        yield i
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+class SparqlPoolTests(SimpleTestCase):
+    def setUp(self):
+        overrides = override_settings(RGO_SPARQL_WORKERS=2, RGO_SPARQL_START_METHOD='fork')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        sparql_pool.shutdown()
+        self.addCleanup(sparql_pool.shutdown)
+
+    def run_in_pool(self, func, *args, timeout=10):
+        [result] = sparql_pool._replies(func, args, timeout)
+        return result
+
+    def assertQueryError(self, error_code, func, *args, timeout=10):
+        with self.assertRaises(sparql_pool.QueryError) as caught:
+            self.run_in_pool(func, *args, timeout=timeout)
+        self.assertEqual(caught.exception.error_code, error_code)
+
+    def test_timeout_kills_only_the_stuck_worker(self):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            slow = executor.submit(self.run_in_pool, _sleep, 1.5)
+            time.sleep(0.5)
+            self.assertQueryError('timeout', _sleep, 30, timeout=0.5)
+            # The other query runs on to completion
+            slow_pid = slow.result()
+        self.assertEqual(sparql_pool._get_pool()._count, 1)
+        self.assertEqual(self.run_in_pool(_sleep, 0), slow_pid)
+
+    def test_dead_worker_fails_the_query_and_is_replaced(self):
+        self.assertQueryError('worker_failed', _exit_worker)
+        self.assertEqual(sparql_pool._get_pool()._count, 0)
+        self.assertIsInstance(self.run_in_pool(_sleep, 0), int)
+
+    def test_closing_a_stream_early_kills_its_worker(self):
+        replies = sparql_pool._replies(_count_forever, (), 10, stream=True)
+        pid = next(replies)
+        next(replies)
+        replies.close()
+        self.assertEqual(sparql_pool._get_pool()._count, 0)
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+class NodeDetailsTests(ColdGraphTestCase):
+    def edges(self, properties, direction):
+        return {(p['predicate'], p['object']) for p in properties if p['direction'] == direction}
+
+    def test_details_list_incoming_edges(self):
+        details = self.client.get('/details/', {'id': str(RG.SagunActivity)}).json()
+        incoming = self.edges(details['properties'], 'in')
+        self.assertIn((str(CRM.P9_consists_of), str(RG.SagunEvent)), incoming)
+        self.assertIn((str(CRM.P16_used_specific_object), str(RG.Egg)), self.edges(details['properties'], 'out'))
+        # The same edge, seen from the other end
+        whole = self.client.get('/details/', {'id': str(RG.SagunEvent)}).json()
+        self.assertIn((str(CRM.P9_consists_of), str(RG.SagunActivity)), self.edges(whole['properties'], 'out'))
+
+    def test_batch_matches_single_requests(self):
+        ids = [str(RG.SagunActivity), str(RG.SagunEvent), str(RG.SagunActivity)]
+        nodes = self.client.get('/api/details/', {'id': ids}).json()['nodes']
+        self.assertEqual(list(nodes), ids[:2])
+        for node_id in ids[:2]:
+            single = self.client.get('/details/', {'id': node_id}).json()
+            self.assertEqual(nodes[node_id]['properties'], single['properties'])
+
+
+class SparqlFormatTests(SimpleTestCase):
+    variables = ['s', 'o']
+    rows = [
+        (RG.SagunEvent, rdflib.Literal('Sagun "offering",\tceremony\nline', lang='en')),
+        (rdflib.BNode('b0'), rdflib.Literal('3', datatype=XSD.integer)),
+        (RG.SagunActivity, None),
+    ]
+
+    def round_trip(self, fmt):
+        text = ''.join(sparql_formats.STREAMERS[fmt](self.variables, self.rows))
+        result = rdflib.query.Result.parse(io.StringIO(text), format=fmt)
+        return [tuple(binding.get(rdflib.Variable(var)) for var in self.variables) for binding in result.bindings]
+
+    def test_json_and_tsv_keep_every_term(self):
+        for fmt in ('json', 'tsv'):
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.round_trip(fmt), self.rows)
+
+    def test_csv_keeps_iris_blank_nodes_and_lexical_values(self):
+        text = ''.join(sparql_formats.stream_csv(self.variables, self.rows))
+        self.assertIn('\r\n_:b0,3\r\n', text)
+        rows = self.round_trip('csv')
+        # CSV has no language tags or datatypes
+        self.assertEqual(rows[0], (RG.SagunEvent, rdflib.Literal('Sagun "offering",\tceremony\nline')))
+        self.assertIsInstance(rows[1][0], rdflib.BNode)
+        self.assertEqual(rows[2], (RG.SagunActivity, None))
+
+
+class QueryNormalizationTests(SimpleTestCase):
+    def test_formatting_only_edits_share_a_cache_key(self):
+        cases = [
+            ('SELECT ?s WHERE { ?s ?p ?o }', 'SELECT ?s WHERE { ?s ?p ?o }'),
+            ('  SELECT  ?s\n\tWHERE {\n  ?s ?p ?o\n}\n', 'SELECT ?s WHERE { ?s ?p ?o }'),
+            ('SELECT ?s # all subjects\nWHERE { ?s ?p ?o } # done', 'SELECT ?s WHERE { ?s ?p ?o }'),
+            # Whitespace and '#' inside literals and IRIs are part of the query
+            ('SELECT ?s WHERE { ?s ?p "a  b # c" }', 'SELECT ?s WHERE { ?s ?p "a  b # c" }'),
+            (r"SELECT ?s WHERE { ?s ?p 'it\'s  #1' }", r"SELECT ?s WHERE { ?s ?p 'it\'s  #1' }"),
+            ('SELECT ?s WHERE { ?s ?p """two\n  lines""" }', 'SELECT ?s WHERE { ?s ?p """two\n  lines""" }'),
+            ('SELECT ?s WHERE { ?s <http://x/#a> ?o }', 'SELECT ?s WHERE { ?s <http://x/#a> ?o }'),
+        ]
+        for query, expected in cases:
+            with self.subTest(query=query):
+                self.assertEqual(graph_utils.normalize_query(query), expected)
+
+
+class SearchNormalizationTests(SimpleTestCase):
+    def test_normalize(self):
+        cases = [
+            ('Pāṇigrahaṇa', 'panigrahana'),    # Latin diacritics are dropped
+            ('KANYĀDĀNA', 'kanyadana'),
+            ('ﬁre', 'fire'),                   # compatibility forms
+            ('कन्यादान', 'कन्यादान'),            # matras and virama are kept
+            ('क़लश', 'कलश'),                     # nukta
+            ('चाँद', 'चांद'),                    # chandrabindu -> anusvara
+            ('क्\u200dष', 'क्ष'),               # zero width joiner
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(search.normalize(text), expected)
+
+    def test_tokenize(self):
+        cases = [
+            ('Sagun (egg) offering—Hindu/Buddhist', ['sagun', 'egg', 'offering', 'hindu', 'buddhist']),
+            ('rg:SagunEvent_2', ['rg', 'sagunevent', '2']),
+            ('पाणिग्रहण, संस्कार', ['पाणिग्रहण', 'संस्कार']),
+            ('  ', []),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(search.tokenize(text), expected)
@@ -7,5 +7,17 @@ urlpatterns = [
     path('navigate/inferred/', views.inferred_navigation_view, name='navigate_inferred'),
     path('navigate/events/', views.events_navigation_view, name='navigate_events'),
     path('sparql/', views.sparql_view, name='sparql'),
+    path('sparql/stream/', views.sparql_stream, name='sparql_stream'),
+    path('sparql/named/', views.named_queries, name='sparql_named_list'),
+    path('sparql/named/<slug:name>/', views.named_query, name='sparql_named'),
     path('details/', views.node_details, name='node_details'),
+    path('search/', views.search, name='search'),
+    path('api/details/', views.nodes_details, name='nodes_details'),
+    path('api/similarity/compare/', views.similarity_compare, name='similarity_compare'),
+    path('api/similarity/neighbors/', views.similarity_neighbors, name='similarity_neighbors'),
+    path('api/tree/roots/', views.tree_roots, name='tree_roots'),
+    path('api/tree/children/', views.tree_children, name='tree_children'),
+    path('api/tree/dag/', views.tree_dag, name='tree_dag'),
+    path('health/', views.health, name='health'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
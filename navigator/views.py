@@ -1,56 +1,431 @@
+import functools
+import hashlib
+import time
+from urllib.parse import urlencode
+
 from django.shortcuts import render, HttpResponse
-from django.http import JsonResponse
-from .graph_utils import get_navigation_structure, get_node_details, execute_sparql_query
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.urls import reverse
+
+from . import graph_utils, metrics, offload, sparql_formats, sparql_pool, sparql_registry
+from .graph_utils import (
+    get_navigation_roots, get_navigation_children,
+    get_node_details, get_nodes_details, execute_sparql_query, graph_status,
+)
+
+def _inferred_or_fallback(inferred, artifact=None):
+    """Decide whether an inferred request can be served right now.
+
+    Returns (inferred, reasoning_in_progress). While the reasoner is still running
+    in the background the asserted view is served instead of blocking the request.
+    """
+    if not inferred or graph_utils.inferred_graph_ready():
+        return inferred, False
+    if artifact and graph_utils.load_artifact(artifact, graph_utils.graph_version(inferred=True)) is not None:
+        return True, False
+    graph_utils.start_background_reasoning()
+    return False, graph_utils.reasoning_in_progress()
+
+def _offloaded(view):
+    """Turn a sync view into an async one that runs on the graph executor (see offload.run)."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await offload.run(view, request, *args, **kwargs)
+    return wrapper
 
 def landing_page(request):
     return render(request, 'navigator/landing.html')
 
-def navigation_view(request):
-    inferred = request.GET.get("inferred", "true").lower() == "false"
-
-    roots = get_navigation_structure(inferred=inferred)
+def _template_version():
+    # Part of the ETag so a deploy that only changes templates still invalidates
+    global _TEMPLATE_VERSION
+    if _TEMPLATE_VERSION is None:
+        h = hashlib.sha256()
+        for name in ("navigator/navigation.html", "navigator/tree_node.html"):
+            h.update(get_template(name).template.source.encode())
+        _TEMPLATE_VERSION = h.hexdigest()[:8]
+    return _TEMPLATE_VERSION
 
-    return render(request, "navigator/navigation.html", {
-        "roots": roots,
-        "inferred": inferred, 
-    })
+_TEMPLATE_VERSION = None
 
-def inferred_navigation_view(request):
+def _tree_validators(request, mode, inferred, reasoning):
+    """(tree_key, etag, last_modified, 304 response or None) for a navigation tree page."""
+    version = graph_utils.graph_version(inferred=inferred)
+    tree_key = f"{mode}-{'inferred' if inferred else 'asserted'}-{version[:16]}-{_template_version()}"
+    etag = f'"{tree_key}{"-reasoning" if reasoning else ""}"'
+    last_modified = graph_utils.graph_last_modified(inferred=inferred)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    return tree_key, etag, last_modified, not_modified
 
-    inferred = request.GET.get("inferred", "true").lower() == "true"
+def _render_tree(request, mode, inferred, reasoning, get_roots, context):
+    """Render a navigation tree, answering conditional GETs with 304.
 
-    roots = get_navigation_structure(inferred=inferred)
+    The ETag changes with the graph version, so the cached tree markup and the
+    browser's copy stay valid until the ontology is redeployed.
+    """
+    tree_key, etag, last_modified, not_modified = _tree_validators(request, mode, inferred, reasoning)
+    if not_modified is not None:
+        return not_modified
+    return _tree_response(request, get_roots(inferred=inferred), inferred, reasoning, context,
+                          tree_key, etag, last_modified)
 
-    return render(request, "navigator/navigation.html", {
-        "roots": roots, 
-        "inferred": inferred
+def _tree_response(request, roots, inferred, reasoning, context, tree_key, etag, last_modified):
+    with metrics.timed('template_render'):
+        response = render(request, "navigator/navigation.html", {
+            **context,
+            "roots": roots,
+            "inferred": inferred,
+            "reasoning_in_progress": reasoning,
+            "tree_key": tree_key,
         })
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    if reasoning:
+        # The inferred tree replaces this one as soon as the reasoner is done
+        patch_cache_control(response, no_cache=True)
+    return response
+
+def _reduce_param(request):
+    """?reduce=true|false overrides RGO_REDUCE_INFERRED_HIERARCHY; None when absent."""
+    value = request.GET.get('reduce', '').lower()
+    return {'true': True, 'false': False}.get(value)
+
+async def _render_navigation(request, inferred):
+    # Graph work runs on the bounded executor (see offload.run) so the event loop stays free
+    inferred, reasoning = await offload.run(_inferred_or_fallback, inferred,
+                                            graph_utils.hierarchy_artifact_name(True))
+    reduce = _reduce_param(request)
+    reduced = graph_utils.reduce_hierarchy(inferred, reduce)
+    mode = "navigation-reduced" if reduced else "navigation"
+    tree_key, etag, last_modified, not_modified = await offload.run(_tree_validators, request, mode,
+                                                                    inferred, reasoning)
+    if not_modified is not None:
+        return not_modified
+
+    # Only the roots are rendered; script.js fetches children from the tree API
+    roots = await offload.run(get_navigation_roots, inferred=inferred, reduce=reduced,
+                              key=('navigation-roots', inferred, reduced, graph_utils.graph_version(inferred)))
+    return await offload.run(_tree_response, request, roots, inferred, reasoning,
+                             {'reduce_param': '' if reduce is None else str(reduce).lower()},
+                             tree_key, etag, last_modified)
 
+async def navigation_view(request):
+    inferred = request.GET.get("inferred", "true").lower() == "false"
+    return await _render_navigation(request, inferred)
+
+async def inferred_navigation_view(request):
+
+    inferred = request.GET.get("inferred", "true").lower() == "true"
 
+    return await _render_navigation(request, inferred)
+
+
+@_offloaded
 def events_navigation_view(request):
-    from .graph_utils import get_event_navigation_structure
-    roots = get_event_navigation_structure(inferred=True)
-    return render(request, 'navigator/navigation.html', {'roots': roots, 'mode': 'Events by Rituals ' })
+    from .graph_utils import get_event_navigation_roots
+    inferred, reasoning = _inferred_or_fallback(True, graph_utils.EVENTS_DAG_ARTIFACT_NAME)
+    # Only the root is rendered; script.js expands the rest from /api/tree/dag/
+    return _render_tree(request, "events", inferred, reasoning, get_event_navigation_roots,
+                        {'mode': 'Events by Rituals ', 'tree_mode': 'events'})
 
-def sparql_view(request):
+def _sparql_url(query, inferred, **params):
+    params = {'query': query, **params}
+    if inferred:
+        params['inferred'] = 'true'
+    return f"{reverse('sparql')}?{urlencode(params)}"
+
+async def sparql_view(request):
     default_query = 'SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 50'
     query = request.POST.get('query') or request.GET.get('query') or default_query
     results = None
+    pagination = {}
+    reasoning = False
     
     inferred = request.GET.get('inferred') == 'true'
     
     if request.method == 'POST' or request.GET.get('run'):
-        results = execute_sparql_query(query, inferred=inferred)
+        page_size = getattr(settings, 'RGO_SPARQL_PAGE_SIZE', 100)
+        offset = _int_param(request, 'offset', 0)
+        # The page links keep asking for inferred results; this page may fall back to asserted
+        use_inferred, reasoning = await offload.run(_inferred_or_fallback, inferred)
+        # Identical queries in flight (same page, mode and graph version) are evaluated once
+        key = graph_utils.sparql_cache_key(query, inferred=use_inferred, extra=f"page:{offset}:{page_size}")
+        results = await offload.run_sparql(execute_sparql_query, query, inferred=use_inferred, offset=offset,
+                                           limit=page_size, key=key)
+
+        if 'error' not in results and results.get('type') != 'OTHER':
+            pagination = {
+                'first_row': offset + 1,
+                'last_row': offset + len(results['results']),
+                'previous_url': _sparql_url(query, inferred, run='true', offset=max(0, offset - page_size)) if offset else None,
+                'next_url': _sparql_url(query, inferred, run='true', offset=results['next_offset']) if results['next_offset'] is not None else None,
+                'downloads': {fmt: f"{reverse('sparql_stream')}?{urlencode({'query': query, 'format': fmt, **({'inferred': 'true'} if inferred else {})})}"
+                              for fmt in sparql_formats.STREAMERS},
+            }
         
-    return render(request, 'navigator/sparql.html', {'results': results, 'query': query, 'inferred': inferred})
+    return await offload.run(render, request, 'navigator/sparql.html', {
+        'results': results, 'query': query, 'inferred': inferred, 'pagination': pagination,
+        'reasoning_in_progress': reasoning})
+
+async def sparql_stream(request):
+    """Stream full results as SPARQL JSON, CSV or TSV without building them in memory."""
+    query = request.POST.get('query') or request.GET.get('query')
+    if not query:
+        return JsonResponse({'error': 'No query provided'}, status=400)
+    fmt = (request.POST.get('format') or request.GET.get('format') or 'json').lower()
+    if fmt not in sparql_formats.STREAMERS:
+        return JsonResponse({'error': f"Unsupported format '{fmt}'"}, status=400)
+    inferred = request.GET.get('inferred') == 'true' or request.POST.get('inferred') == 'true'
+    inferred, reasoning = await offload.run(_inferred_or_fallback, inferred)
+
+    max_rows = getattr(settings, 'RGO_SPARQL_MAX_ROWS', 10000)
+    try:
+        # Evaluated in the worker pool, under RGO_SPARQL_TIMEOUT for the whole download
+        kind, variables, rows = await offload.run_sparql(sparql_pool.stream_query, query, inferred=inferred,
+                                                         max_rows=max_rows)
+    except sparql_pool.QueryError as e:
+        error = {'error': str(e), 'error_code': e.error_code}
+        return JsonResponse(error, status=_error_status(error))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if kind == 'OTHER':
+        return JsonResponse({'error': 'Query type not supported for streaming.'}, status=400)
+    if kind == 'TRIPLES':
+        variables = ['subject', 'predicate', 'object']
+
+    content = sparql_formats.STREAMERS[fmt](variables, rows)
+    if isinstance(request, ASGIRequest):
+        # Django would otherwise read a sync iterator to the end in its one sync thread
+        content = offload.iterate_sparql(content)
+    response = StreamingHttpResponse(content, content_type=sparql_formats.CONTENT_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="results.{fmt}"'
+    response.headers['X-Row-Limit'] = str(max_rows)
+    if reasoning:
+        response.headers['X-Reasoning-In-Progress'] = 'true'
+    return response
+
+def _error_status(results):
+    if 'error' not in results:
+        return 200
+    return {'timeout': 504, 'worker_failed': 503, 'not_ready': 503}.get(results.get('error_code'), 400)
 
-def node_details(request):
+async def named_queries(request):
+    queries = await offload.run(sparql_registry.load_prepared_queries)
+    return JsonResponse({'queries': [
+        {
+            'name': entry['name'],
+            'title': entry['title'],
+            'variables': entry['variables'],
+            'url': reverse('sparql_named', args=[entry['name']]),
+            'error': entry['error'],
+        }
+        for entry in queries.values()
+    ]})
+
+async def named_query(request, name):
+    entry = await offload.run(sparql_registry.get_prepared_query, name)
+    if entry is None:
+        return JsonResponse({'error': f"Unknown query '{name}'"}, status=404)
+    if entry['prepared'] is None:
+        return JsonResponse({'error': entry['error']}, status=500)
+
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = await offload.run(_inferred_or_fallback, inferred)
+    try:
+        bindings = sparql_registry.bindings_from_params(entry, request.GET, reserved=('inferred', 'offset', 'limit'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Same key as the result cache, so the ETag only changes with the graph or bindings
+    page_size = getattr(settings, 'RGO_SPARQL_PAGE_SIZE', 100)
+    offset = _int_param(request, 'offset', 0)
+    limit = _int_param(request, 'limit', page_size, maximum=page_size) or page_size
+    cache_key = graph_utils.sparql_cache_key(entry['text'], inferred=inferred,
+                                             extra=f"{graph_utils.bindings_key(bindings)}:{offset}:{limit}")
+    etag = f'"{hashlib.sha256(cache_key.encode()).hexdigest()[:32]}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    results = await offload.run_sparql(execute_sparql_query, entry['text'], inferred=inferred,
+                                       prepared=entry['prepared'], init_bindings=bindings, offset=offset, limit=limit)
+    response = JsonResponse({
+        'name': entry['name'],
+        'inferred': inferred,
+        'reasoning_in_progress': reasoning,
+        **results,
+    }, status=_error_status(results))
+    if 'error' not in results:
+        response.headers['ETag'] = etag
+    return response
+
+async def node_details(request):
     node_id = request.GET.get('id')
     inferred = request.GET.get('inferred') == 'true'
-    print("Inference flag in view:", inferred)
     if not node_id:
         return JsonResponse({'error': 'No id provided'}, status=400)
-    data = get_node_details(node_id, inferred=inferred)
+    inferred, reasoning = await offload.run(_inferred_or_fallback, inferred)
+    details = await offload.run(get_node_details, node_id, inferred=inferred,
+                                key=('node-details', node_id, inferred, graph_utils.graph_version(inferred)))
+    # The result may be shared with coalesced requests; copy before adding to it
+    data = {**details, 'reasoning_in_progress': reasoning}
     
     return JsonResponse(data)
 
+@_offloaded
+def search(request):
+    """Label search for typeahead: ?q=<text>[&limit=n][&inferred=true]"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'No query provided'}, status=400)
+    inferred = request.GET.get('inferred') == 'true'
+    # The search index is built from the inferred graph itself, so a prebuilt
+    # hierarchy artifact does not make the inferred search ready
+    inferred, reasoning = _inferred_or_fallback(inferred)
+    limit = _int_param(request, 'limit', 20, maximum=getattr(settings, 'RGO_SEARCH_MAX_RESULTS', 100)) or 20
+
+    started = time.perf_counter()
+    results = graph_utils.search_nodes(query, inferred=inferred, limit=limit, reduce=_reduce_param(request))
+    return JsonResponse({
+        'query': query,
+        'results': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 3),
+        'inferred': inferred,
+        'reasoning_in_progress': reasoning,
+    })
+
+@_offloaded
+def nodes_details(request):
+    """Details of several nodes in one request: ?id=<uri>&id=<uri>..."""
+    node_ids = request.GET.getlist('id')
+    if not node_ids:
+        return JsonResponse({'error': 'No id provided'}, status=400)
+    batch_size = getattr(settings, 'RGO_DETAILS_BATCH_SIZE', 200)
+    if len(node_ids) > batch_size:
+        return JsonResponse({'error': f'At most {batch_size} ids per request'}, status=400)
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = _inferred_or_fallback(inferred)
+    return JsonResponse({
+        'nodes': get_nodes_details(node_ids, inferred=inferred),
+        'inferred': inferred,
+        'reasoning_in_progress': reasoning,
+    })
+
+@_offloaded
+def similarity_compare(request):
+    """Module overlap of two rituals: ?a=<uri>&b=<uri>[&inferred=true]"""
+    a, b = request.GET.get('a'), request.GET.get('b')
+    if not a or not b:
+        return JsonResponse({'error': 'Two rituals (a and b) are required'}, status=400)
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = _inferred_or_fallback(inferred)
+    data = graph_utils.compare_rituals(a, b, inferred=inferred)
+    if data is None:
+        return JsonResponse({'error': 'Both a and b must be rituals with parts'}, status=404)
+    return JsonResponse({**data, 'inferred': inferred, 'reasoning_in_progress': reasoning})
+
+@_offloaded
+def similarity_neighbors(request):
+    """Rituals sharing the most modules with one ritual: ?id=<uri>[&k=n][&inferred=true]"""
+    node_id = request.GET.get('id')
+    if not node_id:
+        return JsonResponse({'error': 'No id provided'}, status=400)
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = _inferred_or_fallback(inferred)
+    k = _int_param(request, 'k', 10, maximum=getattr(settings, 'RGO_SEARCH_MAX_RESULTS', 100)) or 10
+    data = graph_utils.similar_rituals(node_id, inferred=inferred, k=k)
+    if data is None:
+        return JsonResponse({'error': f"'{node_id}' is not a ritual with parts"}, status=404)
+    return JsonResponse({**data, 'inferred': inferred, 'reasoning_in_progress': reasoning})
+
+def _int_param(request, name, default, maximum=None):
+    try:
+        value = max(0, int(request.GET.get(name, default)))
+    except ValueError:
+        value = default
+    return min(value, maximum) if maximum is not None else value
+
+@_offloaded
+def tree_roots(request):
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = _inferred_or_fallback(inferred, graph_utils.hierarchy_artifact_name(True))
+    return JsonResponse({
+        'roots': get_navigation_roots(inferred=inferred, reduce=_reduce_param(request)),
+        'inferred': inferred,
+        'reasoning_in_progress': reasoning,
+    })
+
+@_offloaded
+def tree_children(request):
+    node_id = request.GET.get('id')
+    if not node_id:
+        return JsonResponse({'error': 'No id provided'}, status=400)
+    inferred = request.GET.get('inferred') == 'true'
+    inferred, reasoning = _inferred_or_fallback(inferred, graph_utils.hierarchy_artifact_name(True))
+
+    page_size = getattr(settings, 'RGO_TREE_PAGE_SIZE', 200)
+    offset = _int_param(request, 'offset', 0)
+    limit = _int_param(request, 'limit', page_size, maximum=page_size) or page_size
+
+    data = get_navigation_children(node_id, inferred=inferred, offset=offset, limit=limit,
+                                   reduce=_reduce_param(request))
+    data['inferred'] = inferred
+    data['reasoning_in_progress'] = reasoning
+    return JsonResponse(data)
+
+@_offloaded
+def tree_dag(request):
+    """Whole tree as {'nodes', 'roots'}, each node once, children referenced by position."""
+    mode = request.GET.get('mode', 'navigation')
+    if mode not in ('navigation', 'events'):
+        return JsonResponse({'error': f"Unknown mode '{mode}'"}, status=400)
+    if mode == 'events':
+        inferred, reasoning = _inferred_or_fallback(True, graph_utils.EVENTS_DAG_ARTIFACT_NAME)
+    else:
+        inferred = request.GET.get('inferred') == 'true'
+        inferred, reasoning = _inferred_or_fallback(inferred, graph_utils.hierarchy_artifact_name(True))
+    reduced = mode == 'navigation' and graph_utils.reduce_hierarchy(inferred, _reduce_param(request))
+
+    etag = f'"{mode}{"-reduced" if reduced else ""}-{graph_utils.graph_version(inferred=inferred)[:16]}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    if mode == 'events':
+        dag = graph_utils.get_event_navigation_dag(inferred=inferred)
+    else:
+        dag = graph_utils.get_navigation_dag(inferred=inferred, reduce=reduced)
+    response = JsonResponse({**dag, 'mode': mode, 'inferred': inferred, 'reasoning_in_progress': reasoning})
+    response.headers['ETag'] = etag
+    if reasoning:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+async def health(request):
+    # Runs on the event loop (nothing here blocks), so it answers while the executors are busy.
+    # Whatever started this process, the asserted graph gets loaded; health turns 200 once it is
+    graph_utils.start_asserted_load()
+    graphs = graph_status()
+    ready = graphs['asserted']['state'] == 'ready'
+    return JsonResponse({
+        'status': 'ok' if ready else 'unavailable',
+        'ready': ready,
+        'inferred_ready': graphs['inferred']['state'] == 'ready',
+        'graphs': graphs,
+    }, status=200 if ready else 503)
+
+async def metrics_view(request):
+    """Prometheus text exposition of the phase and request histograms."""
+    extra = ['# HELP rgo_graph_ready Whether the graph is loaded (1) or not (0).', '# TYPE rgo_graph_ready gauge']
+    load_seconds = ['# HELP rgo_graph_load_seconds Time the last load of the graph took.',
+                    '# TYPE rgo_graph_load_seconds gauge']
+    for name, status in graph_status().items():
+        extra.append(f'rgo_graph_ready{{graph="{name}"}} {int(status["state"] == "ready")}')
+        if status['load_seconds'] is not None:
+            load_seconds.append(f'rgo_graph_load_seconds{{graph="{name}"}} {status["load_seconds"]}')
+    return HttpResponse(metrics.render(extra + load_seconds), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Server-Timing headers, request/phase histograms for /metrics/ and opt-in cProfile captures
+    'navigator.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -121,3 +123,119 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Ritual Grammar navigator
+
+# Root ontologies, loaded into one named graph each (named by their owl:Ontology IRI).
+# Their owl:imports are resolved offline through the Protege catalog and loaded as
+# named graphs too; set RGO_RESOLVE_IMPORTS = False to load the roots only.
+RGO_ONTOLOGY_DIR = BASE_DIR / 'ontology'
+RGO_ONTOLOGIES = ['ritualgrammar.ttl', 'nepal-marriage-ontology.ttl']
+RGO_ONTOLOGY_CATALOG = RGO_ONTOLOGY_DIR / 'catalog-v001.xml'
+RGO_RESOLVE_IMPORTS = True
+# Reasoner for the inferred graph: 'hermit' (owlready2 + HermiT in a Java subprocess)
+# or 'rules' (pure-Python closure of the transitive / subproperty / inverse /
+# subclass axioms and the P2 chain; covers what the navigation pages need, in a
+# fraction of the time)
+RGO_INFERENCE_ENGINE = 'hermit'
+# Run HermiT over the imported vocabularies (CRM, CRMsci, PROV) as well as the roots
+RGO_REASON_OVER_IMPORTS = False
+
+# Inferred-graph snapshots and other derived artifacts, keyed by ontology hash
+RGO_CACHE_DIR = BASE_DIR / '.graph_cache'
+
+# Run the reasoner in a background thread when a server (runserver, WSGI or ASGI)
+# starts; inferred requests are served from the asserted graph (flagged
+# "reasoning in progress") until it is done
+RGO_BACKGROUND_REASONING = True
+
+# Show the inferred hierarchy as its transitive reduction (Hasse diagram), so
+# ancestors reached through transitive properties are not repeated as direct
+# parents; the dropped edges are returned as "inferred_parents". ?reduce=false
+# on the navigation pages and tree API shows the full closure.
+RGO_REDUCE_INFERRED_HIERARCHY = True
+
+# Maximum number of children returned per request by /api/tree/children/
+RGO_TREE_PAGE_SIZE = 200
+
+# Threads for the graph work of the async views (navigation pages, node details,
+# tree API, search). Identical requests in flight share one computation.
+RGO_ASYNC_WORKERS = 4
+# Threads that run SPARQL queries for the views, mostly waiting on the process
+# pool; separate, so slow queries never hold up the pages above
+RGO_SPARQL_ASYNC_WORKERS = 8
+
+# Maximum number of ids per /api/details/ request (the client prefetches a page of children at once)
+RGO_DETAILS_BATCH_SIZE = 200
+
+# Maximum number of hits returned by /search/
+RGO_SEARCH_MAX_RESULTS = 100
+
+# Requests sent with an "X-RGO-Profile: 1" header are run under cProfile and the
+# stats written to RGO_PROFILE_DIR (the response names the file in X-RGO-Profile-File).
+# Only for debugging: profiling slows the request down considerably.
+RGO_PROFILE_REQUESTS = DEBUG
+RGO_PROFILE_DIR = RGO_CACHE_DIR / 'profiles'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'navigator': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Preferred label languages, most preferred first ('' = untagged literals)
+RGO_LABEL_LANGUAGES = ['en', '']
+
+# Cache framework. The "sparql" cache holds SPARQL results keyed by normalized
+# query, mode and graph version; LocMemCache evicts least recently used entries
+# beyond MAX_ENTRIES. Point it at a FileBasedCache to share results between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sparql': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rgo-sparql',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 256, 'CULL_FREQUENCY': 4},
+    },
+}
+
+RGO_SPARQL_CACHE = 'sparql'
+# Results with more rows than this are not cached
+RGO_SPARQL_CACHE_MAX_ROWS = 5000
+
+# Curated queries served (pre-parsed) under /sparql/named/<name>/
+RGO_SPARQL_DIR = BASE_DIR / 'ontology' / 'sparql'
+
+# SPARQL console paging, and the hard cap on rows served for any query
+# (HTML pages, named-query JSON and streamed downloads)
+RGO_SPARQL_PAGE_SIZE = 100
+RGO_SPARQL_MAX_ROWS = 10000
+
+# SPARQL queries run in a process pool of this size with a per-query
+# wall-clock limit (seconds); a stuck worker is killed and replaced.
+# Set RGO_SPARQL_WORKERS = 0 to run queries in the request thread.
+RGO_SPARQL_WORKERS = 2
+RGO_SPARQL_TIMEOUT = 30
+# multiprocessing start method for the pool (None = platform default)
+RGO_SPARQL_START_METHOD = None
+
+# Where the asserted and inferred graphs live. 'memory' parses into every worker.
+# A persistent backend ('owlready2' SQLite quadstore, or an rdflib store plugin
+# such as 'Oxigraph' / 'BerkeleyDB') is built once per graph version under PATH
+# (e.g. by build_graph_artifacts) and then opened by all workers, sharing pages
+# through the OS page cache instead of holding a private copy each.
+RGO_GRAPH_STORE = {
+    'BACKEND': 'memory',
+    'PATH': RGO_CACHE_DIR / 'store',
+}
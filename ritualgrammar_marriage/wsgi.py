@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ritualgrammar_marriage.settings')
 
 application = get_wsgi_application()
+
+# Load the graphs (and run the reasoner) while the server comes up
+from navigator.graph_utils import start_background_loading  # noqa: E402
+
+start_background_loading()